@@ -0,0 +1,248 @@
+import io
+import json
+import zipfile
+from pathlib import PurePosixPath
+from typing import IO, Any, Dict, Generator, Optional
+from urllib.parse import urlparse
+
+from sqlite_utils.db import Database
+
+from .service import (
+    BatchWriter,
+    build_database,
+    get_store,
+    get_table,
+    save_accounts,
+)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def open_archive_file(archive: zipfile.ZipFile, file_name: str) -> IO[str]:
+    """
+    Open a file in a Mastodon account archive as text, without extracting it.
+    The file is looked up by name, so archives with a top level directory
+    work too.
+    """
+    for name in archive.namelist():
+        if PurePosixPath(name).name == file_name:
+            return io.TextIOWrapper(archive.open(name), encoding="utf-8")
+
+    raise ArchiveError(f"The archive doesn't contain {file_name}.")
+
+
+def iter_json_array(
+    file_obj: IO[str], key: str, chunk_size: int = 64 * 1024
+) -> Generator[Any, None, None]:
+    """
+    Stream the items of the array under key in a JSON document, reading the
+    file chunk_size characters at a time, so the whole document is never
+    loaded. The first occurrence of the key is used.
+    """
+    decoder = json.JSONDecoder()
+    marker = f'"{key}"'
+    buffer = ""
+
+    def read_more() -> bool:
+        nonlocal buffer
+        chunk = file_obj.read(chunk_size)
+        buffer += chunk
+        return bool(chunk)
+
+    # Find the key, keeping enough of the buffer to match a marker split
+    # across two chunks.
+    while True:
+        index = buffer.find(marker)
+        if index != -1:
+            buffer = buffer[index + len(marker) :]
+            break
+
+        buffer = buffer[-len(marker) :]
+        if not read_more():
+            return
+
+    # Skip the colon to the start of the array.
+    while True:
+        buffer = buffer.lstrip().lstrip(":").lstrip()
+        if buffer:
+            break
+        if not read_more():
+            raise ArchiveError(f"Unexpected end of file after {marker}.")
+
+    if not buffer.startswith("["):
+        raise ArchiveError(f"Expected {marker} to be an array.")
+    buffer = buffer[1:]
+
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        if not buffer:
+            if not read_more():
+                raise ArchiveError(f"Unexpected end of file in {marker}.")
+            continue
+
+        if buffer.startswith("]"):
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # The item is cut off at the end of the buffer.
+            if not read_more():
+                raise
+            continue
+
+        # A number at the end of the buffer may continue in the next chunk.
+        if end == len(buffer) and read_more():
+            continue
+
+        yield item
+        buffer = buffer[end:]
+
+
+def get_archive_actor(archive: zipfile.ZipFile) -> Dict[str, Any]:
+    """
+    Returns the ActivityPub actor of the archive's account.
+    """
+    with open_archive_file(archive, "actor.json") as file_obj:
+        return json.load(file_obj)
+
+
+def transformer_actor(actor: Dict[str, Any], account_id: str) -> Dict[str, Any]:
+    """
+    Transform an ActivityPub actor into a Mastodon account.
+    """
+    return {
+        "id": account_id,
+        "username": actor.get("preferredUsername"),
+        "url": actor.get("url"),
+        "display_name": actor.get("name"),
+        "note": actor.get("summary"),
+    }
+
+
+def get_status_id(status_url: str) -> str:
+    """
+    Returns the Mastodon status ID at the end of an ActivityPub object URL.
+    """
+    return urlparse(status_url).path.rstrip("/").split("/")[-1]
+
+
+def iter_archive_statuses(
+    archive: zipfile.ZipFile, account_id: str
+) -> Generator[Dict[str, Any], None, None]:
+    """
+    Stream the statuses created by the account from the archive's outbox.json,
+    as Mastodon statuses. Boosts of other statuses only reference the status
+    by URL, so they are skipped.
+    """
+    with open_archive_file(archive, "outbox.json") as file_obj:
+        for activity in iter_json_array(file_obj, "orderedItems"):
+            note = activity.get("object")
+            if activity.get("type") != "Create" or not isinstance(note, dict):
+                continue
+
+            yield {
+                "id": get_status_id(note["id"]),
+                "created_at": note.get("published"),
+                "content": note.get("content"),
+                "account": {"id": account_id},
+            }
+
+
+def iter_archive_status_urls(
+    archive: zipfile.ZipFile, file_name: str
+) -> Generator[str, None, None]:
+    """
+    Stream the status URLs from the archive's likes.json or bookmarks.json.
+    """
+    try:
+        file_obj = open_archive_file(archive, file_name)
+    except ArchiveError:
+        return
+
+    with file_obj:
+        for item in iter_json_array(file_obj, "orderedItems"):
+            if isinstance(item, str):
+                yield item
+            elif isinstance(item, dict) and "id" in item:
+                yield item["id"]
+
+
+def get_archive_account_id(db: Database, actor: Dict[str, Any]) -> str:
+    """
+    Returns the ID of the archive's account, found in the database by its URL.
+    The archive only identifies the account by URL.
+    """
+    build_database(db)
+    row = next(
+        get_table("accounts", db=db).rows_where(
+            "url = ?", [actor.get("url")], select="id", limit=1
+        ),
+        None,
+    )
+
+    if row is None:
+        raise ArchiveError(
+            f"The account {actor.get('url')} isn't in the database, import"
+            " its statuses from the API first or pass the account ID."
+        )
+
+    return str(row["id"])
+
+
+def import_archive(
+    db: Database,
+    archive_path: str,
+    account_id: Optional[str] = None,
+    batch_size: int = 10_000,
+) -> Dict[str, int]:
+    """
+    Import the statuses, favourites and bookmarks from a Mastodon account
+    archive. Returns the number of rows imported and skipped.
+
+    The archive identifies favourited and bookmarked statuses by URL, and only
+    statuses on the account's own server have a URL ending with their ID, so
+    only those already in the database are recorded.
+    """
+    counts = {"statuses": 0, "favourited": 0, "bookmarked": 0, "skipped": 0}
+
+    with zipfile.ZipFile(archive_path) as archive:
+        actor = get_archive_actor(archive)
+        if account_id is None:
+            account_id = get_archive_account_id(db, actor)
+
+        save_accounts(db, [transformer_actor(actor, account_id)])
+
+        # The statuses and activities go to the shards of a shard catalog.
+        store = get_store(db)
+        with BatchWriter(
+            lambda statuses: store.save_statuses(db, statuses),
+            batch_size=batch_size,
+            flush_interval=None,
+            db=db,
+        ) as writer:
+            for status in iter_archive_statuses(archive, account_id):
+                writer.add([status])
+                counts["statuses"] += 1
+
+        domain = urlparse(actor["id"]).netloc
+        for activity, file_name in (
+            ("favourited", "likes.json"),
+            ("bookmarked", "bookmarks.json"),
+        ):
+            status_ids = []
+            for status_url in iter_archive_status_urls(archive, file_name):
+                if urlparse(status_url).netloc == domain:
+                    status_ids.append(get_status_id(status_url))
+                else:
+                    counts["skipped"] += 1
+
+            saved = store.save_activity_status_ids(
+                db, account_id, activity, status_ids
+            )
+            counts[activity] += saved
+            counts["skipped"] += len(status_ids) - saved
+
+    return counts
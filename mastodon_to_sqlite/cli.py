@@ -1,3 +1,4 @@
+import datetime
 import json
 from pathlib import Path
 
@@ -8,10 +9,202 @@ from . import service
 
 @click.group()
 @click.version_option()
-def cli():
+@click.option(
+    "--pool-size",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Number of connections kept open to the Mastodon server",
+)
+@click.option(
+    "--max-connections",
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Most connections open to the Mastodon server at once, requests wait"
+        " for a free one [default: no limit]"
+    ),
+)
+@click.option(
+    "--compression/--no-compression",
+    default=True,
+    show_default=True,
+    help="Ask the Mastodon server for compressed responses",
+)
+@click.option(
+    "--connect-timeout",
+    type=click.FloatRange(min=0),
+    default=10.0,
+    show_default=True,
+    help="Seconds to wait for a connection to the Mastodon server",
+)
+@click.option(
+    "--read-timeout",
+    type=click.FloatRange(min=0),
+    default=60.0,
+    show_default=True,
+    help="Seconds to wait for the Mastodon server to respond",
+)
+@click.option(
+    "--http2",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Use HTTP/2, requires httpx[http2] to be installed",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=5_000,
+    show_default=True,
+    help="Number of rows written to the database at a time",
+)
+@click.option(
+    "--flush-interval",
+    type=click.FloatRange(min=0),
+    default=10.0,
+    show_default=True,
+    help="Seconds after which buffered rows are written regardless",
+)
+@click.option(
+    "--busy-timeout",
+    type=click.FloatRange(min=0),
+    default=30.0,
+    show_default=True,
+    help="Seconds a write waits for another process's write to finish",
+)
+@click.option(
+    "--wait-for-lock",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Wait for other commands using the database to finish first",
+)
+@click.option(
+    "--lock-timeout",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="Seconds to wait for the database lock, waits forever if not set",
+)
+@click.option(
+    "--write-attempts",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="Times a write is attempted while the database is locked",
+)
+@click.pass_context
+def cli(
+    ctx,
+    pool_size,
+    max_connections,
+    compression,
+    connect_timeout,
+    read_timeout,
+    http2,
+    batch_size,
+    flush_interval,
+    busy_timeout,
+    wait_for_lock,
+    lock_timeout,
+    write_attempts,
+):
     """
     Save data from Mastodon to a SQLite database.
     """
+    ctx.ensure_object(dict)
+    ctx.obj["writer"] = {
+        "batch_size": batch_size,
+        "flush_interval": flush_interval,
+        "attempts": write_attempts,
+    }
+    ctx.obj["database"] = {
+        "busy_timeout": busy_timeout,
+        "wait_for_lock": wait_for_lock,
+        "lock_timeout": lock_timeout,
+    }
+    ctx.obj["transport"] = {
+        "pool_maxsize": pool_size,
+        "max_connections": max_connections,
+        "compression": compression,
+        "connect_timeout": connect_timeout,
+        "read_timeout": read_timeout,
+        "http2": http2,
+    }
+
+
+def get_transport():
+    """
+    Returns the TransportConfig for the options passed to the cli group. It's
+    built here rather than in the group, so --help doesn't import requests.
+    """
+    from .client import TransportConfig
+
+    ctx = click.get_current_context()
+    return TransportConfig(**(ctx.obj or {}).get("transport", {}))
+
+
+def get_writer(db, save_func, **options):
+    """
+    Returns a BatchWriter for save_func using the batch options, overridden by
+    options, saving each batch in one transaction on the database.
+    """
+    ctx = click.get_current_context()
+    return service.BatchWriter(
+        save_func, db=db, **{**(ctx.obj or {}).get("writer", {}), **options}
+    )
+
+
+def open_database(db_path):
+    """
+    Open the database using the database options. With --wait-for-lock, the
+    database lock is held until the command finishes, and the time spent
+    waiting for it is reported.
+    """
+    ctx = click.get_current_context()
+    options = (ctx.obj or {}).get("database", {})
+
+    # ctx.meta is shared with the commands invoked by this one, which already
+    # hold the lock if this one does.
+    lock_key = f"mastodon_to_sqlite.lock:{db_path}"
+    if options.get("wait_for_lock") and lock_key not in ctx.meta:
+        try:
+            lock = ctx.with_resource(
+                service.DatabaseLock(db_path, timeout=options["lock_timeout"])
+            )
+        except TimeoutError as exc:
+            raise click.ClickException(str(exc))
+        ctx.meta[lock_key] = lock
+        click.echo(
+            f"Waited {lock.wait_time:.1f}s for the database lock.", err=True
+        )
+
+    return service.open_database(
+        db_path, busy_timeout=options.get("busy_timeout", 30.0)
+    )
+
+
+def get_client(auth):
+    """
+    Returns a MastodonClient using the transport options.
+    """
+    return service.get_client(auth, transport=get_transport())
+
+
+def echo_maintenance_report(report):
+    """
+    Print the report returned by service.maintain_database.
+    """
+    for step, seconds in report["timings"].items():
+        click.echo(f"{step}: {seconds:.2f}s")
+
+    click.echo(
+        f"Size: {report['size_before']:,} bytes before,"
+        f" {report['size_after']:,} bytes after."
+    )
+
+    for problem in report["problems"]:
+        click.echo(f"Integrity problem: {problem}", err=True)
 
 
 @cli.command()
@@ -68,7 +261,7 @@ def verify_auth(auth):
     """
     Verify the authentication to the Mastodon server.
     """
-    if service.verify_auth(auth) is True:
+    if service.verify_auth(auth, transport=get_transport()) is True:
         click.echo("Successfully authenticated with the Mastodon server.")
     else:
         click.echo(
@@ -91,27 +284,44 @@ def verify_auth(auth):
     default="auth.json",
     help="Path to auth.json token file",
 )
-def followers(db_path, auth):
+@click.option(
+    "--maintain",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the maintain command after importing",
+)
+def followers(db_path, auth, maintain):
     """
     Save followers for the authenticated user.
     """
-    db = service.open_database(db_path)
-    client = service.get_client(auth)
+    db = open_database(db_path)
+    client = get_client(auth)
 
     authenticated_account = service.get_authenticated_account(client)
     account_id = authenticated_account["id"]
 
     service.save_accounts(db, [authenticated_account])
 
-    with click.progressbar(
+    writer = get_writer(
+        db,
+        lambda followers: service.save_accounts(
+            db, followers, followed_id=account_id
+        ),
+    )
+
+    with writer, click.progressbar(
         service.get_followers(account_id, client),
         label="Importing followers",
         show_pos=True,
     ) as bar:
         for followers in bar:
-            service.save_accounts(db, followers, follower_id=account_id)
+            writer.add(followers)
             bar.pos = bar.pos + len(followers) - 1
 
+    if maintain:
+        echo_maintenance_report(service.maintain_database(db))
+
 
 @cli.command()
 @click.argument(
@@ -128,27 +338,44 @@ def followers(db_path, auth):
     default="auth.json",
     help="Path to auth.json token file",
 )
-def followings(db_path, auth):
+@click.option(
+    "--maintain",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the maintain command after importing",
+)
+def followings(db_path, auth, maintain):
     """
     Save followings for the authenticated user.
     """
-    db = service.open_database(db_path)
-    client = service.get_client(auth)
+    db = open_database(db_path)
+    client = get_client(auth)
 
     authenticated_account = service.get_authenticated_account(client)
     account_id = authenticated_account["id"]
 
     service.save_accounts(db, [authenticated_account])
 
-    with click.progressbar(
+    writer = get_writer(
+        db,
+        lambda followings: service.save_accounts(
+            db, followings, follower_id=account_id
+        ),
+    )
+
+    with writer, click.progressbar(
         service.get_followings(account_id, client),
         label="Importing followings",
         show_pos=True,
     ) as bar:
         for followers in bar:
-            service.save_accounts(db, followers, followed_id=account_id)
+            writer.add(followers)
             bar.pos = bar.pos + len(followers) - 1
 
+    if maintain:
+        echo_maintenance_report(service.maintain_database(db))
+
 
 @cli.command()
 @click.argument(
@@ -173,31 +400,78 @@ def followings(db_path, auth):
     default=False,
     help="Update existing statuses",
 )
-def statuses(db_path, auth, update):
+@click.option(
+    "--backfill",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Import the full history by paging time windows concurrently",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of time windows fetched concurrently with --backfill",
+)
+@click.option(
+    "--maintain",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the maintain command after importing",
+)
+def statuses(db_path, auth, update, backfill, workers, maintain):
     """
     Save statuses for the authenticated user.
     """
-    db = service.open_database(db_path)
-    client = service.get_client(auth)
+    if update and backfill:
+        raise click.UsageError("--update and --backfill can't be combined.")
+
+    db = open_database(db_path)
+    client = get_client(auth)
 
     authenticated_account = service.get_authenticated_account(client)
     account_id = authenticated_account["id"]
+    account_created_at = authenticated_account.get("created_at")
 
     service.save_accounts(db, [authenticated_account])
 
-    since_id = None
-    if update:
-        since_id = service.get_most_recent_status_id(db)
+    if backfill:
+        # Fall back to the first Mastodon release if the account doesn't say
+        # when it was created.
+        start = datetime.datetime(2016, 3, 16, tzinfo=datetime.timezone.utc)
+        if account_created_at is not None:
+            start = datetime.datetime.fromisoformat(
+                account_created_at.replace("Z", "+00:00")
+            )
 
-    with click.progressbar(
-        service.get_statuses(account_id, client, since_id=since_id),
+        pages = service.get_statuses_backfill(
+            account_id, client, start=start, workers=workers
+        )
+    else:
+        since_id = None
+        if update:
+            since_id = service.get_store(db).get_most_recent_status_id(db)
+
+        pages = service.get_statuses(account_id, client, since_id=since_id)
+
+    store = service.get_store(db)
+    writer = get_writer(db, lambda statuses: store.save_statuses(db, statuses))
+
+    with writer, click.progressbar(
+        pages,
         label="Importing statuses",
         show_pos=True,
     ) as bar:
         for statuses in bar:
-            service.save_statuses(db, statuses)
+            writer.add(statuses)
             bar.pos = bar.pos + len(statuses) - 1
 
+    if maintain:
+        echo_maintenance_report(service.maintain_database(db))
+
 
 @cli.command()
 @click.argument(
@@ -214,29 +488,46 @@ def statuses(db_path, auth, update):
     default="auth.json",
     help="Path to auth.json token file",
 )
-def bookmarks(db_path, auth):
+@click.option(
+    "--maintain",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the maintain command after importing",
+)
+def bookmarks(db_path, auth, maintain):
     """
     Save bookmarks for the authenticated user.
     """
-    db = service.open_database(db_path)
-    client = service.get_client(auth)
+    db = open_database(db_path)
+    client = get_client(auth)
 
     authenticated_account = service.get_authenticated_account(client)
     account_id = authenticated_account["id"]
 
     service.save_accounts(db, [authenticated_account])
 
-    with click.progressbar(
+    store = service.get_store(db)
+
+    def save_bookmarks(bookmarks):
+        accounts = [d["account"] for d in bookmarks]
+        service.save_accounts(db, accounts)
+        store.save_activities(db, account_id, "bookmarked", bookmarks)
+
+    writer = get_writer(db, save_bookmarks)
+
+    with writer, click.progressbar(
         service.get_bookmarks(client),
         label="Importing bookmarks",
         show_pos=True,
     ) as bar:
         for bookmarks in bar:
-            accounts = [d["account"] for d in bookmarks]
-            service.save_accounts(db, accounts)
-            service.save_activities(db, account_id, "bookmarked", bookmarks)
+            writer.add(bookmarks)
             bar.pos = bar.pos + len(bookmarks) - 1
 
+    if maintain:
+        echo_maintenance_report(service.maintain_database(db))
+
 
 @cli.command()
 @click.argument(
@@ -253,25 +544,667 @@ def bookmarks(db_path, auth):
     default="auth.json",
     help="Path to auth.json token file",
 )
-def favourites(db_path, auth):
+@click.option(
+    "--maintain",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the maintain command after importing",
+)
+def favourites(db_path, auth, maintain):
     """
     Save favourites for the authenticated user.
     """
-    db = service.open_database(db_path)
-    client = service.get_client(auth)
+    db = open_database(db_path)
+    client = get_client(auth)
 
     authenticated_account = service.get_authenticated_account(client)
     account_id = authenticated_account["id"]
 
     service.save_accounts(db, [authenticated_account])
 
-    with click.progressbar(
+    store = service.get_store(db)
+
+    def save_favourites(favourites):
+        accounts = [d["account"] for d in favourites]
+        service.save_accounts(db, accounts)
+        store.save_activities(db, account_id, "favourited", favourites)
+
+    writer = get_writer(db, save_favourites)
+
+    with writer, click.progressbar(
         service.get_favourites(client),
         label="Importing favourites",
         show_pos=True,
     ) as bar:
         for favourites in bar:
-            accounts = [d["account"] for d in favourites]
-            service.save_accounts(db, accounts)
-            service.save_activities(db, account_id, "favourited", favourites)
+            writer.add(favourites)
             bar.pos = bar.pos + len(favourites) - 1
+
+    if maintain:
+        echo_maintenance_report(service.maintain_database(db))
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "-a",
+    "--auth",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=True, exists=True
+    ),
+    default="auth.json",
+    help="Path to auth.json token file",
+)
+@click.option(
+    "--maintain",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the maintain command after importing",
+)
+def notifications(db_path, auth, maintain):
+    """
+    Save notifications for the authenticated user, only fetching the ones
+    newer than the last import.
+    """
+    db = open_database(db_path)
+    client = get_client(auth)
+
+    authenticated_account = service.get_authenticated_account(client)
+    account_id = authenticated_account["id"]
+
+    service.save_accounts(db, [authenticated_account])
+
+    min_id = service.get_import_cursor(db, account_id, "notifications")
+    store = service.get_store(db)
+
+    def save_page(notifications):
+        store.save_notifications(db, account_id, notifications)
+        service.save_import_cursor(
+            db, account_id, "notifications", notifications[-1]["id"]
+        )
+
+    # Pages are fetched oldest first and each is saved with the cursor in one
+    # transaction, so an interrupted import continues where it stopped.
+    writer = get_writer(db, save_page, batch_size=1)
+
+    with writer, click.progressbar(
+        service.get_notifications(client, min_id=min_id),
+        label="Importing notifications",
+        show_pos=True,
+    ) as bar:
+        for notifications in bar:
+            writer.add(notifications)
+            bar.pos = bar.pos + len(notifications) - 1
+
+    if maintain:
+        echo_maintenance_report(service.maintain_database(db))
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "-a",
+    "--auth",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=True, exists=True
+    ),
+    default="auth.json",
+    help="Path to auth.json token file",
+)
+@click.option(
+    "--maintain",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the maintain command after importing",
+)
+def home(db_path, auth, maintain):
+    """
+    Save the authenticated user's home timeline, only fetching the statuses
+    newer than the last import.
+    """
+    db = open_database(db_path)
+    client = get_client(auth)
+
+    authenticated_account = service.get_authenticated_account(client)
+    account_id = authenticated_account["id"]
+
+    service.save_accounts(db, [authenticated_account])
+
+    min_id = service.get_import_cursor(db, account_id, "home")
+    store = service.get_store(db)
+
+    def save_page(statuses):
+        store.save_home_timeline(db, account_id, statuses)
+        service.save_import_cursor(db, account_id, "home", statuses[-1]["id"])
+
+    # Pages are fetched oldest first and each is saved with the cursor in one
+    # transaction, so an interrupted import continues where it stopped.
+    writer = get_writer(db, save_page, batch_size=1)
+
+    with writer, click.progressbar(
+        service.get_home_timeline(client, min_id=min_id),
+        label="Importing home timeline statuses",
+        show_pos=True,
+    ) as bar:
+        for statuses in bar:
+            writer.add(statuses)
+            bar.pos = bar.pos + len(statuses) - 1
+
+    if maintain:
+        echo_maintenance_report(service.maintain_database(db))
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "-a",
+    "--auth",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=True, exists=True
+    ),
+    default="auth.json",
+    help="Path to auth.json token file",
+)
+@click.option(
+    "-s",
+    "--source",
+    "sources",
+    type=click.Choice(["statuses", "bookmarks", "favourites"]),
+    multiple=True,
+    default=("statuses", "bookmarks", "favourites"),
+    show_default=True,
+    help="Statuses to archive the threads of",
+)
+@click.option(
+    "--ttl",
+    type=click.FloatRange(min=0),
+    default=24.0,
+    show_default=True,
+    help="Skip threads fetched within this many hours",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of threads fetched concurrently",
+)
+@click.option(
+    "--maintain",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run the maintain command after importing",
+)
+def threads(db_path, auth, sources, ttl, workers, maintain):
+    """
+    Save the threads around statuses for the authenticated user.
+    """
+    db = open_database(db_path)
+    client = get_client(auth)
+
+    authenticated_account = service.get_authenticated_account(client)
+    account_id = authenticated_account["id"]
+
+    service.save_accounts(db, [authenticated_account])
+
+    store = service.get_store(db)
+    status_ids = store.get_thread_status_ids(
+        db, account_id, sources=sources, ttl=datetime.timedelta(hours=ttl)
+    )
+
+    with click.progressbar(
+        length=len(status_ids),
+        label="Importing threads",
+        show_pos=True,
+    ) as bar:
+        for status_id, context in service.get_status_contexts(
+            status_ids, client, max_workers=workers
+        ):
+            store.save_status_context(db, status_id, context)
+            bar.update(1)
+
+    if maintain:
+        echo_maintenance_report(service.maintain_database(db))
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=False, exists=True
+    ),
+    required=True,
+)
+@click.argument(
+    "output_dir",
+    type=click.Path(file_okay=False, dir_okay=True, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "-f",
+    "--format",
+    "export_format",
+    type=click.Choice(["parquet", "arrow", "ndjson", "csv"]),
+    default=None,
+    help="Export format, defaults to parquet if pyarrow is installed",
+)
+@click.option(
+    "-t",
+    "--table",
+    "tables",
+    type=click.Choice(
+        ["statuses", "accounts", "following", "status_activities"]
+    ),
+    multiple=True,
+    help="Tables to export, defaults to all",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=10_000,
+    show_default=True,
+    help="Number of rows read and written at a time",
+)
+@click.option(
+    "--since",
+    default=None,
+    help=(
+        "Only export statuses and followings after this ISO-8601 timestamp,"
+        " in UTC unless it has an offset"
+    ),
+)
+def export(db_path, output_dir, export_format, tables, chunk_size, since):
+    """
+    Export the database tables to Parquet, Arrow, NDJSON or CSV files.
+    """
+    from . import export as exporter
+
+    if export_format is None:
+        export_format = exporter.get_default_format()
+
+    if export_format in ("parquet", "arrow") and not exporter.has_pyarrow():
+        raise click.ClickException(
+            f"Exporting to {export_format} requires pyarrow to be installed."
+        )
+
+    since_epoch = None
+    if since is not None:
+        try:
+            since_epoch = exporter.get_since_epoch(since)
+        except ValueError:
+            raise click.BadParameter(
+                f"{since} isn't an ISO-8601 timestamp.", param_hint="--since"
+            )
+
+    db = open_database(db_path)
+
+    counts = exporter.export_database(
+        db,
+        Path(output_dir),
+        export_format,
+        tables=list(tables) or None,
+        chunk_size=chunk_size,
+        since_epoch=since_epoch,
+    )
+
+    for table_name, count in counts.items():
+        click.echo(f"Exported {count} rows from {table_name}.")
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=False, exists=True
+    ),
+    required=True,
+)
+def rebuild_aggregates(db_path):
+    """
+    Recompute the aggregate tables from scratch.
+    """
+    db = open_database(db_path)
+    service.rebuild_aggregates(db)
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=False, exists=True
+    ),
+    required=True,
+)
+@click.option(
+    "--period",
+    type=click.Choice(["year", "month"]),
+    default="year",
+    show_default=True,
+    help="Period of the statuses in each shard",
+)
+@click.option(
+    "--freeze",
+    "freeze_keys",
+    multiple=True,
+    help="Vacuum a shard and make it read-only, e.g. 2022",
+)
+@click.option(
+    "--thaw",
+    "thaw_keys",
+    multiple=True,
+    help="Make a frozen shard writable again",
+)
+def shard(db_path, period, freeze_keys, thaw_keys):
+    """
+    Split the statuses and activities into shard files by when the statuses
+    were created. The database becomes the catalog of the shards.
+    """
+    from . import shards
+
+    db = open_database(db_path)
+
+    try:
+        shards.create_catalog(db, period)
+
+        for key in thaw_keys:
+            shards.thaw_shard(db, key)
+
+        for key, counts in shards.split_database(db).items():
+            click.echo(
+                f"Moved {counts['statuses']} statuses and"
+                f" {counts['status_activities']} activities to the {key}"
+                " shard."
+            )
+
+        for key in freeze_keys:
+            echo_maintenance_report(shards.freeze_shard(db, key))
+            click.echo(f"Froze the {key} shard.")
+    except shards.ShardError as exc:
+        raise click.ClickException(str(exc))
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=False, exists=True
+    ),
+    required=True,
+)
+@click.option(
+    "-a",
+    "--auth",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=True, exists=True
+    ),
+    default="auth.json",
+    help="Path to auth.json token file",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(1, 40),
+    default=40,
+    show_default=True,
+    help="Accounts fetched per request",
+)
+def backfill_accounts(db_path, auth, batch_size):
+    """
+    Save the accounts referenced by statuses, followings and activities that
+    aren't saved yet.
+    """
+    db = open_database(db_path)
+    client = get_client(auth)
+
+    counts = service.backfill_accounts(db, client, batch_size=batch_size)
+
+    click.echo(
+        f"Saved {counts['saved']} of {counts['missing']} missing accounts."
+    )
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=False, exists=True
+    ),
+    required=True,
+)
+@click.option(
+    "-t",
+    "--tokenize",
+    type=click.Choice(["unicode61", "porter", "trigram"]),
+    default="unicode61",
+    show_default=True,
+    help="Full-text search tokenizer",
+)
+def rebuild_fts(db_path, tokenize):
+    """
+    Rebuild the statuses full-text search index with the given tokenizer.
+    """
+    db = open_database(db_path)
+    service.build_database(db)
+    service.rebuild_statuses_fts(db, tokenize=tokenize)
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=False, exists=True
+    ),
+    required=True,
+)
+@click.option(
+    "--codec",
+    type=click.Choice(["zlib", "zstd", "none"]),
+    default="zlib",
+    show_default=True,
+    help="Compression of the statuses' content, zstd requires zstandard",
+)
+@click.option(
+    "--level",
+    type=int,
+    default=None,
+    help="Compression level, the codec's default if not set",
+)
+def compress(db_path, codec, level):
+    """
+    Store the statuses' content compressed, including statuses saved later.
+    """
+    from .compression import has_zstandard
+
+    if codec == "zstd" and not has_zstandard():
+        raise click.ClickException(
+            "The zstd codec requires zstandard, install it with:"
+            " pip install 'mastodon-to-sqlite[zstd]'"
+        )
+
+    from . import shards
+
+    db = open_database(db_path)
+    try:
+        sizes = service.set_content_codec(
+            db, None if codec == "none" else codec, level=level
+        )
+    except shards.ShardError as exc:
+        raise click.ClickException(str(exc))
+
+    click.echo(
+        f"Status content is {sizes['size_after']} bytes, it was"
+        f" {sizes['size_before']} bytes. Run maintain to shrink the file."
+    )
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=False, exists=True
+    ),
+    required=True,
+)
+@click.option(
+    "--fts-merge",
+    "fts_merge_pages",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Incrementally merge this many FTS pages instead of a full optimize",
+)
+@click.option(
+    "--full-vacuum",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Run a full VACUUM, enabling incremental vacuums for old databases",
+)
+def maintain(db_path, fts_merge_pages, full_vacuum):
+    """
+    Analyze, optimize, vacuum and check the integrity of the database.
+    """
+    db = open_database(db_path)
+
+    report = service.maintain_database(
+        db, fts_merge_pages=fts_merge_pages, full_vacuum=full_vacuum
+    )
+    echo_maintenance_report(report)
+
+    if report["problems"]:
+        raise click.ClickException("The integrity check found problems.")
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.argument(
+    "archive_path",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=False, exists=True
+    ),
+    required=True,
+)
+@click.option(
+    "--account-id",
+    default=None,
+    help="ID of the archive's account, defaults to looking it up by URL",
+)
+def import_archive(db_path, archive_path, account_id):
+    """
+    Import statuses, favourites and bookmarks from a Mastodon archive zip.
+    """
+    from . import archive
+
+    db = open_database(db_path)
+    writer_options = (click.get_current_context().obj or {}).get("writer", {})
+
+    try:
+        counts = archive.import_archive(
+            db,
+            archive_path,
+            account_id=account_id,
+            batch_size=writer_options.get("batch_size", 10_000),
+        )
+    except archive.ArchiveError as exc:
+        raise click.ClickException(str(exc))
+
+    click.echo(
+        f"Imported {counts['statuses']} statuses,"
+        f" {counts['favourited']} favourites and"
+        f" {counts['bookmarked']} bookmarks."
+    )
+    if counts["skipped"]:
+        click.echo(
+            f"Skipped {counts['skipped']} favourites and bookmarks of"
+            " statuses that aren't in the database."
+        )
+
+
+@cli.command()
+@click.argument(
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "-a",
+    "--auth",
+    type=click.Path(
+        file_okay=True, dir_okay=False, allow_dash=True, exists=True
+    ),
+    default="auth.json",
+    help="Path to auth.json token file",
+)
+@click.option(
+    "--plan",
+    "dry_run",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Only print what would be synced",
+)
+@click.pass_context
+def sync(ctx, db_path, auth, dry_run):
+    """
+    Save statuses, followers and followings that changed since the last sync.
+    """
+    db = open_database(db_path)
+    client = get_client(auth)
+
+    authenticated_account = service.get_authenticated_account(client)
+    account_id = authenticated_account["id"]
+
+    plan = service.get_sync_plan(db, authenticated_account)
+
+    total_requests = 1 + sum(step.estimated_requests for step in plan)
+    for step in plan:
+        click.echo(
+            f"{step.endpoint}: {step.action} ({step.reason}),"
+            f" ~{step.estimated_requests} requests"
+        )
+    click.echo(
+        f"Total: ~{total_requests} requests, ~"
+        f"{service.estimate_rate_limit_wait(total_requests)}s waiting for"
+        " the rate limit."
+    )
+
+    if dry_run:
+        return
+
+    commands = {
+        "statuses": statuses,
+        "followers": followers,
+        "followings": followings,
+    }
+
+    for step in plan:
+        if step.action == "skip":
+            continue
+
+        kwargs = {"db_path": db_path, "auth": auth}
+        if step.endpoint == "statuses":
+            kwargs["update"] = step.action == "incremental"
+
+        ctx.invoke(commands[step.endpoint], **kwargs)
+        service.save_sync_state(
+            db, account_id, step.endpoint, step.remote_count
+        )
@@ -1,9 +1,23 @@
 import datetime
+import threading
+from dataclasses import dataclass
 from time import sleep
-from typing import Dict, Generator, Optional, Tuple
+from typing import Generator, List, Mapping, Optional, Tuple, Union
 
 from requests import PreparedRequest, Request, Response, Session
+from requests.adapters import BaseAdapter, HTTPAdapter
 from requests.auth import AuthBase
+from requests.structures import CaseInsensitiveDict
+
+# Connection-specific headers, which HTTP/2 forbids, h2 rejects requests that
+# send them.
+HOP_BY_HOP_HEADERS = (
+    "connection",
+    "keep-alive",
+    "proxy-connection",
+    "transfer-encoding",
+    "upgrade",
+)
 
 
 def get_utc_now() -> datetime.datetime:
@@ -22,23 +36,208 @@ class MastodonAuth(AuthBase):
         return r
 
 
+@dataclass
+class TransportConfig:
+    """
+    How the MastodonClient connects to the Mastodon server.
+    """
+
+    # The number of connections kept open to the Mastodon server, raise it
+    # when the client is used from more threads than that. With
+    # max_connections set, at most that many connections are open at once and
+    # requests wait for a free one.
+    pool_maxsize: int = 10
+    max_connections: Optional[int] = None
+    compression: bool = True
+    connect_timeout: Optional[float] = 10.0
+    read_timeout: Optional[float] = 60.0
+    http2: bool = False
+
+    @property
+    def timeout(self) -> Tuple[Optional[float], Optional[float]]:
+        return self.connect_timeout, self.read_timeout
+
+    @property
+    def accept_encoding(self) -> str:
+        if self.compression is False:
+            return "identity"
+
+        # urllib3 only decodes Brotli when one of the brotli packages is
+        # installed, so only ask for it then.
+        try:
+            import brotli  # noqa: F401
+        except ImportError:
+            try:
+                import brotlicffi  # noqa: F401
+            except ImportError:
+                return "gzip, deflate"
+
+        return "gzip, deflate, br"
+
+
+class HTTP2Adapter(BaseAdapter):
+    """
+    A requests transport adapter that sends requests with httpx, which
+    supports HTTP/2. Requires httpx to be installed with its http2 extra.
+    """
+
+    def __init__(self, config: TransportConfig):
+        super().__init__()
+
+        try:
+            import httpx
+        except ImportError as exc:
+            raise ImportError(
+                "HTTP/2 requires httpx, install it with:"
+                " pip install 'mastodon-to-sqlite[http2]'"
+            ) from exc
+
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.pool_maxsize,
+            ),
+        )
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        import httpx
+
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+            timeout = httpx.Timeout(
+                None, connect=connect_timeout, read=read_timeout
+            )
+
+        headers = {
+            name: value
+            for name, value in request.headers.items()
+            if name.lower() not in HOP_BY_HOP_HEADERS
+        }
+
+        http_response = self.client.request(
+            method=request.method,
+            url=request.url,
+            headers=headers,
+            content=request.body,
+            timeout=timeout,
+        )
+
+        response = Response()
+        response.status_code = http_response.status_code
+        response.headers = CaseInsensitiveDict(http_response.headers)
+        response.url = request.url
+        response.request = request
+        response.reason = http_response.reason_phrase
+        response.encoding = http_response.encoding
+        # httpx has already decompressed the content.
+        response._content = http_response.content
+        response.headers.pop("Content-Encoding", None)
+        return response
+
+    def close(self):
+        self.client.close()
+
+
 class MastodonClient:
-    def __init__(self, domain: str, access_token: str):
-        self.api_url = f"https://{domain}/api/v1"
+    def __init__(
+        self,
+        domain: str,
+        access_token: str,
+        transport: Optional[TransportConfig] = None,
+        scheme: str = "https",
+    ):
+        self.api_url = f"{scheme}://{domain}/api/v1"
+        self.transport = transport or TransportConfig()
 
         self.session = Session()
         self.session.auth = MastodonAuth(access_token)
 
+        adapter: BaseAdapter
+        if self.transport.http2:
+            adapter = HTTP2Adapter(self.transport)
+        else:
+            # The client only talks to one host, so one pool. urllib3 only
+            # caps a pool's connections when it blocks, and then keeps as
+            # many open as the cap.
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=(
+                    self.transport.max_connections
+                    or self.transport.pool_maxsize
+                ),
+                pool_block=self.transport.max_connections is not None,
+            )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.session.headers["Accept-Encoding"] = self.transport.accept_encoding
+        # HTTP/2 connections are always persistent.
+        if not self.transport.http2:
+            self.session.headers["Connection"] = "keep-alive"
+
         self.session.headers[
             "User-Agent"
         ] = "mastodon-to-sqlite (+https://github.com/myles/mastodon-to-sqlite)"
 
+        # The rate limit is shared by every thread using this client, so the
+        # last reported budget is guarded by a lock.
+        self._rate_limit_lock = threading.Lock()
+        self.rate_limit_remaining: Optional[int] = None
+        self.rate_limit_reset_at: Optional[datetime.datetime] = None
+
+    def update_rate_limit(self, response: Response):
+        """
+        Record the rate limit budget reported by the Mastodon server.
+        See docs: <https://docs.joinmastodon.org/api/rate-limits/>
+        """
+        if "X-RateLimit-Remaining" not in response.headers:
+            return
+
+        with self._rate_limit_lock:
+            self.rate_limit_remaining = int(
+                response.headers["X-RateLimit-Remaining"]
+            )
+            if "X-RateLimit-Reset" in response.headers:
+                self.rate_limit_reset_at = datetime.datetime.fromisoformat(
+                    response.headers["X-RateLimit-Reset"]
+                )
+
+    def wait_for_rate_limit(self):
+        """
+        If the Mastodon server is reporting rate limit remaining of one more
+        call, then sleep until we are free to call again. The lock is held while
+        sleeping so other threads queue up behind the wait.
+        """
+        with self._rate_limit_lock:
+            if self.rate_limit_remaining is None:
+                return
+
+            if (
+                self.rate_limit_remaining > 1
+                or self.rate_limit_reset_at is None
+            ):
+                # Reserve a call from the budget, so concurrent requests made
+                # before the next response arrives don't overshoot it.
+                self.rate_limit_remaining -= 1
+                return
+
+            # A reset time that has already passed, or clocks that disagree,
+            # mustn't stall every thread behind the lock.
+            wait_seconds = (
+                self.rate_limit_reset_at - get_utc_now()
+            ).total_seconds()
+            if wait_seconds > 0:
+                sleep(wait_seconds)
+            self.rate_limit_remaining = None
+            self.rate_limit_reset_at = None
+
     def request(
         self,
         method: str,
         path: str,
-        params: Optional[Dict[str, str]] = None,
-        timeout: Optional[Tuple[int, int]] = None,
+        params: Optional[Mapping[str, Union[str, List[str]]]] = None,
+        timeout: Optional[Tuple[Optional[float], Optional[float]]] = None,
         **kwargs,
     ) -> Tuple[PreparedRequest, Response]:
         full_url = f"{self.api_url}/{path}"
@@ -47,7 +246,13 @@ class MastodonClient:
             method=method.upper(), url=full_url, params=params, **kwargs
         )
         prepped = self.session.prepare_request(request)
+
+        if timeout is None:
+            timeout = self.transport.timeout
+
+        self.wait_for_rate_limit()
         response = self.session.send(prepped, timeout=timeout)
+        self.update_rate_limit(response)
 
         return prepped, response
 
@@ -55,10 +260,16 @@ class MastodonClient:
         self,
         method: str,
         path: str,
-        params: Optional[Dict[str, str]] = None,
-        timeout: Optional[Tuple[int, int]] = None,
+        params: Optional[Mapping[str, Union[str, List[str]]]] = None,
+        timeout: Optional[Tuple[Optional[float], Optional[float]]] = None,
+        rel: str = "next",
         **kwargs,
     ) -> Generator[Tuple[PreparedRequest, Response], None, None]:
+        """
+        Request every page, following the Link header. With rel="next" pages
+        are requested from newest to oldest, with rel="prev" and a min_id
+        param from oldest to newest.
+        """
         next_path: Optional[str] = path
 
         while next_path is not None:
@@ -74,20 +285,11 @@ class MastodonClient:
             # If there is no Link header or the Link header does not contain a
             # next link, then we know there isn't pagination this endpoint or
             # there is no next page.
-            if "Link" not in response.headers or "next" not in response.links:
+            if "Link" not in response.headers or rel not in response.links:
                 next_path = None
                 continue
 
-            # If the Mastodon server is reporting rate limit remaining of one
-            # more call, then we should sleep until we are free to call again.
-            # See docs: <https://docs.joinmastodon.org/api/rate-limits/>
-            if response.headers.get("X-RateLimit-Remaining") == "1":
-                reset_at = datetime.datetime.fromisoformat(
-                    response.headers["X-RateLimit-Reset"]
-                )
-                sleep((reset_at - get_utc_now()).seconds)
-
-            next_url = response.links["next"]["url"]
+            next_url = response.links[rel]["url"]
             next_path = next_url.replace(f"{self.api_url}/", "")
 
             # Resetting the params because the next_path will provide the query
@@ -125,6 +327,23 @@ class MastodonClient:
             "GET", f"accounts/{account_id}/statuses", params=params
         )
 
+    def accounts_statuses_page(
+        self,
+        account_id: str,
+        max_id: Optional[str] = None,
+        since_id: Optional[str] = None,
+    ) -> Tuple[PreparedRequest, Response]:
+        params = {"limit": "40"}
+
+        if max_id is not None:
+            params["max_id"] = max_id
+        if since_id is not None:
+            params["since_id"] = since_id
+
+        return self.request(
+            "GET", f"accounts/{account_id}/statuses", params=params
+        )
+
     def bookmarks(
         self,
     ) -> Generator[Tuple[PreparedRequest, Response], None, None]:
@@ -138,3 +357,36 @@ class MastodonClient:
         return self.request_paginated(
             "GET", "favourites", params={"limit": "40"}
         )
+
+    def statuses_context(
+        self, status_id: str
+    ) -> Tuple[PreparedRequest, Response]:
+        return self.request("GET", f"statuses/{status_id}/context")
+
+    def notifications(
+        self, min_id: str = "0"
+    ) -> Generator[Tuple[PreparedRequest, Response], None, None]:
+        return self.request_paginated(
+            "GET",
+            "notifications",
+            params={"limit": "80", "min_id": min_id},
+            rel="prev",
+        )
+
+    def timelines_home(
+        self, min_id: str = "0"
+    ) -> Generator[Tuple[PreparedRequest, Response], None, None]:
+        return self.request_paginated(
+            "GET",
+            "timelines/home",
+            params={"limit": "40", "min_id": min_id},
+            rel="prev",
+        )
+
+    def accounts(
+        self, account_ids: List[str]
+    ) -> Tuple[PreparedRequest, Response]:
+        return self.request("GET", "accounts", params={"id[]": account_ids})
+
+    def account(self, account_id: str) -> Tuple[PreparedRequest, Response]:
+        return self.request("GET", f"accounts/{account_id}")
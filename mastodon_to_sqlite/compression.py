@@ -0,0 +1,163 @@
+import base64
+import sqlite3
+import threading
+import zlib
+from functools import lru_cache
+from typing import Iterable, Optional, Union
+
+CODECS = ("zlib", "zstd")
+
+# Compressed content is told apart by its first bytes, zstd frames start with
+# this magic number, zlib streams with 0x78.
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# The settings storing the codec, see service.set_content_codec.
+CODEC_SETTINGS = (
+    "content_codec",
+    "content_codec_level",
+    "content_zstd_dictionary",
+)
+
+
+def has_zstandard() -> bool:
+    """
+    Returns True if zstandard is installed, so the zstd codec can be used.
+    """
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+
+    return True
+
+
+def train_dictionary(samples: Iterable[bytes], size: int = 112_640) -> bytes:
+    """
+    Train a zstd dictionary of up to size bytes on sample contents. Statuses
+    are short and share a lot of markup, which a dictionary compresses far
+    better than each status on its own.
+    """
+    import zstandard
+
+    return zstandard.train_dictionary(size, list(samples)).as_bytes()
+
+
+class ContentCodec:
+    """
+    Compresses status content with zlib, or zstd with an optional trained
+    dictionary, and decompresses content compressed with either. Content that
+    isn't compressed is returned as it is.
+    """
+
+    def __init__(
+        self,
+        codec: str = "zlib",
+        level: Optional[int] = None,
+        dictionary: Optional[bytes] = None,
+    ):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}.")
+
+        self.codec = codec
+        self.level = level
+        self.dictionary = dictionary
+
+        # zstd compressors can't be shared between threads.
+        self.local = threading.local()
+
+    def get_zstd_dictionary(self):
+        import zstandard
+
+        if self.dictionary is None:
+            return None
+        return zstandard.ZstdCompressionDict(self.dictionary)
+
+    def get_compressor(self):
+        if not hasattr(self.local, "compressor"):
+            import zstandard
+
+            self.local.compressor = zstandard.ZstdCompressor(
+                level=self.level or 3, dict_data=self.get_zstd_dictionary()
+            )
+        return self.local.compressor
+
+    def get_decompressor(self):
+        if not hasattr(self.local, "decompressor"):
+            import zstandard
+
+            self.local.decompressor = zstandard.ZstdDecompressor(
+                dict_data=self.get_zstd_dictionary()
+            )
+        return self.local.decompressor
+
+    def compress(self, content: Optional[str]) -> Optional[bytes]:
+        if content is None:
+            return None
+
+        data = content.encode("utf-8")
+        if self.codec == "zstd":
+            return self.get_compressor().compress(data)
+
+        return zlib.compress(data, -1 if self.level is None else self.level)
+
+    def decompress(self, value: Union[str, bytes, None]) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+
+        if value.startswith(ZSTD_MAGIC):
+            data = self.get_decompressor().decompress(value)
+        else:
+            data = zlib.decompress(value)
+
+        return data.decode("utf-8")
+
+
+@lru_cache(maxsize=8)
+def get_content_codec(
+    codec: str, level: Optional[int], dictionary: Optional[str]
+) -> ContentCodec:
+    """
+    Returns the codec for the settings, reusing it for as long as the settings
+    don't change, so a trained dictionary is only loaded once.
+    """
+    return ContentCodec(
+        codec,
+        level=level,
+        dictionary=None if dictionary is None else base64.b64decode(dictionary),
+    )
+
+
+def read_content_codec(conn: sqlite3.Connection) -> Optional[ContentCodec]:
+    """
+    Returns the codec the database's status content is compressed with, or
+    None if it isn't compressed.
+    """
+    try:
+        settings = dict(
+            conn.execute(
+                "SELECT key, value FROM settings WHERE key IN (?, ?, ?)",
+                CODEC_SETTINGS,
+            ).fetchall()
+        )
+    except sqlite3.OperationalError:
+        # The database has no settings table.
+        return None
+
+    if not settings.get("content_codec"):
+        return None
+
+    level = settings.get("content_codec_level")
+    return get_content_codec(
+        settings["content_codec"],
+        None if level is None else int(level),
+        settings.get("content_zstd_dictionary"),
+    )
+
+
+def register_decompress(conn: sqlite3.Connection):
+    """
+    Register the decompress() SQL function on the connection, which returns
+    the text of compressed content, and any other value as it is.
+    """
+    codec = read_content_codec(conn) or ContentCodec()
+    conn.create_function("decompress", 1, codec.decompress, deterministic=True)
@@ -0,0 +1,12 @@
+from datasette import hookimpl
+
+from .compression import register_decompress
+
+
+@hookimpl
+def prepare_connection(conn):
+    """
+    Register the decompress() SQL function on Datasette's connections, so the
+    statuses_decoded view shows the statuses' content as text.
+    """
+    register_decompress(conn)
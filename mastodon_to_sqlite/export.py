@@ -0,0 +1,240 @@
+import csv
+import datetime
+import json
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Optional, Tuple
+
+from sqlite_utils.db import Database
+
+from . import shards
+from .compression import register_decompress
+from .service import get_table
+
+EXPORT_TABLES = ("statuses", "accounts", "following", "status_activities")
+
+# The indexed epoch columns used to only export rows changed after a
+# watermark. Tables without a timestamp column are always exported in full.
+WATERMARK_COLUMNS = {
+    "statuses": "created_at_epoch",
+    "following": "first_seen_epoch",
+}
+
+EXPORT_FORMATS = ("parquet", "arrow", "ndjson", "csv")
+
+# The content of statuses may be stored compressed.
+COLUMN_EXPRESSIONS = {("statuses", "content"): "decompress([content])"}
+
+
+def has_pyarrow() -> bool:
+    """
+    Returns True if pyarrow is installed, so the columnar formats can be used.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+
+    return True
+
+
+def get_default_format() -> str:
+    """
+    Returns Parquet if pyarrow is installed, otherwise NDJSON.
+    """
+    return "parquet" if has_pyarrow() else "ndjson"
+
+
+def get_since_epoch(since: str) -> int:
+    """
+    Returns the Unix epoch in seconds of an ISO-8601 timestamp or date, which
+    is taken to be in UTC unless it has an offset.
+    """
+    timestamp = datetime.datetime.fromisoformat(since.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+
+    return int(timestamp.timestamp())
+
+
+def iter_table_chunks(
+    db: Database,
+    table_name: str,
+    chunk_size: int = 10_000,
+    since_epoch: Optional[int] = None,
+) -> Generator[Tuple[List[str], List[Tuple[Any, ...]]], None, None]:
+    """
+    Stream the rows of a table in chunks of chunk_size from a single cursor,
+    so only one chunk is held in memory at a time. With since_epoch, only the
+    rows after it are streamed.
+    """
+    select = ", ".join(
+        COLUMN_EXPRESSIONS.get((table_name, column), f"[{column}]")
+        + f" AS [{column}]"
+        for column in get_table(table_name, db=db).columns_dict
+    )
+    sql = f"SELECT {select} FROM [{table_name}]"
+    register_decompress(db.conn)
+    params: List[Any] = []
+
+    watermark_column = WATERMARK_COLUMNS.get(table_name)
+    if since_epoch is not None and watermark_column is not None:
+        sql += f" WHERE [{watermark_column}] > ?"
+        params.append(since_epoch)
+
+    cursor = db.conn.execute(sql, params)
+    columns = [description[0] for description in cursor.description]
+
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield columns, rows
+
+
+def iter_export_chunks(
+    db: Database,
+    table_name: str,
+    chunk_size: int = 10_000,
+    since_epoch: Optional[int] = None,
+) -> Generator[Tuple[List[str], List[Tuple[Any, ...]]], None, None]:
+    """
+    Stream the rows of a table like iter_table_chunks, followed by its rows in
+    each shard if the database is a shard catalog and the table is sharded.
+    """
+    yield from iter_table_chunks(
+        db, table_name, chunk_size=chunk_size, since_epoch=since_epoch
+    )
+
+    if table_name not in shards.SHARDED_TABLES:
+        return
+
+    for shard_db in shards.iter_shard_databases(db):
+        yield from iter_table_chunks(
+            shard_db, table_name, chunk_size=chunk_size, since_epoch=since_epoch
+        )
+
+
+def get_arrow_schema(db: Database, table_name: str):
+    """
+    Returns the pyarrow schema for a table from its declared column types, so
+    every chunk is written with the same schema.
+    """
+    import pyarrow as pa
+
+    arrow_types = {
+        "INTEGER": pa.int64(),
+        "FLOAT": pa.float64(),
+        "REAL": pa.float64(),
+        "BLOB": pa.binary(),
+    }
+
+    return pa.schema(
+        [
+            (column.name, arrow_types.get(column.type.upper(), pa.string()))
+            for column in get_table(table_name, db=db).columns
+        ]
+    )
+
+
+def export_table(
+    db: Database,
+    table_name: str,
+    output_path: Path,
+    export_format: str,
+    chunk_size: int = 10_000,
+    since_epoch: Optional[int] = None,
+) -> int:
+    """
+    Export a table, and its rows in the shards of a catalog, to a file in the
+    given format, returning the number of rows written.
+    """
+    chunks = iter_export_chunks(
+        db, table_name, chunk_size=chunk_size, since_epoch=since_epoch
+    )
+
+    if export_format in ("parquet", "arrow"):
+        return _export_arrow(db, table_name, output_path, export_format, chunks)
+
+    count = 0
+    with output_path.open("w", newline="") as file_obj:
+        csv_writer = None
+        for columns, rows in chunks:
+            if export_format == "csv":
+                if csv_writer is None:
+                    csv_writer = csv.writer(file_obj)
+                    csv_writer.writerow(columns)
+                csv_writer.writerows(rows)
+            else:
+                for row in rows:
+                    file_obj.write(
+                        json.dumps(dict(zip(columns, row)), default=str)
+                    )
+                    file_obj.write("\n")
+            count += len(rows)
+
+    return count
+
+
+def _export_arrow(
+    db: Database,
+    table_name: str,
+    output_path: Path,
+    export_format: str,
+    chunks: Generator[Tuple[List[str], List[Tuple[Any, ...]]], None, None],
+) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = get_arrow_schema(db, table_name)
+
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(str(output_path), schema)
+    else:
+        writer = pa.ipc.new_file(str(output_path), schema)
+
+    count = 0
+    try:
+        # The columns are selected in the same order as the schema.
+        for _, rows in chunks:
+            arrays = [
+                pa.array([row[index] for row in rows], type=field.type)
+                for index, field in enumerate(schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    finally:
+        writer.close()
+
+    return count
+
+
+def export_database(
+    db: Database,
+    output_dir: Path,
+    export_format: str,
+    tables: Optional[List[str]] = None,
+    chunk_size: int = 10_000,
+    since_epoch: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Export the tables to files named after them in output_dir, returning the
+    number of rows written per table.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    counts = {}
+    for table_name in tables or EXPORT_TABLES:
+        if get_table(table_name, db=db).exists() is False:
+            continue
+
+        output_path = output_dir / f"{table_name}.{export_format}"
+        counts[table_name] = export_table(
+            db,
+            table_name,
+            output_path,
+            export_format,
+            chunk_size=chunk_size,
+            since_epoch=since_epoch,
+        )
+
+    return counts
@@ -0,0 +1,336 @@
+import datetime
+import sqlite3
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Generic, List, Optional, Tuple, TypeVar, Union
+from urllib.parse import quote
+
+from .compression import register_decompress
+
+# The largest SQLite integer, used as the open end of a keyset.
+MAX_ID = 2**63 - 1
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class Account:
+    id: int
+    username: Optional[str]
+    url: Optional[str]
+    display_name: Optional[str]
+    note: Optional[str]
+
+
+@dataclass(frozen=True)
+class Status:
+    id: int
+    account_id: Optional[int]
+    content: Optional[str]
+    content_text: Optional[str]
+    created_at: Optional[str]
+    created_at_epoch: Optional[int]
+    replies_count: Optional[int]
+    favourites_count: Optional[int]
+    reblogs_count: Optional[int]
+
+
+@dataclass(frozen=True)
+class Page(Generic[T]):
+    """
+    A page of results, and the cursor to pass back for the next page, or None
+    if this is the last page.
+    """
+
+    items: List[T]
+    cursor: Optional[Tuple]
+
+
+# The content of statuses may be stored compressed.
+COLUMN_EXPRESSIONS = {
+    "statuses.content": "decompress(statuses.content)",
+}
+
+
+def get_select(model: type, table_name: str) -> str:
+    columns = (f"{table_name}.{field.name}" for field in fields(model))
+    return ", ".join(
+        COLUMN_EXPRESSIONS.get(column, column) for column in columns
+    )
+
+
+# The SQL text is constant per query, so the connection's statement cache
+# prepares each query once.
+TIMELINE_SQL = f"""
+SELECT {get_select(Status, "statuses")}
+FROM statuses
+WHERE created_at_epoch >= :start
+  AND created_at_epoch < :end
+  AND (created_at_epoch, id) < (:before_epoch, :before_id)
+ORDER BY created_at_epoch DESC, id DESC
+LIMIT :limit
+"""
+
+STATUSES_BY_ACCOUNT_SQL = f"""
+SELECT {get_select(Status, "statuses")}
+FROM statuses
+WHERE account_id = :account_id AND id < :before_id
+ORDER BY id DESC
+LIMIT :limit
+"""
+
+# Ordering matches by relevance would sort every match before returning the
+# first page, so matches are returned newest first, which FTS5 produces from
+# its index directly.
+SEARCH_SQL = f"""
+SELECT {get_select(Status, "statuses")}
+FROM statuses_fts
+JOIN statuses ON statuses.rowid = statuses_fts.rowid
+WHERE statuses_fts MATCH :query AND statuses_fts.rowid < :before_id
+ORDER BY statuses_fts.rowid DESC
+LIMIT :limit
+"""
+
+FOLLOWERS_AS_OF_SQL = f"""
+SELECT {get_select(Account, "accounts")}
+FROM following
+JOIN accounts ON accounts.id = following.follower_id
+WHERE following.followed_id = :account_id
+  AND following.follower_id > :after_id
+  AND following.first_seen_epoch <= :as_of
+ORDER BY following.follower_id
+LIMIT :limit
+"""
+
+FAVOURITES_BY_AUTHOR_SQL = f"""
+SELECT {get_select(Status, "statuses")}
+FROM statuses
+JOIN status_activities ON status_activities.status_id = statuses.id
+WHERE statuses.account_id = :author_id
+  AND statuses.id < :before_id
+  AND status_activities.account_id = :account_id
+  AND status_activities.activity = 'favourited'
+ORDER BY statuses.id DESC
+LIMIT :limit
+"""
+
+
+def get_sharded_search_sql(schemas: List[str]) -> str:
+    """
+    SEARCH_SQL over a shard catalog and its attached shards. MATCH can't be
+    used on the view combining their indexes, so each index is searched for a
+    page and the pages are merged.
+    """
+    searches = " UNION ALL ".join(
+        f"""
+SELECT * FROM (
+    SELECT {get_select(Status, "statuses")}
+    FROM [{schema}].statuses_fts AS statuses_fts
+    JOIN [{schema}].statuses AS statuses
+      ON statuses.rowid = statuses_fts.rowid
+    WHERE statuses_fts MATCH :query AND statuses_fts.rowid < :before_id
+    ORDER BY statuses_fts.rowid DESC
+    LIMIT :limit
+)"""
+        for schema in schemas
+    )
+    return f"{searches}\nORDER BY id DESC\nLIMIT :limit\n"
+
+
+def is_shard_catalog(conn: sqlite3.Connection) -> bool:
+    """
+    Returns True if the database is a shard catalog.
+    """
+    try:
+        row = conn.execute(
+            "SELECT value FROM settings WHERE key = 'shard_period'"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # The database has no settings table.
+        return False
+
+    return row is not None
+
+
+def to_epoch(value: Union[datetime.datetime, int]) -> int:
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+class ArchiveReader:
+    """
+    Read-only access to a mastodon-to-sqlite database for the common queries.
+    Results are paged by keyset: pass a page's cursor to get the next page.
+    The shards of a shard catalog are attached, see shards.attach_shards.
+    """
+
+    def __init__(
+        self,
+        db_file_path: Union[str, Path],
+        mmap_size: int = 256 * 1024 * 1024,
+        cached_statements: int = 128,
+    ):
+        path = quote(str(Path(db_file_path).absolute()))
+        self.conn = sqlite3.connect(
+            f"file:{path}?mode=ro",
+            uri=True,
+            cached_statements=cached_statements,
+        )
+
+        # The shards' views are TEMP views, which query_only would refuse.
+        self.search_sql = SEARCH_SQL
+        if is_shard_catalog(self.conn):
+            self.search_sql = get_sharded_search_sql(self._attach_shards())
+
+        self.conn.execute("PRAGMA query_only = 1")
+        self.conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        register_decompress(self.conn)
+
+    def _attach_shards(self) -> List[str]:
+        from sqlite_utils.db import Database
+
+        from . import shards
+
+        try:
+            return shards.attach_shards(Database(self.conn))
+        except shards.ShardError:
+            self.conn.close()
+            raise
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self) -> "ArchiveReader":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def timeline(
+        self,
+        start: Union[datetime.datetime, int],
+        end: Union[datetime.datetime, int],
+        limit: int = 50,
+        cursor: Optional[Tuple] = None,
+    ) -> Page[Status]:
+        """
+        Statuses created from start up to end, newest first.
+        """
+        end_epoch = to_epoch(end)
+        before_epoch, before_id = cursor or (end_epoch, MAX_ID)
+
+        rows = self.conn.execute(
+            TIMELINE_SQL,
+            {
+                "start": to_epoch(start),
+                "end": end_epoch,
+                "before_epoch": before_epoch,
+                "before_id": before_id,
+                "limit": limit,
+            },
+        ).fetchall()
+
+        statuses = [Status(*row) for row in rows]
+        return Page(
+            statuses,
+            self._next_cursor(
+                statuses, limit, lambda s: (s.created_at_epoch, s.id)
+            ),
+        )
+
+    def statuses_by_account(
+        self, account_id: int, limit: int = 50, cursor: Optional[Tuple] = None
+    ) -> Page[Status]:
+        """
+        The account's statuses, newest first.
+        """
+        (before_id,) = cursor or (MAX_ID,)
+
+        rows = self.conn.execute(
+            STATUSES_BY_ACCOUNT_SQL,
+            {"account_id": account_id, "before_id": before_id, "limit": limit},
+        ).fetchall()
+
+        statuses = [Status(*row) for row in rows]
+        return Page(
+            statuses, self._next_cursor(statuses, limit, lambda s: (s.id,))
+        )
+
+    def search(
+        self, query: str, limit: int = 50, cursor: Optional[Tuple] = None
+    ) -> Page[Status]:
+        """
+        Statuses matching the full-text search query, newest first.
+        """
+        (before_id,) = cursor or (MAX_ID,)
+
+        rows = self.conn.execute(
+            self.search_sql,
+            {"query": query, "before_id": before_id, "limit": limit},
+        ).fetchall()
+
+        statuses = [Status(*row) for row in rows]
+        return Page(
+            statuses, self._next_cursor(statuses, limit, lambda s: (s.id,))
+        )
+
+    def followers_as_of(
+        self,
+        account_id: int,
+        as_of: Union[datetime.datetime, int],
+        limit: int = 50,
+        cursor: Optional[Tuple] = None,
+    ) -> Page[Account]:
+        """
+        The accounts that were first seen following the account by as_of.
+        """
+        (after_id,) = cursor or (-MAX_ID,)
+
+        rows = self.conn.execute(
+            FOLLOWERS_AS_OF_SQL,
+            {
+                "account_id": account_id,
+                "after_id": after_id,
+                "as_of": to_epoch(as_of),
+                "limit": limit,
+            },
+        ).fetchall()
+
+        accounts = [Account(*row) for row in rows]
+        return Page(
+            accounts, self._next_cursor(accounts, limit, lambda a: (a.id,))
+        )
+
+    def favourites_by_author(
+        self,
+        account_id: int,
+        author_id: int,
+        limit: int = 50,
+        cursor: Optional[Tuple] = None,
+    ) -> Page[Status]:
+        """
+        The author's statuses favourited by the account, newest first.
+        """
+        (before_id,) = cursor or (MAX_ID,)
+
+        rows = self.conn.execute(
+            FAVOURITES_BY_AUTHOR_SQL,
+            {
+                "account_id": account_id,
+                "author_id": author_id,
+                "before_id": before_id,
+                "limit": limit,
+            },
+        ).fetchall()
+
+        statuses = [Status(*row) for row in rows]
+        return Page(
+            statuses, self._next_cursor(statuses, limit, lambda s: (s.id,))
+        )
+
+    @staticmethod
+    def _next_cursor(items, limit, key) -> Optional[Tuple]:
+        if len(items) < limit:
+            return None
+        return key(items[-1])
@@ -1,27 +1,257 @@
+from __future__ import annotations
+
+import base64
+import contextlib
 import datetime
 import json
+import math
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import Any, Dict, Generator, List, Optional
+from types import ModuleType
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .compression import (
+    CODEC_SETTINGS,
+    ContentCodec,
+    read_content_codec,
+    register_decompress,
+    train_dictionary,
+)
+
+# sqlite_utils and requests (through the client) are slow to import, so they
+# are only imported by the functions that use them. This keeps the CLI quick
+# to start for --help and commands that don't need them.
+if TYPE_CHECKING:
+    from sqlite_utils.db import Database, Table
+
+    from .client import MastodonClient, TransportConfig
+
+# Saves statuses to a database, save_statuses or the shards module's.
+SaveStatusesFunc = Callable[["Database", List[Dict[str, Any]]], Any]
+
+
+def open_database(db_file_path, busy_timeout: float = 30.0) -> Database:
+    """
+    Open the Mastodon SQLite database. A write waits up to busy_timeout seconds
+    for another connection's write to finish before failing with "database is
+    locked". The decompress() SQL function is registered for reading
+    compressed status content.
+    """
+    from sqlite_utils.db import Database
+
+    db = Database(db_file_path)
+    db.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+    register_decompress(db.conn)
+
+    # auto_vacuum can only be changed without a full VACUUM before the first
+    # table is created, so new databases are set up for incremental vacuums.
+    if not db.table_names():
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    return db
+
+
+class DatabaseLock:
+    """
+    An advisory lock on a file next to the database, so processes writing to
+    the same database take turns instead of competing for SQLite's write lock.
+    The time spent waiting for the lock is kept in wait_time. Only available
+    where fcntl is, which excludes Windows.
+    """
+
+    def __init__(
+        self,
+        db_file_path,
+        timeout: Optional[float] = None,
+        poll_interval: float = 0.1,
+    ):
+        self.lock_file_path = f"{db_file_path}.lock"
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+        self.file_obj: Optional[IO[str]] = None
+        self.wait_time = 0.0
+
+    def acquire(self):
+        import fcntl
+
+        self.file_obj = open(self.lock_file_path, "a")
+        started_at = time.monotonic()
+
+        while True:
+            try:
+                fcntl.flock(self.file_obj, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if (
+                    self.timeout is not None
+                    and time.monotonic() - started_at >= self.timeout
+                ):
+                    self.file_obj.close()
+                    self.file_obj = None
+                    raise TimeoutError(
+                        f"Timed out after {self.timeout}s waiting for"
+                        f" {self.lock_file_path}."
+                    )
+                time.sleep(self.poll_interval)
+
+        self.wait_time = time.monotonic() - started_at
+
+    def release(self):
+        import fcntl
+
+        if self.file_obj is not None:
+            fcntl.flock(self.file_obj, fcntl.LOCK_UN)
+            self.file_obj.close()
+            self.file_obj = None
+
+    def __enter__(self) -> "DatabaseLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def is_locked_error(exc: Exception) -> bool:
+    """
+    Returns True if the exception is SQLite giving up on waiting for another
+    connection's lock.
+    """
+    return isinstance(exc, sqlite3.OperationalError) and (
+        "locked" in str(exc) or "busy" in str(exc)
+    )
 
-from sqlite_utils.db import Database, Table
 
-from .client import MastodonClient
+def retry_on_locked(
+    func: Callable[[], Any], attempts: int = 3, delay: float = 1.0
+) -> Any:
+    """
+    Call func, calling it again after delay seconds (doubling each time) if the
+    database stayed locked past its busy timeout, up to attempts times in all.
+    Only what func wrote in its failed transaction is rolled back, so func
+    must do all of its writes in one transaction, like BatchWriter's saves with
+    a db, for the retry to redo them.
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except sqlite3.OperationalError as exc:
+            if not is_locked_error(exc) or attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2**attempt)
 
 
-def open_database(db_file_path) -> Database:
+@contextlib.contextmanager
+def write_transaction(db: Database) -> Generator[Database, None, None]:
     """
-    Open the Mastodon SQLite database.
+    Run the block in a transaction that takes the write lock as it begins
+    (BEGIN IMMEDIATE), so it waits up to the busy timeout for another
+    connection's write. A deferred BEGIN takes it at the first write, and
+    when another connection is writing, SQLite fails that upgrade from a read
+    at once, without waiting. Inside another transaction the block is a
+    savepoint.
     """
-    return Database(db_file_path)
+    if db.conn.in_transaction:
+        with db.atomic():
+            yield db
+        return
+
+    db.conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.conn.rollback()
+        raise
+
+    try:
+        db.conn.execute("COMMIT")
+    except BaseException:
+        db.conn.rollback()
+        raise
 
 
 def get_table(table_name: str, db: Database) -> Table:
     """
     Returns a Table from a given db Database object.
     """
+    from sqlite_utils.db import Table
+
     return Table(db=db, name=table_name)
 
 
+def get_setting(db: Database, key: str) -> Optional[str]:
+    """
+    Returns a setting stored in the database, or None if it isn't set.
+    """
+    table = get_table("settings", db=db)
+    if table.exists() is False:
+        return None
+
+    row = next(table.rows_where("key = ?", [key], select="value"), None)
+    return None if row is None else row["value"]
+
+
+def set_setting(db: Database, key: str, value: str):
+    """
+    Store a setting in the database.
+    """
+    get_table("settings", db=db).upsert({"key": key, "value": value}, pk="key")
+
+
+def get_store(db: Database) -> ModuleType:
+    """
+    Returns the module that saves statuses and activities to the database, the
+    shards module if it's a shard catalog, otherwise this one. Both have the
+    same save functions.
+    """
+    if get_setting(db, "shard_period") is None:
+        return sys.modules[__name__]
+
+    from . import shards
+
+    return shards
+
+
+# The statuses with their content decompressed, for reading the database with
+# tools like Datasette. Querying it needs the decompress() SQL function, which
+# open_database and the Datasette plugin register.
+STATUSES_DECODED_SQL = """
+SELECT
+    id,
+    account_id,
+    decompress(content) AS content,
+    content_text,
+    created_at,
+    created_at_epoch,
+    replies_count,
+    favourites_count,
+    reblogs_count
+FROM statuses
+"""
+
+
 def build_database(db: Database):
     """
     Build the Mastodon SQLite database structure.
@@ -47,19 +277,28 @@ def build_database(db: Database):
 
     if following_table.exists() is False:
         following_table.create(
-            columns={"followed_id": int, "follower_id": int, "first_seen": str},
+            columns={
+                "followed_id": int,
+                "follower_id": int,
+                "first_seen": str,
+                "first_seen_epoch": int,
+            },
             pk=("followed_id", "follower_id"),
             foreign_keys=(
                 ("followed_id", "accounts", "id"),
                 ("follower_id", "accounts", "id"),
             ),
         )
+    elif "first_seen_epoch" not in following_table.columns_dict:
+        migrate_following_first_seen_epoch(db)
 
     following_indexes = {tuple(i.columns) for i in following_table.indexes}
     if ("followed_id",) not in following_indexes:
         following_table.create_index(["followed_id"])
     if ("follower_id",) not in following_indexes:
         following_table.create_index(["follower_id"])
+    if ("first_seen_epoch",) not in following_indexes:
+        following_table.create_index(["first_seen_epoch"])
 
     if statuses_table.exists() is False:
         statuses_table.create(
@@ -67,7 +306,9 @@ def build_database(db: Database):
                 "id": int,
                 "account_id": int,
                 "content": str,
+                "content_text": str,
                 "created_at": str,
+                "created_at_epoch": int,
                 "replies_count": int,
                 "favourites_count": int,
                 "reblogs_count": int,
@@ -75,11 +316,19 @@ def build_database(db: Database):
             pk="id",
             foreign_keys=(("account_id", "accounts", "id"),),
         )
-        statuses_table.enable_fts(["content"], create_triggers=True)
+        statuses_table.enable_fts(["content_text"], create_triggers=True)
+    else:
+        statuses_columns = statuses_table.columns_dict
+        if "content_text" not in statuses_columns:
+            migrate_statuses_content_text(db)
+        if "created_at_epoch" not in statuses_columns:
+            migrate_statuses_created_at_epoch(db)
 
     statuses_indexes = {tuple(i.columns) for i in statuses_table.indexes}
     if ("account_id",) not in statuses_indexes:
         statuses_table.create_index(["account_id"])
+    if ("created_at_epoch",) not in statuses_indexes:
+        statuses_table.create_index(["created_at_epoch"])
 
     status_activities_table = get_table("status_activities", db=db)
     if status_activities_table.exists() is False:
@@ -104,8 +353,369 @@ def build_database(db: Database):
     if ("status_id", "activity") not in status_activities_indexes:
         status_activities_table.create_index(["status_id", "activity"])
 
+    status_context_table = get_table("status_context", db=db)
+    if status_context_table.exists() is False:
+        status_context_table.create(
+            columns={
+                "status_id": int,
+                "related_status_id": int,
+                "relation": str,  # ancestor, descendant
+            },
+            pk=("status_id", "related_status_id"),
+            foreign_keys=(
+                ("status_id", "statuses", "id"),
+                ("related_status_id", "statuses", "id"),
+            ),
+        )
+
+    status_context_indexes = {
+        tuple(i.columns) for i in status_context_table.indexes
+    }
+    if ("related_status_id",) not in status_context_indexes:
+        status_context_table.create_index(["related_status_id"])
+
+    status_context_fetches_table = get_table("status_context_fetches", db=db)
+    if status_context_fetches_table.exists() is False:
+        status_context_fetches_table.create(
+            columns={"status_id": int, "fetched_at": str},
+            pk="status_id",
+        )
+
+    statuses_per_day_table = get_table("statuses_per_day", db=db)
+    if statuses_per_day_table.exists() is False:
+        statuses_per_day_table.create(
+            columns={"account_id": int, "date": str, "count": int},
+            pk=("account_id", "date"),
+        )
+
+    activities_per_month_table = get_table("activities_per_month", db=db)
+    if activities_per_month_table.exists() is False:
+        activities_per_month_table.create(
+            columns={
+                "account_id": int,
+                "activity": str,  # favourited, bookmarked
+                "author_id": int,
+                "month": str,
+                "count": int,
+            },
+            pk=("account_id", "activity", "author_id", "month"),
+        )
+
+    followers_per_day_table = get_table("followers_per_day", db=db)
+    if followers_per_day_table.exists() is False:
+        followers_per_day_table.create(
+            columns={"account_id": int, "date": str, "gained": int},
+            pk=("account_id", "date"),
+        )
+
+    sync_state_table = get_table("sync_state", db=db)
+    if sync_state_table.exists() is False:
+        sync_state_table.create(
+            columns={
+                "account_id": int,
+                "endpoint": str,
+                "remote_count": int,
+                "synced_at": str,
+            },
+            pk=("account_id", "endpoint"),
+        )
+
+    notifications_table = get_table("notifications", db=db)
+    if notifications_table.exists() is False:
+        notifications_table.create(
+            columns={
+                "id": int,
+                "recipient_id": int,
+                "type": str,  # mention, reblog, favourite, follow, ...
+                "created_at": str,
+                "created_at_epoch": int,
+                "account_id": int,
+                "status_id": int,
+            },
+            pk="id",
+            foreign_keys=(
+                ("recipient_id", "accounts", "id"),
+                ("account_id", "accounts", "id"),
+                ("status_id", "statuses", "id"),
+            ),
+        )
+        notifications_table.create_index(["recipient_id", "created_at_epoch"])
+
+    home_timeline_table = get_table("home_timeline", db=db)
+    if home_timeline_table.exists() is False:
+        home_timeline_table.create(
+            columns={"account_id": int, "status_id": int},
+            pk=("account_id", "status_id"),
+            foreign_keys=(
+                ("account_id", "accounts", "id"),
+                ("status_id", "statuses", "id"),
+            ),
+        )
+
+    import_cursors_table = get_table("import_cursors", db=db)
+    if import_cursors_table.exists() is False:
+        import_cursors_table.create(
+            columns={
+                "account_id": int,
+                "endpoint": str,
+                "min_id": str,
+                "updated_at": str,
+            },
+            pk=("account_id", "endpoint"),
+        )
+
+    if "statuses_decoded" not in db.view_names():
+        db.create_view("statuses_decoded", STATUSES_DECODED_SQL)
+
+    if get_setting(db, "following_direction") is None:
+        migrate_following_direction(db)
+
+
+def get_fts_tokenize(db: Database, table_name: str) -> Optional[str]:
+    """
+    Returns the tokenizer the table's full-text search index was created with.
+    """
+    fts_table = get_table(f"{table_name}_fts", db=db)
+    if fts_table.exists() is False:
+        return None
+
+    match = re.search(r"tokenize\s*=\s*'([^']*)'", fts_table.schema)
+    if match is None:
+        return None
+
+    return match.group(1)
+
+
+def rebuild_statuses_fts(db: Database, tokenize: Optional[str] = None):
+    """
+    Rebuild the statuses full-text search index over the plain text content,
+    with the given tokenizer.
+    """
+    statuses_table = get_table("statuses", db=db)
+    statuses_table.enable_fts(
+        ["content_text"],
+        create_triggers=True,
+        tokenize=tokenize,
+        replace=True,
+    )
+
+
+def migrate_statuses_content_text(db: Database, chunk_size: int = 1_000):
+    """
+    Add the plain text content column to an existing statuses table, then
+    move its full-text search index from the HTML content to the plain text.
+    """
+    statuses_table = get_table("statuses", db=db)
+    tokenize = get_fts_tokenize(db, "statuses")
+
+    # Drop the old index first, so backfilling doesn't fire its triggers.
+    if get_table("statuses_fts", db=db).exists():
+        statuses_table.disable_fts()
+
+    statuses_table.add_column("content_text", str)
+
+    last_rowid = 0
+    while True:
+        rows = db.execute(
+            "SELECT rowid, content FROM statuses WHERE rowid > ?"
+            " ORDER BY rowid LIMIT ?",
+            [last_rowid, chunk_size],
+        ).fetchall()
+        if not rows:
+            break
+
+        with write_transaction(db):
+            db.conn.executemany(
+                "UPDATE statuses SET content_text = ? WHERE rowid = ?",
+                [(get_plain_text(content), rowid) for rowid, content in rows],
+            )
+        last_rowid = rows[-1][0]
+
+    rebuild_statuses_fts(db, tokenize=tokenize)
+
+
+# The rows per statement of the save functions' upserts. sqlite-utils lowers
+# it to keep each statement under 999 bound parameters.
+UPSERT_BATCH_SIZE = 1_000
+
+
+class BatchWriter:
+    """
+    Buffers records and saves them with save_func once batch_size records are
+    buffered or flush_interval seconds have passed since the last save,
+    whichever comes first. Used as a context manager, the remaining records are
+    saved on exit. With a db, each save is one transaction on it. A save that
+    fails because the database is locked is retried up to attempts times in
+    all.
+    """
+
+    def __init__(
+        self,
+        save_func: Callable[[List[Dict[str, Any]]], Any],
+        batch_size: int = 5_000,
+        flush_interval: Optional[float] = 10.0,
+        attempts: int = 1,
+        db: Optional[Database] = None,
+    ):
+        self.save_func = save_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.attempts = attempts
+        self.db = db
+
+        self.records: List[Dict[str, Any]] = []
+        self.last_flushed_at = time.monotonic()
+
+    def add(self, records: Iterable[Dict[str, Any]]):
+        self.records.extend(records)
+
+        if len(self.records) >= self.batch_size or (
+            self.flush_interval is not None
+            and time.monotonic() - self.last_flushed_at >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        records, self.records = self.records, []
+        self.last_flushed_at = time.monotonic()
+
+        if not records:
+            return
 
-def get_client(auth_file_path: str) -> MastodonClient:
+        retry_on_locked(lambda: self.save(records), attempts=self.attempts)
+
+    def save(self, records: List[Dict[str, Any]]):
+        # The save functions transform the records in place, so each attempt
+        # saves copies.
+        copies = [dict(record) for record in records]
+
+        if self.db is None:
+            self.save_func(copies)
+            return
+
+        with write_transaction(self.db):
+            self.save_func(copies)
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+def get_epoch(timestamp: Optional[str]) -> Optional[int]:
+    """
+    Returns the Unix epoch in seconds of an ISO-8601 timestamp.
+    """
+    if not timestamp:
+        return None
+
+    return int(
+        datetime.datetime.fromisoformat(
+            timestamp.replace("Z", "+00:00")
+        ).timestamp()
+    )
+
+
+def backfill_column(
+    db: Database, table_name: str, column: str, expression: str, chunk_size: int
+):
+    """
+    Set a column to a SQL expression for every row of a table, a chunk of
+    rows per transaction so the write lock is released in between.
+    """
+    last_rowid = db.execute(
+        f"SELECT min(rowid) - 1 FROM [{table_name}]"
+    ).fetchone()[0]
+    if last_rowid is None:
+        return
+
+    while True:
+        rowids = [
+            row[0]
+            for row in db.execute(
+                f"SELECT rowid FROM [{table_name}]"
+                " WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                [last_rowid, chunk_size],
+            ).fetchall()
+        ]
+        if not rowids:
+            break
+
+        with write_transaction(db):
+            db.conn.execute(
+                f"UPDATE [{table_name}] SET [{column}] = {expression}"
+                " WHERE rowid BETWEEN ? AND ?",
+                [rowids[0], rowids[-1]],
+            )
+        last_rowid = rowids[-1]
+
+
+def migrate_statuses_created_at_epoch(db: Database, chunk_size: int = 10_000):
+    """
+    Add the integer created at column to an existing statuses table. Statuses
+    without a created at timestamp fall back to the one in their snowflake ID.
+    """
+    get_table("statuses", db=db).add_column("created_at_epoch", int)
+    backfill_column(
+        db,
+        "statuses",
+        "created_at_epoch",
+        "coalesce(CAST(strftime('%s', created_at) AS INTEGER),"
+        " (id >> 16) / 1000)",
+        chunk_size,
+    )
+
+
+def migrate_following_first_seen_epoch(db: Database, chunk_size: int = 10_000):
+    """
+    Add the integer first seen column to an existing following table.
+    """
+    get_table("following", db=db).add_column("first_seen_epoch", int)
+    backfill_column(
+        db,
+        "following",
+        "first_seen_epoch",
+        "CAST(strftime('%s', first_seen) AS INTEGER)",
+        chunk_size,
+    )
+
+
+def migrate_following_direction(db: Database):
+    """
+    Swap the followed and follower IDs of the following table's rows. The
+    followers and followings commands used to save every relationship the
+    wrong way round, so the rows saved before this migration are inverted.
+    """
+    get_table("settings", db=db).create(
+        {"key": str, "value": str}, pk="key", if_not_exists=True
+    )
+    columns = list(get_table("following", db=db).columns_dict)
+    swapped = {"followed_id": "follower_id", "follower_id": "followed_id"}
+
+    with write_transaction(db):
+        db.conn.execute(
+            "CREATE TEMP TABLE following_inverted AS SELECT * FROM following"
+        )
+        db.conn.execute("DELETE FROM following")
+        db.conn.execute(
+            f"INSERT INTO following ({', '.join(columns)})"
+            f" SELECT {', '.join(swapped.get(c, c) for c in columns)}"
+            " FROM temp.following_inverted"
+        )
+        db.conn.execute("DROP TABLE temp.following_inverted")
+
+        db.conn.execute("DELETE FROM followers_per_day")
+        db.conn.execute(REBUILD_FOLLOWERS_PER_DAY_SQL)
+        db.conn.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            ["following_direction", "followed,follower"],
+        )
+
+
+def get_client(
+    auth_file_path: str, transport: Optional[TransportConfig] = None
+) -> MastodonClient:
     """
     Returns a fully authenticated MastodonClient.
     """
@@ -114,17 +724,22 @@ def get_client(auth_file_path: str) -> MastodonClient:
 
     auth = json.loads(raw_auth)
 
+    from .client import MastodonClient
+
     return MastodonClient(
         domain=auth["mastodon_domain"],
         access_token=auth["mastodon_access_token"],
+        transport=transport,
     )
 
 
-def verify_auth(auth_file_path: str) -> bool:
+def verify_auth(
+    auth_file_path: str, transport: Optional[TransportConfig] = None
+) -> bool:
     """
     Verify Mastodon authentication.
     """
-    client = get_client(auth_file_path)
+    client = get_client(auth_file_path, transport=transport)
 
     _, response = client.accounts_verify_credentials()
 
@@ -198,23 +813,119 @@ def save_accounts(
     for account in accounts:
         transformer_account(account)
 
-    accounts_table.upsert_all(accounts, pk="id")
+    accounts_table.upsert_all(accounts, pk="id", batch_size=UPSERT_BATCH_SIZE)
 
     if followed_id is not None or follower_id is not None:
         first_seen = datetime.datetime.now(datetime.timezone.utc).isoformat()
 
+        followings = [
+            {
+                "followed_id": followed_id or account["id"],
+                "follower_id": follower_id or account["id"],
+                "first_seen": first_seen,
+                "first_seen_epoch": get_epoch(first_seen),
+            }
+            for account in accounts
+        ]
+        existing = get_existing_keys(
+            db,
+            "following",
+            ("followed_id", "follower_id"),
+            [(f["followed_id"], f["follower_id"]) for f in followings],
+        )
+
         following_table.upsert_all(
-            (
-                {
-                    "followed_id": followed_id or account["id"],
-                    "follower_id": follower_id or account["id"],
-                    "first_seen": first_seen,
-                }
-                for account in accounts
-            ),
+            followings,
             pk=("followed_id", "follower_id"),
+            batch_size=UPSERT_BATCH_SIZE,
         )
 
+        update_followers_per_day(
+            db,
+            [
+                following
+                for following in followings
+                if (following["followed_id"], following["follower_id"])
+                not in existing
+            ],
+        )
+
+
+# The accounts referenced by another table but not in the accounts table.
+DANGLING_ACCOUNT_IDS_SQL = """
+SELECT referenced.account_id
+FROM (
+    SELECT account_id FROM statuses
+    UNION SELECT followed_id FROM following
+    UNION SELECT follower_id FROM following
+    UNION SELECT account_id FROM status_activities
+) AS referenced
+LEFT JOIN accounts ON accounts.id = referenced.account_id
+WHERE accounts.id IS NULL AND referenced.account_id IS NOT NULL
+ORDER BY referenced.account_id
+"""
+
+
+def get_dangling_account_ids(db: Database) -> List[str]:
+    """
+    Returns the IDs of the accounts referenced by statuses, followings or
+    activities that aren't saved.
+    """
+    build_database(db)
+    return [str(row[0]) for row in db.execute(DANGLING_ACCOUNT_IDS_SQL)]
+
+
+def get_accounts(
+    account_ids: List[str], client: MastodonClient, batch_size: int = 40
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """
+    Get the accounts in batches of batch_size. Servers without the multiple
+    accounts endpoint (before Mastodon 4.3) return a 404, so the accounts are
+    fetched one at a time from them instead. Accounts that no longer exist are
+    skipped.
+    """
+    multiple = True
+
+    for start in range(0, len(account_ids), batch_size):
+        batch = account_ids[start : start + batch_size]
+
+        if multiple:
+            _, response = client.accounts(batch)
+            if response.status_code != 404:
+                response.raise_for_status()
+                yield response.json()
+                continue
+            multiple = False
+
+        accounts = []
+        for account_id in batch:
+            _, response = client.account(account_id)
+            if response.status_code == 404:
+                continue
+            response.raise_for_status()
+            accounts.append(response.json())
+
+        yield accounts
+
+
+def backfill_accounts(
+    db: Database, client: MastodonClient, batch_size: int = 40
+) -> Dict[str, int]:
+    """
+    Fetch and save the accounts referenced in the database but not saved,
+    saving each batch in one transaction. Returns the number of accounts
+    missing and saved.
+    """
+    account_ids = get_store(db).get_dangling_account_ids(db)
+
+    saved = 0
+    for accounts in get_accounts(account_ids, client, batch_size=batch_size):
+        with write_transaction(db):
+            save_accounts(db, accounts)
+        saved += len(accounts)
+
+    return {"missing": len(account_ids), "saved": saved}
+
 
 def get_statuses(
     account_id: str, client: MastodonClient, since_id: Optional[str] = None
@@ -228,6 +939,157 @@ def get_statuses(
         yield response.json()
 
 
+def get_snowflake_id(timestamp: datetime.datetime) -> int:
+    """
+    Returns the smallest Mastodon snowflake ID for the given timestamp. The
+    upper 48 bits of an ID are milliseconds since the Unix epoch.
+    """
+    return int(timestamp.timestamp() * 1000) << 16
+
+
+def get_snowflake_datetime(snowflake_id: Any) -> datetime.datetime:
+    """
+    Returns the timestamp encoded in a Mastodon snowflake ID.
+    """
+    return datetime.datetime.fromtimestamp(
+        (int(snowflake_id) >> 16) / 1000, tz=datetime.timezone.utc
+    )
+
+
+def get_status_partitions(
+    start: datetime.datetime, end: datetime.datetime, count: int
+) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Split the status IDs between start and end into count time windows of
+    (since_id, max_id) pairs. Both are exclusive, so since_id is one below the
+    window's first ID, and the first and last windows are left open so no
+    status falls outside every window.
+    """
+    step = (end - start) / count
+    boundaries = [
+        get_snowflake_id(start + step * index) for index in range(1, count)
+    ]
+
+    since_ids: List[Optional[str]] = [None]
+    since_ids.extend(str(boundary - 1) for boundary in boundaries)
+    max_ids: List[Optional[str]] = [str(boundary) for boundary in boundaries]
+    max_ids.append(None)
+
+    return list(zip(since_ids, max_ids))
+
+
+def get_statuses_partition(
+    account_id: str,
+    client: MastodonClient,
+    since_id: Optional[str] = None,
+    max_id: Optional[str] = None,
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """
+    Get the account's statuses between since_id and max_id, newest first.
+    """
+    while True:
+        _, response = client.accounts_statuses_page(
+            account_id, max_id=max_id, since_id=since_id
+        )
+        response.raise_for_status()
+        statuses = response.json()
+
+        if not statuses:
+            return
+
+        yield statuses
+        max_id = str(min(int(status["id"]) for status in statuses))
+
+
+def get_statuses_backfill(
+    account_id: str,
+    client: MastodonClient,
+    start: datetime.datetime,
+    workers: int = 4,
+    partitions: Optional[int] = None,
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """
+    Get the account's statuses since start by paging time windows of the
+    snowflake ID space concurrently. Pages are yielded as they arrive, so the
+    caller stays the only writer.
+    """
+    if partitions is None:
+        partitions = workers * 4
+
+    end = datetime.datetime.now(datetime.timezone.utc)
+    windows = get_status_partitions(start, end, partitions)
+
+    pages: "queue.Queue[Any]" = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def fetch_partition(since_id: Optional[str], max_id: Optional[str]):
+        try:
+            for page in get_statuses_partition(
+                account_id, client, since_id=since_id, max_id=max_id
+            ):
+                if stop.is_set():
+                    break
+                pages.put(page)
+        except Exception as exc:
+            pages.put(exc)
+        finally:
+            pages.put(done)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for since_id, max_id in windows:
+            executor.submit(fetch_partition, since_id, max_id)
+
+        try:
+            remaining = len(windows)
+            while remaining:
+                page = pages.get()
+                if page is done:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            stop.set()
+
+
+class PlainTextParser(HTMLParser):
+    """
+    Collects the text of a Mastodon status's HTML content, keeping paragraphs
+    and line breaks as new lines.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parts: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "br":
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "p":
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def get_plain_text(html: Optional[str]) -> Optional[str]:
+    """
+    Returns the plain text of a Mastodon status's HTML content.
+    """
+    if html is None:
+        return None
+
+    parser = PlainTextParser()
+    parser.feed(html)
+    parser.close()
+
+    return "".join(parser.parts).strip()
+
+
 def transformer_status(status: Dict[str, Any]):
     """
     Transformer a Mastodon status, so it can be safely saved to the SQLite
@@ -249,6 +1111,15 @@ def transformer_status(status: Dict[str, Any]):
 
     status["account_id"] = account["id"]
 
+    if "content" in status:
+        status["content_text"] = get_plain_text(status["content"])
+
+    status["created_at_epoch"] = get_epoch(status.get("created_at"))
+    if status["created_at_epoch"] is None:
+        status["created_at_epoch"] = int(
+            get_snowflake_datetime(status["id"]).timestamp()
+        )
+
 
 def save_statuses(db: Database, statuses: List[Dict[str, Any]]):
     """
@@ -256,26 +1127,184 @@ def save_statuses(db: Database, statuses: List[Dict[str, Any]]):
     """
     build_database(db)
     statuses_table = get_table("statuses", db=db)
+    codec = read_content_codec(db.conn)
 
     for status in statuses:
         transformer_status(status)
+        if codec is not None and "content" in status:
+            status["content"] = codec.compress(status["content"])
 
-    statuses_table.upsert_all(statuses, pk="id")
+    existing = get_existing_keys(
+        db, "statuses", ("id",), [(status["id"],) for status in statuses]
+    )
 
+    statuses_table.upsert_all(statuses, pk="id", batch_size=UPSERT_BATCH_SIZE)
 
-def get_bookmarks(
-    client: MastodonClient,
-) -> Generator[List[Dict[str, Any]], None, None]:
-    """
-    Get authenticated account's bookmarks.
-    """
-    for request, response in client.bookmarks():
-        yield response.json()
+    update_statuses_per_day(
+        db, [status for status in statuses if (status["id"],) not in existing]
+    )
 
 
-def get_favourites(
-    client: MastodonClient,
-) -> Generator[List[Dict[str, Any]], None, None]:
+def get_import_cursor(
+    db: Database, account_id: str, endpoint: str
+) -> Optional[str]:
+    """
+    Returns the ID of the newest item imported from the endpoint, or None if
+    nothing was imported yet.
+    """
+    build_database(db)
+    row = next(
+        get_table("import_cursors", db=db).rows_where(
+            "account_id = ? AND endpoint = ?",
+            [account_id, endpoint],
+            select="min_id",
+        ),
+        None,
+    )
+    return None if row is None else row["min_id"]
+
+
+def save_import_cursor(
+    db: Database, account_id: str, endpoint: str, min_id: str
+):
+    """
+    Record the ID of the newest item imported from the endpoint.
+    """
+    build_database(db)
+    get_table("import_cursors", db=db).upsert(
+        {
+            "account_id": account_id,
+            "endpoint": endpoint,
+            "min_id": min_id,
+            "updated_at": datetime.datetime.now(
+                datetime.timezone.utc
+            ).isoformat(),
+        },
+        pk=("account_id", "endpoint"),
+    )
+
+
+def get_forward_pages(
+    pages: Iterable[Tuple[Any, Any]]
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """
+    Yield the items of forward paged responses oldest first, stopping at the
+    first empty page.
+    """
+    for request, response in pages:
+        response.raise_for_status()
+        items = response.json()
+        if not items:
+            break
+
+        # Each page is newest first, even when paging forward.
+        yield list(reversed(items))
+
+
+def get_notifications(
+    client: MastodonClient, min_id: Optional[str] = None
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """
+    Get authenticated account's notifications newer than min_id, oldest
+    first.
+    """
+    return get_forward_pages(client.notifications(min_id=min_id or "0"))
+
+
+def get_home_timeline(
+    client: MastodonClient, min_id: Optional[str] = None
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """
+    Get authenticated account's home timeline newer than min_id, oldest
+    first.
+    """
+    return get_forward_pages(client.timelines_home(min_id=min_id or "0"))
+
+
+def save_notifications(
+    db: Database,
+    account_id: str,
+    notifications: List[Dict[str, Any]],
+    save_statuses_func: Optional[SaveStatusesFunc] = None,
+):
+    """
+    Save Mastodon notifications, with their accounts and statuses, to the
+    SQLite database. The statuses are saved with save_statuses_func, which
+    defaults to save_statuses.
+    """
+    build_database(db)
+    save_statuses_func = save_statuses_func or save_statuses
+
+    save_accounts(
+        db, [notification["account"] for notification in notifications]
+    )
+
+    statuses = [
+        notification["status"]
+        for notification in notifications
+        if notification.get("status")
+    ]
+    save_accounts(db, [status["account"] for status in statuses])
+    save_statuses_func(db, statuses)
+
+    get_table("notifications", db=db).upsert_all(
+        [
+            {
+                "id": notification["id"],
+                "recipient_id": account_id,
+                "type": notification["type"],
+                "created_at": notification["created_at"],
+                "created_at_epoch": get_epoch(notification["created_at"]),
+                "account_id": notification["account"]["id"],
+                "status_id": (notification.get("status") or {}).get("id"),
+            }
+            for notification in notifications
+        ],
+        pk="id",
+        batch_size=UPSERT_BATCH_SIZE,
+    )
+
+
+def save_home_timeline(
+    db: Database,
+    account_id: str,
+    statuses: List[Dict[str, Any]],
+    save_statuses_func: Optional[SaveStatusesFunc] = None,
+):
+    """
+    Save the statuses in the home timeline to the SQLite database. The
+    statuses are saved with save_statuses_func, which defaults to
+    save_statuses.
+    """
+    build_database(db)
+    save_statuses_func = save_statuses_func or save_statuses
+
+    save_accounts(db, [status["account"] for status in statuses])
+    save_statuses_func(db, statuses)
+
+    get_table("home_timeline", db=db).upsert_all(
+        [
+            {"account_id": account_id, "status_id": status["id"]}
+            for status in statuses
+        ],
+        pk=("account_id", "status_id"),
+        batch_size=UPSERT_BATCH_SIZE,
+    )
+
+
+def get_bookmarks(
+    client: MastodonClient,
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """
+    Get authenticated account's bookmarks.
+    """
+    for request, response in client.bookmarks():
+        yield response.json()
+
+
+def get_favourites(
+    client: MastodonClient,
+) -> Generator[List[Dict[str, Any]], None, None]:
     """
     Get authenticated account's favourites.
     """
@@ -292,11 +1321,86 @@ def save_activities(
     build_database(db)
     statuses_table = get_table("statuses", db=db)
     status_activities_table = get_table("status_activities", db=db)
+    codec = read_content_codec(db.conn)
 
     for status in statuses:
         transformer_status(status)
+        if codec is not None and "content" in status:
+            status["content"] = codec.compress(status["content"])
+
+    existing_statuses = get_existing_keys(
+        db, "statuses", ("id",), [(status["id"],) for status in statuses]
+    )
+    existing_activities = get_existing_keys(
+        db,
+        "status_activities",
+        ("account_id", "activity", "status_id"),
+        [(account_id, activity, status["id"]) for status in statuses],
+    )
+
+    statuses_table.upsert_all(statuses, pk="id", batch_size=UPSERT_BATCH_SIZE)
+
+    status_activities_table.upsert_all(
+        (
+            {
+                "account_id": account_id,
+                "activity": activity,
+                "status_id": status["id"],
+            }
+            for status in statuses
+        ),
+        pk=("account_id", "activity", "status_id"),
+        batch_size=UPSERT_BATCH_SIZE,
+    )
+
+    update_statuses_per_day(
+        db,
+        [
+            status
+            for status in statuses
+            if (status["id"],) not in existing_statuses
+        ],
+    )
+    update_activities_per_month(
+        db,
+        account_id,
+        activity,
+        [
+            status
+            for status in statuses
+            if (account_id, activity, status["id"]) not in existing_activities
+        ],
+    )
+
+
+def save_activity_status_ids(
+    db: Database, account_id: str, activity: str, status_ids: List[str]
+) -> int:
+    """
+    Save Mastodon activities for statuses that are already in the SQLite
+    database, by ID. Returns the number of activities saved.
+    """
+    build_database(db)
+    status_activities_table = get_table("status_activities", db=db)
+
+    statuses: List[Dict[str, Any]] = []
+    chunk_size = 900
+    for index in range(0, len(status_ids), chunk_size):
+        chunk = status_ids[index : index + chunk_size]
+        statuses.extend(
+            get_table("statuses", db=db).rows_where(
+                f"id IN ({', '.join('?' for _ in chunk)})",
+                chunk,
+                select="id, account_id, created_at_epoch",
+            )
+        )
 
-    statuses_table.upsert_all(statuses, pk="id")
+    existing_activities = get_existing_keys(
+        db,
+        "status_activities",
+        ("account_id", "activity", "status_id"),
+        [(account_id, activity, status["id"]) for status in statuses],
+    )
 
     status_activities_table.upsert_all(
         (
@@ -308,17 +1412,222 @@ def save_activities(
             for status in statuses
         ),
         pk=("account_id", "activity", "status_id"),
+        batch_size=UPSERT_BATCH_SIZE,
+    )
+
+    update_activities_per_month(
+        db,
+        account_id,
+        activity,
+        [
+            status
+            for status in statuses
+            if (account_id, activity, status["id"]) not in existing_activities
+        ],
+    )
+
+    return len(statuses)
+
+
+def get_existing_keys(
+    db: Database,
+    table_name: str,
+    columns: Tuple[str, ...],
+    keys: List[Tuple[Any, ...]],
+) -> Set[Tuple[Any, ...]]:
+    """
+    Returns the keys that already have a row in the table, so aggregates are
+    only updated for new rows. Keys are compared as strings because the API
+    returns IDs as strings while the database stores integers.
+    """
+    existing: Set[Tuple[str, ...]] = set()
+    column_list = ", ".join(f"[{column}]" for column in columns)
+    row_placeholder = f"({', '.join('?' for _ in columns)})"
+
+    # Keep well under SQLite's limit on the number of bound parameters.
+    chunk_size = 900 // len(columns)
+    for index in range(0, len(keys), chunk_size):
+        chunk = keys[index : index + chunk_size]
+        sql = (
+            f"SELECT {column_list} FROM [{table_name}]"
+            f" WHERE ({column_list}) IN"
+            f" (VALUES {', '.join(row_placeholder for _ in chunk)})"
+        )
+        params = [value for key in chunk for value in key]
+        existing.update(
+            tuple(str(value) for value in row)
+            for row in db.execute(sql, params).fetchall()
+        )
+
+    return {
+        key for key in keys if tuple(str(value) for value in key) in existing
+    }
+
+
+def increment_aggregate(
+    db: Database,
+    table_name: str,
+    key_columns: Tuple[str, ...],
+    count_column: str,
+    counts: Counter,
+):
+    """
+    Add the counts to an aggregate table, inserting missing rows.
+    """
+    if not counts:
+        return
+
+    columns = (*key_columns, count_column)
+    sql = (
+        f"INSERT INTO [{table_name}]"
+        f" ({', '.join(f'[{column}]' for column in columns)})"
+        f" VALUES ({', '.join('?' for _ in columns)})"
+        f" ON CONFLICT ({', '.join(f'[{column}]' for column in key_columns)})"
+        f" DO UPDATE SET [{count_column}] = [{count_column}]"
+        f" + excluded.[{count_column}]"
+    )
+
+    with write_transaction(db):
+        db.conn.executemany(
+            sql, [(*key, count) for key, count in counts.items()]
+        )
+
+
+def format_epoch(epoch: int, date_format: str) -> str:
+    """
+    Format a Unix epoch in seconds as a UTC date.
+    """
+    return datetime.datetime.fromtimestamp(
+        epoch, tz=datetime.timezone.utc
+    ).strftime(date_format)
+
+
+def update_statuses_per_day(db: Database, statuses: List[Dict[str, Any]]):
+    """
+    Count newly saved statuses in the statuses per day aggregate.
+    """
+    increment_aggregate(
+        db,
+        "statuses_per_day",
+        ("account_id", "date"),
+        "count",
+        Counter(
+            (
+                int(status["account_id"]),
+                format_epoch(status["created_at_epoch"], "%Y-%m-%d"),
+            )
+            for status in {str(s["id"]): s for s in statuses}.values()
+        ),
+    )
+
+
+def update_activities_per_month(
+    db: Database,
+    account_id: str,
+    activity: str,
+    statuses: List[Dict[str, Any]],
+):
+    """
+    Count newly saved activities in the activities per author per month
+    aggregate.
+    """
+    increment_aggregate(
+        db,
+        "activities_per_month",
+        ("account_id", "activity", "author_id", "month"),
+        "count",
+        Counter(
+            (
+                int(account_id),
+                activity,
+                int(status["account_id"]),
+                format_epoch(status["created_at_epoch"], "%Y-%m"),
+            )
+            for status in {str(s["id"]): s for s in statuses}.values()
+        ),
+    )
+
+
+def update_followers_per_day(db: Database, followings: List[Dict[str, Any]]):
+    """
+    Count newly seen followers in the followers gained per day aggregate, by
+    the followed account.
+    """
+    increment_aggregate(
+        db,
+        "followers_per_day",
+        ("account_id", "date"),
+        "gained",
+        Counter(
+            (int(followed_id), first_seen[:10])
+            for (followed_id, _), first_seen in {
+                (str(f["followed_id"]), str(f["follower_id"])): f["first_seen"]
+                for f in followings
+            }.items()
+        ),
     )
 
 
+REBUILD_FOLLOWERS_PER_DAY_SQL = """
+INSERT INTO followers_per_day (account_id, date, gained)
+SELECT followed_id, substr(first_seen, 1, 10), count(*)
+FROM following
+GROUP BY 1, 2
+"""
+
+
+def rebuild_aggregates(db: Database):
+    """
+    Recompute the aggregate tables from scratch.
+    """
+    build_database(db)
+
+    with write_transaction(db):
+        db.conn.execute("DELETE FROM statuses_per_day")
+        db.conn.execute(
+            """
+            INSERT INTO statuses_per_day (account_id, date, count)
+            SELECT
+                account_id,
+                date(created_at_epoch, 'unixepoch'),
+                count(*)
+            FROM statuses
+            GROUP BY 1, 2
+            """
+        )
+
+        db.conn.execute("DELETE FROM activities_per_month")
+        db.conn.execute(
+            """
+            INSERT INTO activities_per_month
+                (account_id, activity, author_id, month, count)
+            SELECT
+                status_activities.account_id,
+                status_activities.activity,
+                statuses.account_id,
+                strftime('%Y-%m', statuses.created_at_epoch, 'unixepoch'),
+                count(*)
+            FROM status_activities
+            JOIN statuses ON statuses.id = status_activities.status_id
+            GROUP BY 1, 2, 3, 4
+            """
+        )
+
+        db.conn.execute("DELETE FROM followers_per_day")
+        db.conn.execute(REBUILD_FOLLOWERS_PER_DAY_SQL)
+
+
 def get_most_recent_status_id(db: Database) -> Optional[int]:
     """
     Get the most recent status ID from the SQLite database.
     """
+    build_database(db)
     table = get_table("statuses", db=db)
 
     row = next(
-        table.rows_where(order_by="created_at desc", select="id", limit=1),
+        table.rows_where(
+            order_by="created_at_epoch desc, id desc", select="id", limit=1
+        ),
         None,
     )
 
@@ -326,3 +1635,489 @@ def get_most_recent_status_id(db: Database) -> Optional[int]:
         return None
 
     return row["id"]
+
+
+def get_thread_status_ids(
+    db: Database,
+    account_id: str,
+    sources: Iterable[str] = ("statuses", "bookmarks", "favourites"),
+    ttl: Optional[datetime.timedelta] = None,
+) -> List[int]:
+    """
+    Get the IDs of statuses whose threads should be archived. Statuses that
+    were part of a thread fetched within the ttl are skipped.
+    """
+    build_database(db)
+
+    selects = []
+    params: List[Any] = []
+    if "statuses" in sources:
+        selects.append(
+            "SELECT id AS status_id FROM statuses WHERE account_id = ?"
+        )
+        params.append(account_id)
+
+    activities = [
+        activity
+        for source, activity in (
+            ("bookmarks", "bookmarked"),
+            ("favourites", "favourited"),
+        )
+        if source in sources
+    ]
+    if activities:
+        placeholders = ", ".join("?" for _ in activities)
+        selects.append(
+            "SELECT status_id FROM status_activities"
+            f" WHERE account_id = ? AND activity IN ({placeholders})"
+        )
+        params.extend([account_id, *activities])
+
+    if not selects:
+        return []
+
+    sql = (
+        f"SELECT DISTINCT status_id FROM ({' UNION '.join(selects)})"
+        " ORDER BY status_id DESC"
+    )
+    fetched = set() if ttl is None else get_fetched_status_ids(db, ttl)
+
+    return [
+        row[0]
+        for row in db.execute(sql, params).fetchall()
+        if row[0] not in fetched
+    ]
+
+
+def get_fetched_status_ids(db: Database, ttl: datetime.timedelta) -> Set[int]:
+    """
+    Get the IDs of statuses that were part of a thread fetched within the ttl.
+    """
+    build_database(db)
+    fetched_after = (
+        datetime.datetime.now(datetime.timezone.utc) - ttl
+    ).isoformat()
+
+    return {
+        row[0]
+        for row in db.execute(
+            "SELECT status_id FROM status_context_fetches"
+            " WHERE fetched_at >= ?",
+            [fetched_after],
+        ).fetchall()
+    }
+
+
+def get_status_context(
+    status_id: str, client: MastodonClient
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Get the ancestors and descendants of a status. A status that was deleted
+    or made private since it was saved has an empty thread, so it's recorded
+    as fetched and skipped until the ttl expires.
+    """
+    _, response = client.statuses_context(status_id)
+    if response.status_code in (404, 410):
+        return {"ancestors": [], "descendants": []}
+    response.raise_for_status()
+    return response.json()
+
+
+def get_status_contexts(
+    status_ids: Iterable[Any], client: MastodonClient, max_workers: int = 4
+) -> Generator[Tuple[str, Dict[str, List[Dict[str, Any]]]], None, None]:
+    """
+    Concurrently get the contexts of the statuses. A status that already
+    appeared in a fetched thread isn't fetched again.
+    """
+    seen = set()
+    status_ids_iter = (str(status_id) for status_id in status_ids)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+
+        def submit_next():
+            for status_id in status_ids_iter:
+                if status_id in seen:
+                    continue
+
+                seen.add(status_id)
+                future = executor.submit(get_status_context, status_id, client)
+                futures[future] = status_id
+                return
+
+        for _ in range(max_workers):
+            submit_next()
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                status_id = futures.pop(future)
+                context = future.result()
+
+                seen.update(
+                    str(status["id"])
+                    for status in context["ancestors"] + context["descendants"]
+                )
+
+                yield status_id, context
+                submit_next()
+
+
+def save_status_context(
+    db: Database,
+    status_id: str,
+    context: Dict[str, List[Dict[str, Any]]],
+    save_statuses_func: Optional[SaveStatusesFunc] = None,
+):
+    """
+    Save the thread around a Mastodon status to the SQLite database. The
+    statuses are saved with save_statuses_func, which defaults to
+    save_statuses.
+    """
+    build_database(db)
+    save_statuses_func = save_statuses_func or save_statuses
+    status_context_table = get_table("status_context", db=db)
+    status_context_fetches_table = get_table("status_context_fetches", db=db)
+
+    relations = [
+        (status["id"], relation)
+        for relation in ("ancestor", "descendant")
+        for status in context[f"{relation}s"]
+    ]
+    statuses = context["ancestors"] + context["descendants"]
+    accounts = {
+        status["account"]["id"]: status["account"] for status in statuses
+    }
+
+    save_accounts(db, list(accounts.values()))
+    save_statuses_func(db, statuses)
+
+    status_context_table.upsert_all(
+        (
+            {
+                "status_id": status_id,
+                "related_status_id": related_status_id,
+                "relation": relation,
+            }
+            for related_status_id, relation in relations
+        ),
+        pk=("status_id", "related_status_id"),
+        batch_size=UPSERT_BATCH_SIZE,
+    )
+
+    fetched_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    status_context_fetches_table.upsert_all(
+        (
+            {"status_id": fetched_status_id, "fetched_at": fetched_at}
+            for fetched_status_id in {
+                status_id,
+                *(related for related, _ in relations),
+            }
+        ),
+        pk="status_id",
+        batch_size=UPSERT_BATCH_SIZE,
+    )
+
+
+def get_database_size(db: Database) -> int:
+    """
+    Returns the size of the database in bytes.
+    """
+    page_count = db.execute("PRAGMA page_count").fetchone()[0]
+    page_size = db.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def maintain_database(
+    db: Database,
+    fts_merge_pages: Optional[int] = None,
+    full_vacuum: bool = False,
+) -> Dict[str, Any]:
+    """
+    Refresh the query planner statistics, optimize the full-text search
+    indexes, vacuum free pages and check the integrity of the database.
+    Returns the sizes before and after, the time taken by each step and the
+    integrity check problems.
+    """
+    report: Dict[str, Any] = {
+        "size_before": get_database_size(db),
+        "timings": {},
+    }
+
+    def timed(step: str, sql: str):
+        started_at = time.perf_counter()
+        try:
+            rows = db.execute(sql).fetchall()
+        finally:
+            report["timings"][step] = time.perf_counter() - started_at
+        return rows
+
+    timed("analyze", "ANALYZE")
+    timed("optimize", "PRAGMA optimize")
+
+    for table_name in ("statuses_fts", "accounts_fts"):
+        if get_table(table_name, db=db).exists() is False:
+            continue
+
+        if fts_merge_pages is None:
+            sql = (
+                f"INSERT INTO [{table_name}] ([{table_name}])"
+                " VALUES ('optimize')"
+            )
+        else:
+            sql = (
+                f"INSERT INTO [{table_name}] ([{table_name}], rank)"
+                f" VALUES ('merge', {int(fts_merge_pages)})"
+            )
+
+        with write_transaction(db):
+            timed(f"{table_name} optimize", sql)
+
+    auto_vacuum = db.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if full_vacuum:
+        # A full VACUUM is also the only way to turn on incremental vacuums
+        # for a database created without them.
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        timed("vacuum", "VACUUM")
+    elif auto_vacuum == 2:
+        timed("incremental vacuum", "PRAGMA incremental_vacuum")
+
+    problems = [
+        row[0]
+        for row in timed("integrity check", "PRAGMA integrity_check")
+        if row[0] != "ok"
+    ]
+    for table_name in ("statuses_fts", "accounts_fts"):
+        if get_table(table_name, db=db).exists() is False:
+            continue
+
+        try:
+            with write_transaction(db):
+                timed(
+                    f"{table_name} integrity check",
+                    f"INSERT INTO [{table_name}] ([{table_name}])"
+                    " VALUES ('integrity-check')",
+                )
+        except sqlite3.DatabaseError as exc:
+            problems.append(f"{table_name}: {exc}")
+    report["problems"] = problems
+
+    report["size_after"] = get_database_size(db)
+
+    return report
+
+
+# The account count each endpoint is compared with, and its page size.
+SYNC_ENDPOINTS = {
+    "statuses": ("statuses_count", 40),
+    "followers": ("followers_count", 80),
+    "followings": ("following_count", 80),
+}
+
+# Mastodon's default rate limit is 300 requests per 5 minutes.
+# See docs: <https://docs.joinmastodon.org/api/rate-limits/>
+RATE_LIMIT_REQUESTS = 300
+RATE_LIMIT_PERIOD = 300
+
+
+@dataclass
+class SyncStep:
+    endpoint: str
+    action: str  # skip, incremental, full
+    remote_count: int
+    estimated_requests: int
+    reason: str
+
+
+def get_sync_state(db: Database, account_id: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the counts recorded by the last sync of each endpoint.
+    """
+    build_database(db)
+    return {
+        row["endpoint"]: row
+        for row in get_table("sync_state", db=db).rows_where(
+            "account_id = ?", [account_id]
+        )
+    }
+
+
+def save_sync_state(
+    db: Database, account_id: str, endpoint: str, remote_count: int
+):
+    """
+    Record the count the endpoint was synced at.
+    """
+    build_database(db)
+    get_table("sync_state", db=db).upsert(
+        {
+            "account_id": account_id,
+            "endpoint": endpoint,
+            "remote_count": remote_count,
+            "synced_at": datetime.datetime.now(
+                datetime.timezone.utc
+            ).isoformat(),
+        },
+        pk=("account_id", "endpoint"),
+    )
+
+
+def count_account_statuses(db: Database, account_id: str) -> int:
+    """
+    Returns the number of the account's statuses saved in the database.
+    """
+    build_database(db)
+    return db.execute(
+        "SELECT count(*) FROM statuses WHERE account_id = ?", [account_id]
+    ).fetchone()[0]
+
+
+def get_sync_plan(db: Database, account: Dict[str, Any]) -> List[SyncStep]:
+    """
+    Plan which endpoints need syncing from the counts in the authenticated
+    account, compared with the counts recorded by the last sync and the
+    statuses stored locally.
+    """
+    account_id = account["id"]
+    state = get_sync_state(db, account_id)
+    local_statuses = get_store(db).count_account_statuses(db, account_id)
+
+    plan = []
+    for endpoint, (count_key, page_size) in SYNC_ENDPOINTS.items():
+        remote_count = account.get(count_key) or 0
+        last_count = state.get(endpoint, {}).get("remote_count")
+
+        if last_count is None or (
+            endpoint == "statuses" and local_statuses == 0
+        ):
+            action, reason = "full", "never synced"
+            pages = math.ceil(remote_count / page_size)
+        elif remote_count == last_count:
+            action, reason = "skip", f"unchanged at {remote_count}"
+            pages = 0
+        elif endpoint == "statuses":
+            # New statuses are fetched until the most recent stored one.
+            new = max(remote_count - last_count, 1)
+            action, reason = "incremental", f"{last_count} -> {remote_count}"
+            pages = math.ceil(new / page_size)
+        else:
+            # Unfollows can't be found incrementally, so list them all again.
+            action, reason = "full", f"{last_count} -> {remote_count}"
+            pages = math.ceil(remote_count / page_size)
+
+        # Every import first verifies the credentials, and fetches at least
+        # one page.
+        estimated_requests = 0 if action == "skip" else max(pages, 1) + 1
+        plan.append(
+            SyncStep(
+                endpoint=endpoint,
+                action=action,
+                remote_count=remote_count,
+                estimated_requests=estimated_requests,
+                reason=reason,
+            )
+        )
+
+    return plan
+
+
+def estimate_rate_limit_wait(
+    requests: int,
+    limit: int = RATE_LIMIT_REQUESTS,
+    period: int = RATE_LIMIT_PERIOD,
+) -> int:
+    """
+    Returns the seconds spent waiting for the rate limit to reset while making
+    the requests, assuming the budget is full at the start.
+    """
+    if requests <= limit:
+        return 0
+
+    return (math.ceil(requests / limit) - 1) * period
+
+
+def get_content_size(db: Database) -> int:
+    """
+    Returns the bytes taken by the statuses' content.
+    """
+    return db.execute(
+        "SELECT coalesce(sum(length(CAST(content AS BLOB))), 0) FROM statuses"
+    ).fetchone()[0]
+
+
+def set_content_codec(
+    db: Database,
+    codec: Optional[str],
+    level: Optional[int] = None,
+    sample_size: int = 1_000,
+    chunk_size: int = 1_000,
+) -> Dict[str, int]:
+    """
+    Compress the statuses' content with the codec (zlib or zstd), or
+    decompress it if codec is None, recompressing the saved statuses a chunk
+    at a time. For zstd, a dictionary is trained on a sample of the saved
+    statuses. The plain text content stays uncompressed for full-text search.
+    Returns the content size before and after.
+    """
+    if get_setting(db, "shard_period") is not None:
+        from .shards import ShardError
+
+        raise ShardError(
+            "The statuses of a shard catalog are in its shards, which store"
+            " their content uncompressed."
+        )
+
+    build_database(db)
+    size_before = get_content_size(db)
+    old_codec = read_content_codec(db.conn) or ContentCodec()
+
+    settings = {}
+    if codec is not None:
+        settings["content_codec"] = codec
+    if codec is not None and level is not None:
+        settings["content_codec_level"] = str(level)
+
+    if codec == "zstd":
+        import zstandard
+
+        samples = [
+            (old_codec.decompress(row[0]) or "").encode("utf-8")
+            for row in db.execute(
+                "SELECT content FROM statuses WHERE content IS NOT NULL"
+                " ORDER BY random() LIMIT ?",
+                [sample_size],
+            )
+        ]
+        # Training fails with too few samples, zstd works without one.
+        try:
+            settings["content_zstd_dictionary"] = base64.b64encode(
+                train_dictionary(samples)
+            ).decode("ascii")
+        except zstandard.ZstdError:
+            pass
+
+    with write_transaction(db):
+        settings_table = get_table("settings", db=db)
+        if settings_table.exists():
+            settings_table.delete_where(
+                "key IN (?, ?, ?)", list(CODEC_SETTINGS)
+            )
+        for key, value in settings.items():
+            set_setting(db, key, value)
+
+    new_codec = read_content_codec(db.conn)
+
+    def recompress(value):
+        content = old_codec.decompress(value)
+        if new_codec is None:
+            return content
+        return new_codec.compress(content)
+
+    db.conn.create_function("recompress", 1, recompress)
+    backfill_column(
+        db, "statuses", "content", "recompress(content)", chunk_size
+    )
+    register_decompress(db.conn)
+
+    return {"size_before": size_before, "size_after": get_content_size(db)}
@@ -0,0 +1,562 @@
+import datetime
+import sqlite3
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterable, List, Optional
+
+from sqlite_utils.db import Database
+
+from . import service
+
+# strftime formats of the shard keys, shared by Python and SQLite.
+SHARD_PERIODS = {"year": "%Y", "month": "%Y-%m"}
+
+# SQLite attaches at most 10 databases to a connection unless the library was
+# built with a higher SQLITE_MAX_ATTACHED, which can't be above 125.
+DEFAULT_MAX_ATTACHED = 10
+MAX_ATTACHED = 125
+
+# The tables split into the shards, the rest stay in the catalog. The full-text
+# search tables of the statuses are kept up to date in each shard by triggers.
+SHARDED_TABLES = (
+    "statuses",
+    "status_activities",
+    "statuses_per_day",
+    "activities_per_month",
+)
+
+# The epoch a status activity is sharded by, the status's if it's saved,
+# otherwise the timestamp in the status ID.
+ACTIVITY_EPOCH_SQL = """
+coalesce(
+    statuses.created_at_epoch,
+    (status_activities.status_id >> 16) / 1000
+)
+"""
+
+
+class ShardError(Exception):
+    pass
+
+
+def get_shard_period(db: Database) -> Optional[str]:
+    """
+    Returns the period the database is sharded by, or None if it isn't a shard
+    catalog.
+    """
+    return service.get_setting(db, "shard_period")
+
+
+def raise_attach_limit(db: Database) -> int:
+    """
+    Raise the number of databases that can be attached to the connection as
+    far as the SQLite library allows, returning the limit.
+    """
+    # Connection.setlimit was added in Python 3.11.
+    if not hasattr(db.conn, "setlimit"):
+        return DEFAULT_MAX_ATTACHED
+
+    db.conn.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, MAX_ATTACHED)
+    return db.conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+
+def get_catalog_path(db: Database) -> Path:
+    """
+    Returns the path to the catalog database file, the shards are stored next
+    to it.
+    """
+    for _, name, file_path in db.execute("PRAGMA database_list"):
+        if name == "main" and file_path:
+            return Path(file_path)
+
+    raise ShardError("Only a database file can be sharded.")
+
+
+def get_shards(db: Database) -> List[Dict[str, Any]]:
+    """
+    Returns the shards of the catalog, oldest first.
+    """
+    table = service.get_table("shards", db=db)
+    if table.exists() is False:
+        return []
+
+    return list(table.rows_where(order_by="key"))
+
+
+def get_shard_key(status: Dict[str, Any], period: str) -> str:
+    """
+    Returns the key of the shard a status belongs to, from when it was
+    created.
+    """
+    epoch = service.get_epoch(status.get("created_at"))
+    if epoch is None:
+        epoch = int(service.get_snowflake_datetime(status["id"]).timestamp())
+
+    return datetime.datetime.fromtimestamp(
+        epoch, tz=datetime.timezone.utc
+    ).strftime(SHARD_PERIODS[period])
+
+
+def get_shard_schema(key: str) -> str:
+    return f"shard_{key.replace('-', '_')}"
+
+
+def get_shard(db: Database, key: str) -> Dict[str, Any]:
+    """
+    Returns the catalog's shard for the key.
+    """
+    for shard in get_shards(db):
+        if shard["key"] == key:
+            return shard
+
+    raise ShardError(f"There is no {key} shard.")
+
+
+def open_shard(db: Database, key: str, writable: bool = True) -> Database:
+    """
+    Open the catalog's shard for the key, creating it if it doesn't exist. A
+    ShardError is raised for writes to a frozen shard.
+    """
+    shards_table = service.get_table("shards", db=db)
+    catalog_path = get_catalog_path(db)
+
+    shard = next(
+        (shard for shard in get_shards(db) if shard["key"] == key), None
+    )
+    if shard is None:
+        shard = {
+            "key": key,
+            "file_name": f"{catalog_path.stem}-{key}{catalog_path.suffix}",
+            "frozen": 0,
+        }
+        shards_table.insert(shard, pk="key")
+    elif shard["frozen"] and writable:
+        raise ShardError(
+            f"The {key} shard is frozen, thaw it before writing to it."
+        )
+
+    shard_db = service.open_database(catalog_path.parent / shard["file_name"])
+    service.build_database(shard_db)
+    return shard_db
+
+
+def create_catalog(db: Database, period: str):
+    """
+    Make the database a shard catalog, so statuses and activities are saved in
+    shards by the period they were created in.
+    """
+    current_period = get_shard_period(db)
+    if current_period is not None and current_period != period:
+        raise ShardError(
+            f"The database is already sharded by {current_period}."
+        )
+
+    # A year of month shards is already more than SQLite attaches by default.
+    attach_limit = raise_attach_limit(db)
+    if period == "month" and attach_limit <= DEFAULT_MAX_ATTACHED:
+        raise ShardError(
+            f"SQLite can only attach {attach_limit} databases, too few to read"
+            " month shards together, shard by year instead."
+        )
+
+    get_catalog_path(db)
+    service.build_database(db)
+    service.set_setting(db, "shard_period", period)
+    if service.get_table("shards", db=db).exists() is False:
+        service.get_table("shards", db=db).create(
+            columns={"key": str, "file_name": str, "frozen": int}, pk="key"
+        )
+
+
+def save_statuses(db: Database, statuses: List[Dict[str, Any]]):
+    """
+    Save Mastodon Statuses to the catalog's shards.
+    """
+    period = get_shard_period(db)
+    assert period is not None
+
+    groups = defaultdict(list)
+    for status in statuses:
+        groups[get_shard_key(status, period)].append(status)
+
+    for key, group in groups.items():
+        shard_db = open_shard(db, key)
+        try:
+            with service.write_transaction(shard_db):
+                service.save_statuses(shard_db, group)
+        finally:
+            shard_db.close()
+
+
+def save_activities(
+    db: Database, account_id: str, activity: str, statuses: List[Dict[str, Any]]
+):
+    """
+    Save Mastodon activities to the shards of the statuses they are on.
+    """
+    period = get_shard_period(db)
+    assert period is not None
+
+    groups = defaultdict(list)
+    for status in statuses:
+        groups[get_shard_key(status, period)].append(status)
+
+    for key, group in groups.items():
+        shard_db = open_shard(db, key)
+        try:
+            with service.write_transaction(shard_db):
+                service.save_activities(shard_db, account_id, activity, group)
+        finally:
+            shard_db.close()
+
+
+def save_activity_status_ids(
+    db: Database, account_id: str, activity: str, status_ids: List[str]
+) -> int:
+    """
+    Save Mastodon activities for statuses that are already in the catalog or
+    its shards, by ID. Statuses in frozen shards are skipped. Returns the
+    number of activities saved.
+    """
+    saved = service.save_activity_status_ids(
+        db, account_id, activity, status_ids
+    )
+
+    for shard in get_shards(db):
+        if shard["frozen"]:
+            continue
+
+        shard_db = open_shard(db, shard["key"])
+        try:
+            with service.write_transaction(shard_db):
+                saved += service.save_activity_status_ids(
+                    shard_db, account_id, activity, status_ids
+                )
+        finally:
+            shard_db.close()
+
+    return saved
+
+
+def save_notifications(
+    db: Database, account_id: str, notifications: List[Dict[str, Any]]
+):
+    """
+    Save Mastodon notifications to the catalog, and their statuses to the
+    shards.
+    """
+    service.save_notifications(
+        db, account_id, notifications, save_statuses_func=save_statuses
+    )
+
+
+def save_home_timeline(
+    db: Database, account_id: str, statuses: List[Dict[str, Any]]
+):
+    """
+    Save the home timeline to the catalog, and its statuses to the shards.
+    """
+    service.save_home_timeline(
+        db, account_id, statuses, save_statuses_func=save_statuses
+    )
+
+
+def save_status_context(
+    db: Database, status_id: str, context: Dict[str, List[Dict[str, Any]]]
+):
+    """
+    Save the thread around a Mastodon status to the catalog, and its statuses
+    to the shards.
+    """
+    service.save_status_context(
+        db, status_id, context, save_statuses_func=save_statuses
+    )
+
+
+def get_thread_status_ids(
+    db: Database,
+    account_id: str,
+    sources: Iterable[str] = ("statuses", "bookmarks", "favourites"),
+    ttl: Optional[datetime.timedelta] = None,
+) -> List[int]:
+    """
+    Get the IDs of statuses in the catalog and its shards whose threads should
+    be archived. The threads fetched are recorded in the catalog.
+    """
+    status_ids = set(service.get_thread_status_ids(db, account_id, sources))
+
+    for shard in get_shards(db):
+        shard_db = open_shard(db, shard["key"], writable=False)
+        try:
+            status_ids.update(
+                service.get_thread_status_ids(shard_db, account_id, sources)
+            )
+        finally:
+            shard_db.close()
+
+    if ttl is not None:
+        status_ids -= service.get_fetched_status_ids(db, ttl)
+
+    return sorted(status_ids, reverse=True)
+
+
+def iter_shard_databases(db: Database) -> Generator[Database, None, None]:
+    """
+    Open the catalog's shards for reading one at a time, oldest first,
+    closing each once the next is asked for.
+    """
+    for shard in get_shards(db):
+        shard_db = open_shard(db, shard["key"], writable=False)
+        try:
+            yield shard_db
+        finally:
+            shard_db.close()
+
+
+def count_account_statuses(db: Database, account_id: str) -> int:
+    """
+    Returns the number of the account's statuses saved in the catalog and its
+    shards.
+    """
+    return service.count_account_statuses(db, account_id) + sum(
+        service.count_account_statuses(shard_db, account_id)
+        for shard_db in iter_shard_databases(db)
+    )
+
+
+def get_dangling_account_ids(db: Database) -> List[str]:
+    """
+    Get the IDs of the accounts referenced in the catalog or its shards but
+    not saved in the catalog, where the accounts are.
+    """
+    account_ids = set(service.get_dangling_account_ids(db))
+
+    for shard_db in iter_shard_databases(db):
+        # A shard has no accounts, so every account it references is a
+        # candidate.
+        candidates = service.get_dangling_account_ids(shard_db)
+        existing = service.get_existing_keys(
+            db,
+            "accounts",
+            ("id",),
+            [(account_id,) for account_id in candidates],
+        )
+        account_ids.update(
+            account_id
+            for account_id in candidates
+            if (account_id,) not in existing
+        )
+
+    return sorted(account_ids, key=int)
+
+
+def get_most_recent_status_id(db: Database) -> Optional[int]:
+    """
+    Get the most recent status ID from the catalog and its shards.
+    """
+    most_recent = None
+
+    # The catalog first, then the shards newest first, stopping at the first
+    # shard with statuses.
+    for shard in [None, *reversed(get_shards(db))]:
+        shard_db = db
+        if shard is not None:
+            shard_db = open_shard(db, shard["key"], writable=False)
+
+        try:
+            status_id = service.get_most_recent_status_id(shard_db)
+        finally:
+            if shard_db is not db:
+                shard_db.close()
+
+        if status_id is None:
+            continue
+        if most_recent is None or status_id > most_recent:
+            most_recent = status_id
+        if shard is not None:
+            break
+
+    return most_recent
+
+
+def move_rows_to_shard(db: Database, key: str, period: str) -> Dict[str, int]:
+    """
+    Move the catalog's statuses and activities created in the key's period to
+    its shard, returning the number of rows moved per table.
+    """
+    shard_db = open_shard(db, key)
+    shard_path = get_catalog_path(shard_db)
+    shard_db.close()
+
+    in_period = f"strftime('{SHARD_PERIODS[period]}', {{}}, 'unixepoch') = ?"
+    statuses_where = in_period.format("created_at_epoch")
+    activities_where = (
+        "(status_id) IN (SELECT status_activities.status_id"
+        " FROM main.status_activities"
+        " LEFT JOIN main.statuses ON statuses.id = status_activities.status_id"
+        f" WHERE {in_period.format(ACTIVITY_EPOCH_SQL)})"
+    )
+
+    counts = {}
+    db.execute("ATTACH DATABASE ? AS shard", [str(shard_path)])
+    try:
+        with service.write_transaction(db):
+            for table_name, where in (
+                # Activities first, their statuses are needed to shard them.
+                ("status_activities", activities_where),
+                ("statuses", statuses_where),
+            ):
+                table = service.get_table(table_name, db=db)
+                columns = ", ".join(
+                    f"[{column}]" for column in table.columns_dict
+                )
+                updates = ", ".join(
+                    f"[{column}] = excluded.[{column}]"
+                    for column in table.columns_dict
+                    if column not in table.pks
+                )
+                conflict = ", ".join(f"[{pk}]" for pk in table.pks)
+                # Shards have no codec settings to decompress the content with.
+                select = columns.replace("[content]", "decompress([content])")
+
+                db.conn.execute(
+                    f"INSERT INTO shard.[{table_name}] ({columns})"
+                    f" SELECT {select} FROM main.[{table_name}] WHERE {where}"
+                    f" ON CONFLICT ({conflict}) DO "
+                    + (f"UPDATE SET {updates}" if updates else "NOTHING"),
+                    [key],
+                )
+                counts[table_name] = db.conn.execute(
+                    f"DELETE FROM main.[{table_name}] WHERE {where}", [key]
+                ).rowcount
+    finally:
+        db.execute("DETACH DATABASE shard")
+
+    return counts
+
+
+def split_database(db: Database) -> Dict[str, Dict[str, int]]:
+    """
+    Move the catalog's statuses and activities into their shards, skipping the
+    frozen ones, and rebuild the aggregate tables. Returns the number of rows
+    moved per shard and table.
+    """
+    period = get_shard_period(db)
+    if period is None:
+        raise ShardError("The database isn't a shard catalog.")
+
+    in_period = f"strftime('{SHARD_PERIODS[period]}', {{}}, 'unixepoch')"
+    keys = {
+        row[0]
+        for row in db.execute(
+            f"SELECT DISTINCT {in_period.format('created_at_epoch')}"
+            " FROM statuses"
+            f" UNION SELECT DISTINCT {in_period.format(ACTIVITY_EPOCH_SQL)}"
+            " FROM status_activities"
+            " LEFT JOIN statuses ON statuses.id = status_activities.status_id"
+        )
+        if row[0] is not None
+    }
+    frozen = {shard["key"] for shard in get_shards(db) if shard["frozen"]}
+
+    moved = {}
+    for key in sorted(keys - frozen):
+        moved[key] = move_rows_to_shard(db, key, period)
+
+        shard_db = open_shard(db, key)
+        try:
+            service.rebuild_aggregates(shard_db)
+        finally:
+            shard_db.close()
+
+    service.rebuild_aggregates(db)
+    return moved
+
+
+def freeze_shard(db: Database, key: str) -> Dict[str, Any]:
+    """
+    Vacuum a shard and mark it frozen, so it's attached read-only and isn't
+    written to again. Returns the maintenance report.
+    """
+    get_shard(db, key)
+
+    shard_db = open_shard(db, key)
+    try:
+        report = service.maintain_database(shard_db, full_vacuum=True)
+    finally:
+        shard_db.close()
+
+    service.get_table("shards", db=db).update(key, {"frozen": 1})
+    return report
+
+
+def thaw_shard(db: Database, key: str):
+    """
+    Mark a frozen shard writable again.
+    """
+    get_shard(db, key)
+    service.get_table("shards", db=db).update(key, {"frozen": 0})
+
+
+def attach_shards(db: Database) -> List[str]:
+    """
+    Attach the catalog's shards and create TEMP views with the same names as
+    the sharded tables, combining the rows in the catalog and in each shard.
+    Frozen shards are attached read-only, and a TEMP statuses_decoded view
+    reads the combined statuses. The views replace the tables for this
+    connection, so use it for reading only. Full-text searches can't MATCH
+    the statuses_fts view, they need to search each of the returned schemas.
+    A ShardError is raised if there are more shards than SQLite can attach.
+    """
+    catalog_path = get_catalog_path(db)
+    shards = [
+        shard
+        for shard in get_shards(db)
+        if (catalog_path.parent / shard["file_name"]).exists()
+    ]
+    schemas = ["main"]
+
+    attach_limit = raise_attach_limit(db)
+    if len(shards) > attach_limit:
+        raise ShardError(
+            f"The catalog has {len(shards)} shards but SQLite can only attach"
+            f" {attach_limit} databases."
+        )
+
+    for shard in shards:
+        schema = get_shard_schema(shard["key"])
+        shard_path = catalog_path.parent / shard["file_name"]
+        location = str(shard_path)
+        if shard["frozen"]:
+            location = f"{shard_path.absolute().as_uri()}?mode=ro"
+
+        try:
+            db.execute(f"ATTACH DATABASE ? AS [{schema}]", [location])
+        except sqlite3.OperationalError as exc:
+            raise ShardError(f"Couldn't attach the {shard['key']} shard: {exc}")
+        schemas.append(schema)
+
+    views = {
+        table_name: list(service.get_table(table_name, db=db).columns_dict)
+        for table_name in SHARDED_TABLES
+    }
+    views["statuses_fts"] = ["rowid", "content_text"]
+
+    for view_name, columns in views.items():
+        select = ", ".join(f"[{column}]" for column in columns)
+        db.execute(f"DROP VIEW IF EXISTS temp.[{view_name}]")
+        db.execute(
+            f"CREATE TEMP VIEW [{view_name}] AS "
+            + " UNION ALL ".join(
+                f"SELECT {select} FROM [{schema}].[{view_name}]"
+                for schema in schemas
+            )
+        )
+
+    # Over the TEMP statuses view, so it reads the shards' statuses too.
+    db.execute("DROP VIEW IF EXISTS temp.statuses_decoded")
+    db.execute(
+        "CREATE TEMP VIEW statuses_decoded AS " + service.STATUSES_DECODED_SQL
+    )
+
+    return schemas
@@ -1,8 +1,55 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 from sqlite_utils.db import Database
 
+from . import fixtures
+
 
 @pytest.fixture
 def mock_db() -> Database:
     db = Database(memory=True)
     return db
+
+
+@pytest.fixture
+def fake_mastodon_server():
+    """
+    A local HTTP/1.1 server answering every GET with a JSON account, that
+    counts the connections opened to it.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with server.lock:
+                server.connections += 1
+
+        def do_GET(self):
+            body = json.dumps(fixtures.ACCOUNT_ONE).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connections = 0
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
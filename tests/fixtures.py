@@ -40,3 +40,29 @@ STATUS_TWO = {
     "bookmarked": True,
     "favourited": False,
 }
+
+STATUS_THREE = {
+    "id": "3",
+    "created_at": "2021-12-20T21:46:29.073Z",
+    "content": "Mathematical!",
+    "account": ACCOUNT_TWO,
+    "bookmarked": False,
+    "favourited": False,
+    "replies_count": 0,
+    "reblogs_count": 0,
+}
+
+NOTIFICATION_ONE = {
+    "id": "10",
+    "type": "favourite",
+    "created_at": "2021-12-20T22:46:29.073Z",
+    "account": ACCOUNT_TWO,
+    "status": STATUS_ONE,
+}
+
+NOTIFICATION_TWO = {
+    "id": "11",
+    "type": "follow",
+    "created_at": "2021-12-20T23:46:29.073Z",
+    "account": ACCOUNT_TWO,
+}
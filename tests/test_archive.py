@@ -0,0 +1,132 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from mastodon_to_sqlite import archive, service, shards
+
+from . import fixtures
+
+ACTOR = {
+    "id": "https://mastodon.ooo/users/finn",
+    "type": "Person",
+    "preferredUsername": "finn",
+    "name": "Finn the Human",
+    "summary": "Homies help homies. ALWAYS.",
+    "url": "https://mastodon.ooo/@finn",
+}
+
+OUTBOX = {
+    "@context": "https://www.w3.org/ns/activitystreams",
+    "id": "outbox.json",
+    "type": "OrderedCollection",
+    "totalItems": 3,
+    "orderedItems": [
+        {
+            "type": "Create",
+            "object": {
+                "id": "https://mastodon.ooo/users/finn/statuses/109",
+                "published": "2022-11-05T12:00:00Z",
+                "content": "<p>Mathematical!</p>",
+            },
+        },
+        {
+            "type": "Announce",
+            "object": "https://other.example/users/jake/statuses/42",
+        },
+        {
+            "type": "Create",
+            "object": {
+                "id": "https://mastodon.ooo/users/finn/statuses/110",
+                "published": "2022-11-06T12:00:00Z",
+                "content": "<p>Algebraic!</p>",
+            },
+        },
+    ],
+}
+
+LIKES = {
+    "type": "OrderedCollection",
+    "orderedItems": [
+        "https://mastodon.ooo/users/finn/statuses/110",
+        "https://other.example/users/jake/statuses/42",
+    ],
+}
+
+
+@pytest.fixture
+def archive_path(tmp_path):
+    path = tmp_path / "archive.zip"
+
+    with zipfile.ZipFile(path, "w") as archive_zip:
+        archive_zip.writestr("actor.json", json.dumps(ACTOR))
+        archive_zip.writestr("outbox.json", json.dumps(OUTBOX, indent=2))
+        archive_zip.writestr("likes.json", json.dumps(LIKES))
+
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 64 * 1024))
+def test_iter_json_array(chunk_size):
+    document = json.dumps(
+        {
+            "totalItems": 4,
+            "orderedItems": [{"id": 1, "content": "a ] b"}, 12345, "x", []],
+            "after": [0],
+        },
+        indent=2,
+    )
+
+    items = list(
+        archive.iter_json_array(
+            io.StringIO(document), "orderedItems", chunk_size=chunk_size
+        )
+    )
+
+    assert items == [{"id": 1, "content": "a ] b"}, 12345, "x", []]
+
+
+def test_iter_json_array__missing_key():
+    assert list(archive.iter_json_array(io.StringIO("{}"), "items")) == []
+
+
+def test_import_archive(archive_path, mock_db):
+    counts = archive.import_archive(mock_db, archive_path, account_id="1")
+
+    assert counts == {
+        "statuses": 2,
+        "favourited": 1,
+        "bookmarked": 0,
+        "skipped": 1,
+    }
+    assert mock_db["accounts"].get(1)["username"] == "finn"
+    assert mock_db["statuses"].get(110)["content_text"] == "Algebraic!"
+    assert list(mock_db["status_activities"].rows) == [
+        {"account_id": 1, "activity": "favourited", "status_id": 110}
+    ]
+
+
+def test_import_archive__account_id_from_url(archive_path, mock_db):
+    with pytest.raises(archive.ArchiveError):
+        archive.import_archive(mock_db, archive_path)
+
+    service.save_accounts(mock_db, [fixtures.ACCOUNT_ONE.copy()])
+    archive.import_archive(mock_db, archive_path)
+
+    assert {row["account_id"] for row in mock_db["statuses"].rows} == {1}
+
+
+def test_import_archive__shard_catalog(archive_path, tmp_path):
+    db = service.open_database(str(tmp_path / "mastodon.db"))
+    shards.create_catalog(db, "year")
+
+    counts = archive.import_archive(db, archive_path, account_id="1")
+
+    assert counts["statuses"] == 2
+    assert counts["favourited"] == 1
+    assert db["statuses"].count == 0
+
+    shard_db = service.open_database(str(tmp_path / "mastodon-2022.db"))
+    assert shard_db["statuses"].count == 2
+    assert shard_db["status_activities"].count == 1
@@ -1,7 +1,11 @@
+import copy
+
 import pytest
 from click.testing import CliRunner
 
-from mastodon_to_sqlite import cli
+from mastodon_to_sqlite import cli, service
+
+from . import fixtures
 
 
 @pytest.mark.parametrize(
@@ -25,3 +29,334 @@ def test_verify_auth(
     )
 
     assert result.stdout.startswith(expected_stdout_startswith)
+
+
+def test_maintain(tmp_path):
+    db_path = str(tmp_path / "mastodon.db")
+    service.build_database(service.open_database(db_path))
+
+    runner = CliRunner()
+    result = runner.invoke(cli.maintain, [db_path])
+
+    assert result.exit_code == 0
+    assert "integrity check:" in result.stdout
+    assert result.stdout.strip().endswith("bytes after.")
+
+
+def test_cli__transport_options(mocker):
+    mock_verify_auth = mocker.patch(
+        "mastodon_to_sqlite.cli.service.verify_auth", return_value=True
+    )
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli,
+        [
+            "--pool-size",
+            "20",
+            "--max-connections",
+            "4",
+            "--no-compression",
+            "--read-timeout",
+            "5",
+            "verify-auth",
+            "--auth",
+            "tests/fixture-auth.json",
+        ],
+    )
+
+    assert result.exit_code == 0
+    transport = mock_verify_auth.call_args.kwargs["transport"]
+    assert transport.pool_maxsize == 20
+    assert transport.max_connections == 4
+    assert transport.compression is False
+    assert transport.timeout == (10.0, 5.0)
+
+
+def test_statuses__batch_size(mocker, tmp_path):
+    mocker.patch("mastodon_to_sqlite.cli.service.get_client")
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_authenticated_account",
+        return_value=fixtures.ACCOUNT_ONE.copy(),
+    )
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_statuses",
+        return_value=iter(
+            [
+                [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()],
+                [fixtures.STATUS_THREE.copy()],
+            ]
+        ),
+    )
+    mock_save_statuses = mocker.patch(
+        "mastodon_to_sqlite.cli.service.save_statuses",
+        wraps=service.save_statuses,
+    )
+    db_path = str(tmp_path / "mastodon.db")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli,
+        [
+            "--batch-size",
+            "5",
+            "statuses",
+            db_path,
+            "--auth",
+            "tests/fixture-auth.json",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert mock_save_statuses.call_count == 1
+    assert service.open_database(db_path)["statuses"].count == 3
+
+
+def test_sync__plan(mocker, tmp_path):
+    mocker.patch("mastodon_to_sqlite.cli.service.get_client")
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_authenticated_account",
+        return_value={
+            **fixtures.ACCOUNT_ONE,
+            "statuses_count": 10,
+            "followers_count": 0,
+            "following_count": 0,
+        },
+    )
+    mock_statuses = mocker.patch("mastodon_to_sqlite.cli.service.get_statuses")
+    db_path = str(tmp_path / "mastodon.db")
+    db = service.open_database(db_path)
+    service.save_sync_state(db, fixtures.ACCOUNT_ONE["id"], "followers", 0)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.sync, [db_path, "--auth", "tests/fixture-auth.json", "--plan"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert result.stdout.splitlines() == [
+        "statuses: full (never synced), ~2 requests",
+        "followers: skip (unchanged at 0), ~0 requests",
+        "followings: full (never synced), ~2 requests",
+        "Total: ~5 requests, ~0s waiting for the rate limit.",
+    ]
+    mock_statuses.assert_not_called()
+
+
+def test_sync(mocker, tmp_path):
+    mocker.patch("mastodon_to_sqlite.cli.service.get_client")
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_authenticated_account",
+        side_effect=lambda client: {
+            **fixtures.ACCOUNT_ONE,
+            "statuses_count": 1,
+            "followers_count": 0,
+            "following_count": 0,
+        },
+    )
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_statuses",
+        return_value=iter([[fixtures.STATUS_ONE.copy()]]),
+    )
+    db_path = str(tmp_path / "mastodon.db")
+    db = service.open_database(db_path)
+    for endpoint in ("followers", "followings"):
+        service.save_sync_state(db, fixtures.ACCOUNT_ONE["id"], endpoint, 0)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli, ["sync", db_path, "--auth", "tests/fixture-auth.json"]
+    )
+
+    assert result.exit_code == 0, result.output
+    state = service.get_sync_state(db, fixtures.ACCOUNT_ONE["id"])
+    assert state["statuses"]["remote_count"] == 1
+    assert db["statuses"].count == 1
+
+
+def test_cli__wait_for_lock(tmp_path):
+    db_path = str(tmp_path / "mastodon.db")
+    service.build_database(service.open_database(db_path))
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli,
+        [
+            "--wait-for-lock",
+            "--lock-timeout",
+            "1",
+            "rebuild-aggregates",
+            db_path,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "for the database lock." in result.output
+
+    with service.DatabaseLock(db_path):
+        result = runner.invoke(
+            cli.cli,
+            [
+                "--wait-for-lock",
+                "--lock-timeout",
+                "0.2",
+                "rebuild-aggregates",
+                db_path,
+            ],
+        )
+    assert result.exit_code == 1
+    assert "Timed out" in result.output
+
+
+def test_shard(tmp_path):
+    db_path = str(tmp_path / "mastodon.db")
+    service.save_statuses(
+        service.open_database(db_path), [fixtures.STATUS_ONE.copy()]
+    )
+
+    runner = CliRunner()
+    result = runner.invoke(cli.cli, ["shard", db_path, "--freeze", "2021"])
+
+    assert result.exit_code == 0, result.output
+    assert "Moved 1 statuses and 0 activities to the 2021 shard." in (
+        result.output
+    )
+    assert "Froze the 2021 shard." in result.output
+    assert (tmp_path / "mastodon-2021.db").exists()
+
+    result = runner.invoke(cli.cli, ["shard", db_path, "--period", "month"])
+    assert result.exit_code == 1
+    assert "already sharded by year" in result.output
+
+
+def test_notifications__resumes_from_cursor(mocker, tmp_path):
+    mocker.patch("mastodon_to_sqlite.cli.service.get_client")
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_authenticated_account",
+        side_effect=lambda client: fixtures.ACCOUNT_ONE.copy(),
+    )
+
+    def interrupted(client, min_id):
+        yield [copy.deepcopy(fixtures.NOTIFICATION_ONE)]
+        raise KeyboardInterrupt
+
+    mock_get_notifications = mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_notifications",
+        side_effect=interrupted,
+    )
+    db_path = str(tmp_path / "mastodon.db")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.notifications, [db_path, "--auth", "tests/fixture-auth.json"]
+    )
+    assert result.exit_code != 0
+
+    mock_get_notifications.side_effect = lambda client, min_id: iter(
+        [[copy.deepcopy(fixtures.NOTIFICATION_TWO)]]
+    )
+    result = runner.invoke(
+        cli.notifications, [db_path, "--auth", "tests/fixture-auth.json"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert mock_get_notifications.call_args.kwargs["min_id"] == "10"
+    db = service.open_database(db_path)
+    assert db["notifications"].count == 2
+    assert service.get_import_cursor(db, "1", "notifications") == "11"
+
+
+def test_notifications__page_and_cursor_saved_together(mocker, tmp_path):
+    mocker.patch("mastodon_to_sqlite.cli.service.get_client")
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_authenticated_account",
+        side_effect=lambda client: fixtures.ACCOUNT_ONE.copy(),
+    )
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_notifications",
+        side_effect=lambda client, min_id: iter(
+            [[copy.deepcopy(fixtures.NOTIFICATION_ONE)]]
+        ),
+    )
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.save_import_cursor",
+        side_effect=ValueError("Failed after saving the page"),
+    )
+    db_path = str(tmp_path / "mastodon.db")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.notifications, [db_path, "--auth", "tests/fixture-auth.json"]
+    )
+
+    assert isinstance(result.exception, ValueError)
+    db = service.open_database(db_path)
+    assert db["notifications"].count == 0
+
+
+def test_home__maintain(mocker, tmp_path):
+    mocker.patch("mastodon_to_sqlite.cli.service.get_client")
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_authenticated_account",
+        side_effect=lambda client: fixtures.ACCOUNT_ONE.copy(),
+    )
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_home_timeline",
+        return_value=iter([[fixtures.STATUS_ONE.copy()]]),
+    )
+    db_path = str(tmp_path / "mastodon.db")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.home, [db_path, "--auth", "tests/fixture-auth.json", "--maintain"]
+    )
+
+    assert result.exit_code == 0, result.output
+    db = service.open_database(db_path)
+    assert service.get_import_cursor(db, "1", "home") == "1"
+    assert "integrity check:" in result.output
+
+
+@pytest.mark.parametrize(
+    "command, followed_id, follower_id",
+    (
+        ("followers", fixtures.ACCOUNT_ONE["id"], fixtures.ACCOUNT_TWO["id"]),
+        ("followings", fixtures.ACCOUNT_TWO["id"], fixtures.ACCOUNT_ONE["id"]),
+    ),
+)
+def test_followers(command, followed_id, follower_id, mocker, tmp_path):
+    mocker.patch("mastodon_to_sqlite.cli.service.get_client")
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_authenticated_account",
+        return_value=fixtures.ACCOUNT_ONE.copy(),
+    )
+    for getter in ("get_followers", "get_followings"):
+        mocker.patch(
+            f"mastodon_to_sqlite.cli.service.{getter}",
+            return_value=iter([[fixtures.ACCOUNT_TWO.copy()]]),
+        )
+    db_path = str(tmp_path / "mastodon.db")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.cli, [command, db_path, "--auth", "tests/fixture-auth.json"]
+    )
+
+    assert result.exit_code == 0, result.output
+    row = next(service.open_database(db_path)["following"].rows)
+    assert (row["followed_id"], row["follower_id"]) == (
+        int(followed_id),
+        int(follower_id),
+    )
+
+
+def test_export__invalid_since(tmp_path):
+    db_path = str(tmp_path / "mastodon.db")
+    service.build_database(service.open_database(db_path))
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.export, [db_path, str(tmp_path / "export"), "--since", "yesterday"]
+    )
+
+    assert result.exit_code == 2
+    assert "isn't an ISO-8601 timestamp" in result.output
@@ -1,9 +1,13 @@
 import datetime
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import pytest
 import responses
 from responses import matchers
 
-from mastodon_to_sqlite.client import MastodonClient
+from mastodon_to_sqlite.client import MastodonClient, TransportConfig
 
 from . import fixtures
 
@@ -136,3 +140,313 @@ def test_mastodon_client__request_paginated__rate_limit(mocker):
     list(client.request_paginated("GET", path))
 
     mock_sleep.assert_called_once_with(3690)
+
+
+@responses.activate
+def test_mastodon_client__statuses_context():
+    domain = "mastodon.example"
+    access_token = "IAmAnAccessToken"
+    url = f"https://{domain}/api/v1/statuses/2/context"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=url,
+            json={
+                "ancestors": [fixtures.STATUS_ONE],
+                "descendants": [fixtures.STATUS_THREE],
+            },
+        )
+    )
+
+    client = MastodonClient(domain=domain, access_token=access_token)
+    _, response = client.statuses_context("2")
+
+    assert response.json()["ancestors"][0]["id"] == fixtures.STATUS_ONE["id"]
+    assert responses.calls[-1].request.url == url
+
+
+@responses.activate
+def test_mastodon_client__notifications__forward_paging():
+    domain = "mastodon.example"
+    access_token = "IAmAnAccessToken"
+    url = f"https://{domain}/api/v1/notifications"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=url,
+            headers={
+                "Link": (
+                    f'<{url}?max_id=10>; rel="next",'
+                    f' <{url}?min_id=11>; rel="prev"'
+                )
+            },
+            match=[matchers.query_string_matcher("limit=80&min_id=0")],
+            json=[fixtures.NOTIFICATION_TWO, fixtures.NOTIFICATION_ONE],
+        )
+    )
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=url,
+            match=[matchers.query_string_matcher("min_id=11")],
+            json=[],
+        )
+    )
+
+    client = MastodonClient(domain=domain, access_token=access_token)
+    pages = [response.json() for _, response in client.notifications()]
+
+    assert [len(page) for page in pages] == [2, 0]
+
+
+@responses.activate
+def test_mastodon_client__accounts():
+    domain = "mastodon.example"
+    access_token = "IAmAnAccessToken"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=f"https://{domain}/api/v1/accounts",
+            match=[
+                matchers.query_string_matcher("id%5B%5D=1&id%5B%5D=2"),
+            ],
+            json=[fixtures.ACCOUNT_ONE, fixtures.ACCOUNT_TWO],
+        )
+    )
+
+    client = MastodonClient(domain=domain, access_token=access_token)
+    _, response = client.accounts(["1", "2"])
+
+    assert [account["id"] for account in response.json()] == ["1", "2"]
+
+
+@responses.activate
+def test_mastodon_client__request__shared_rate_limit(mocker):
+    mock_now = datetime.datetime.now(datetime.timezone.utc)
+    rate_limit_reset_at = mock_now + datetime.timedelta(seconds=30)
+
+    mocker.patch(
+        "mastodon_to_sqlite.client.get_utc_now",
+        return_value=mock_now,
+    )
+    mock_sleep = mocker.patch(
+        "mastodon_to_sqlite.client.sleep", return_value=None
+    )
+
+    domain = "mastodon.example"
+    access_token = "IAmAnAccessToken"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=f"https://{domain}/api/v1/statuses/1/context",
+            headers={
+                "X-RateLimit-Remaining": "1",
+                "X-RateLimit-Reset": rate_limit_reset_at.isoformat(),
+            },
+            json={"ancestors": [], "descendants": []},
+        )
+    )
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=f"https://{domain}/api/v1/statuses/2/context",
+            headers={"X-RateLimit-Remaining": "299"},
+            json={"ancestors": [], "descendants": []},
+        )
+    )
+
+    client = MastodonClient(domain=domain, access_token=access_token)
+    client.statuses_context("1")
+    mock_sleep.assert_not_called()
+
+    client.statuses_context("2")
+    mock_sleep.assert_called_once_with(30)
+    assert client.rate_limit_remaining == 299
+
+
+@responses.activate
+def test_mastodon_client__request__rate_limit_reset_passed(mocker):
+    mock_now = datetime.datetime.now(datetime.timezone.utc)
+    rate_limit_reset_at = mock_now - datetime.timedelta(seconds=5)
+
+    mocker.patch(
+        "mastodon_to_sqlite.client.get_utc_now",
+        return_value=mock_now,
+    )
+    mock_sleep = mocker.patch(
+        "mastodon_to_sqlite.client.sleep", return_value=None
+    )
+
+    domain = "mastodon.example"
+    access_token = "IAmAnAccessToken"
+
+    responses.add(
+        responses.Response(
+            method="GET",
+            url=f"https://{domain}/api/v1/statuses/1/context",
+            headers={
+                "X-RateLimit-Remaining": "1",
+                "X-RateLimit-Reset": rate_limit_reset_at.isoformat(),
+            },
+            json={"ancestors": [], "descendants": []},
+        )
+    )
+
+    client = MastodonClient(domain=domain, access_token=access_token)
+    client.statuses_context("1")
+    client.wait_for_rate_limit()
+
+    mock_sleep.assert_not_called()
+    assert client.rate_limit_remaining is None
+
+
+@responses.activate
+def test_mastodon_client__transport_config():
+    domain = "mastodon.example"
+    url = f"https://{domain}/api/v1/accounts/verify_credentials"
+    responses.add(
+        responses.Response(method="GET", url=url, json=fixtures.ACCOUNT_ONE)
+    )
+
+    transport = TransportConfig(
+        pool_maxsize=32, connect_timeout=1.5, read_timeout=4.0
+    )
+    client = MastodonClient(
+        domain=domain, access_token="IAmAnAccessToken", transport=transport
+    )
+    client.accounts_verify_credentials()
+
+    adapter = client.session.get_adapter(url)
+    assert adapter._pool_maxsize == 32
+
+    call = responses.calls[-1]
+    assert "gzip" in call.request.headers["Accept-Encoding"]
+    assert call.request.req_kwargs["timeout"] == (1.5, 4.0)
+
+
+@responses.activate
+def test_mastodon_client__transport_config__no_compression():
+    domain = "mastodon.example"
+    url = f"https://{domain}/api/v1/accounts/verify_credentials"
+    responses.add(
+        responses.Response(method="GET", url=url, json=fixtures.ACCOUNT_ONE)
+    )
+
+    client = MastodonClient(
+        domain=domain,
+        access_token="IAmAnAccessToken",
+        transport=TransportConfig(compression=False),
+    )
+    client.accounts_verify_credentials()
+
+    call = responses.calls[-1]
+    assert call.request.headers["Accept-Encoding"] == "identity"
+
+
+def fetch_concurrently(client: MastodonClient, requests: int, workers: int):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(
+                lambda _: client.accounts_verify_credentials()[1],
+                range(requests),
+            )
+        )
+
+    assert all(response.status_code == 200 for response in results)
+
+
+@pytest.mark.parametrize("pool_maxsize", (1, 8))
+def test_mastodon_client__transport_benchmark(
+    pool_maxsize, fake_mastodon_server
+):
+    """
+    Fetch from the local fake server from eight threads, printing the
+    throughput and the number of connections opened (run with -s).
+    """
+    host, port = fake_mastodon_server.server_address
+    client = MastodonClient(
+        domain=f"{host}:{port}",
+        access_token="IAmAnAccessToken",
+        transport=TransportConfig(pool_maxsize=pool_maxsize),
+        scheme="http",
+    )
+
+    requests = 200
+    started_at = time.perf_counter()
+    fetch_concurrently(client, requests=requests, workers=8)
+    elapsed = time.perf_counter() - started_at
+
+    print(
+        f"pool_maxsize={pool_maxsize}: {requests / elapsed:.0f} requests/s,"
+        f" {fake_mastodon_server.connections} connections"
+    )
+
+    # A pool at least as large as the number of threads reuses every
+    # connection it opens.
+    if pool_maxsize >= 8:
+        assert fake_mastodon_server.connections <= 8
+
+
+def test_mastodon_client__max_connections(fake_mastodon_server):
+    host, port = fake_mastodon_server.server_address
+    client = MastodonClient(
+        domain=f"{host}:{port}",
+        access_token="IAmAnAccessToken",
+        transport=TransportConfig(max_connections=2),
+        scheme="http",
+    )
+
+    fetch_concurrently(client, requests=50, workers=8)
+
+    assert fake_mastodon_server.connections <= 2
+
+
+def test_mastodon_client__http2(fake_mastodon_server):
+    pytest.importorskip("httpx")
+
+    host, port = fake_mastodon_server.server_address
+    client = MastodonClient(
+        domain=f"{host}:{port}",
+        access_token="IAmAnAccessToken",
+        transport=TransportConfig(http2=True),
+        scheme="http",
+    )
+
+    _, response = client.accounts_verify_credentials()
+
+    assert response.status_code == 200
+    assert response.json() == fixtures.ACCOUNT_ONE
+
+
+def test_mastodon_client__http2_headers(mocker):
+    # A stand-in for httpx, so the headers sent over HTTP/2 can be checked
+    # without a server negotiating it.
+    httpx = mocker.MagicMock()
+    http_response = httpx.Client.return_value.request.return_value
+    http_response.status_code = 200
+    http_response.headers = {"Content-Type": "application/json"}
+    http_response.encoding = "utf-8"
+    http_response.content = b"{}"
+    mocker.patch.dict(sys.modules, {"httpx": httpx})
+
+    client = MastodonClient(
+        domain="mastodon.example",
+        access_token="IAmAnAccessToken",
+        transport=TransportConfig(http2=True),
+    )
+    _, response = client.request(
+        "GET", "accounts/verify_credentials", headers={"Keep-Alive": "5"}
+    )
+
+    assert response.status_code == 200
+    headers = httpx.Client.return_value.request.call_args.kwargs["headers"]
+    assert {name.lower() for name in headers} == {
+        "accept",
+        "accept-encoding",
+        "authorization",
+        "user-agent",
+    }
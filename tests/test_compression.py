@@ -0,0 +1,178 @@
+import sqlite3
+import time
+
+import pytest
+
+from mastodon_to_sqlite import export, query, service, shards
+from mastodon_to_sqlite.compression import ContentCodec
+
+from . import fixtures
+
+
+def get_statuses(count):
+    """
+    Statuses with the repetitive HTML Mastodon produces.
+    """
+    return [
+        {
+            "id": str(index),
+            "created_at": f"2022-01-{index % 28 + 1:02}T00:00:00.000Z",
+            "content": (
+                '<p><span class="h-card"><a href="https://mastodon.example/@'
+                f'friend{index % 50}" class="u-url mention">@<span>friend'
+                f"{index % 50}</span></a></span> Status number {index} about"
+                ' <a href="https://mastodon.example/tags/sqlite" class="mention'
+                ' hashtag" rel="tag">#<span>sqlite</span></a></p>'
+            ),
+            "account": fixtures.ACCOUNT_ONE,
+        }
+        for index in range(1, count + 1)
+    ]
+
+
+def test_content_codec():
+    codec = ContentCodec("zlib")
+    content = fixtures.STATUS_ONE["content"]
+
+    compressed = codec.compress(content)
+    assert isinstance(compressed, bytes)
+    assert codec.decompress(compressed) == content
+    assert codec.decompress(content) == content
+    assert codec.decompress(None) is None
+
+
+def test_content_codec__zstd():
+    pytest.importorskip("zstandard")
+    content = fixtures.STATUS_ONE["content"]
+
+    compressed = ContentCodec("zstd").compress(content)
+
+    # Any codec decompresses either format.
+    assert ContentCodec("zlib").decompress(compressed) == content
+
+
+@pytest.mark.parametrize("codec", ("zlib", "zstd"))
+def test_set_content_codec(codec, tmp_path):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+
+    db_path = tmp_path / "mastodon.db"
+    db = service.open_database(db_path)
+    service.save_accounts(db, [fixtures.ACCOUNT_ONE.copy()])
+    service.save_statuses(db, get_statuses(200))
+
+    sizes = service.set_content_codec(db, codec)
+    service.save_statuses(db, [fixtures.STATUS_ONE.copy()])
+
+    assert sizes["size_after"] < sizes["size_before"]
+    assert isinstance(db["statuses"].get(1)["content"], bytes)
+    assert db.execute(
+        "SELECT decompress(content) FROM statuses WHERE id = 1"
+    ).fetchone()[0] == (fixtures.STATUS_ONE["content"])
+
+    # The full-text search index is over the uncompressed plain text.
+    assert [
+        row["id"] for row in db["statuses"].search("piñatas", columns=["id"])
+    ] == [1]
+
+    with query.ArchiveReader(db_path) as reader:
+        page = reader.statuses_by_account(1, limit=1)
+    assert page.items[0].content.startswith("<p>")
+
+    columns, rows = next(export.iter_table_chunks(db, "statuses"))
+    assert all(isinstance(row[columns.index("content")], str) for row in rows)
+
+    service.set_content_codec(db, None)
+    assert db["statuses"].get(1)["content"] == fixtures.STATUS_ONE["content"]
+
+
+def test_save_activities__compressed(tmp_path):
+    db = service.open_database(tmp_path / "mastodon.db")
+    service.save_statuses(db, get_statuses(10))
+    service.set_content_codec(db, "zlib")
+
+    service.save_activities(db, "1", "favourited", [fixtures.STATUS_TWO.copy()])
+
+    assert isinstance(db["statuses"].get(2)["content"], bytes)
+    assert db.execute(
+        "SELECT content FROM statuses_decoded WHERE id = 2"
+    ).fetchone()[0] == (fixtures.STATUS_TWO["content"])
+
+
+@pytest.mark.parametrize("codec", ("zlib", "zstd"))
+def test_split_database__decompresses(codec, tmp_path):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+
+    db = service.open_database(tmp_path / "mastodon.db")
+    service.save_statuses(db, get_statuses(200))
+    service.set_content_codec(db, codec)
+    shards.create_catalog(db, "year")
+
+    shards.split_database(db)
+
+    # The shard is readable on its own, without the catalog's codec.
+    shard_db = service.open_database(tmp_path / "mastodon-2022.db")
+    assert shard_db["statuses"].get(1)["content"] == (
+        get_statuses(1)[0]["content"]
+    )
+
+    shards.attach_shards(db)
+    assert (
+        db.execute(
+            "SELECT count(*) FROM statuses_decoded WHERE content LIKE '<p>%'"
+        ).fetchone()[0]
+        == 200
+    )
+
+
+def test_datasette_prepare_connection(tmp_path):
+    pytest.importorskip("datasette")
+    from mastodon_to_sqlite import datasette_plugin
+
+    db_path = tmp_path / "mastodon.db"
+    db = service.open_database(db_path)
+    service.save_statuses(db, [fixtures.STATUS_ONE.copy()])
+    service.set_content_codec(db, "zlib")
+
+    conn = sqlite3.connect(db_path)
+    datasette_plugin.prepare_connection(conn)
+    assert conn.execute("SELECT content FROM statuses_decoded").fetchone() == (
+        fixtures.STATUS_ONE["content"],
+    )
+
+
+@pytest.mark.parametrize("codec", (None, "zlib", "zstd"))
+def test_content_codec_benchmark(codec, tmp_path):
+    """
+    Import statuses with the content stored uncompressed and with each codec,
+    printing the database size, import speed and query latency (run with -s).
+    """
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+
+    db_path = tmp_path / "mastodon.db"
+    db = service.open_database(db_path)
+    service.save_statuses(db, get_statuses(100))
+    if codec is not None:
+        service.set_content_codec(db, codec)
+
+    statuses = get_statuses(5_000)
+    started_at = time.perf_counter()
+    service.save_statuses(db, statuses)
+    import_seconds = time.perf_counter() - started_at
+
+    db.vacuum()
+    with query.ArchiveReader(db_path) as reader:
+        started_at = time.perf_counter()
+        for _ in range(20):
+            page = reader.statuses_by_account(1, limit=100)
+        query_ms = (time.perf_counter() - started_at) / 20 * 1000
+
+    print(
+        f"{codec or 'uncompressed'}: {db_path.stat().st_size} bytes, content"
+        f" {service.get_content_size(db)} bytes,"
+        f" {len(statuses) / import_seconds:.0f} statuses/s,"
+        f" {query_ms:.2f}ms per page"
+    )
+    assert page.items[0].content.startswith("<p>")
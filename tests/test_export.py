@@ -0,0 +1,100 @@
+import csv
+import json
+
+import pytest
+
+from mastodon_to_sqlite import export, service
+
+from . import fixtures
+
+
+@pytest.fixture
+def export_db(mock_db):
+    service.save_accounts(
+        mock_db, [fixtures.ACCOUNT_ONE.copy(), fixtures.ACCOUNT_TWO.copy()]
+    )
+    service.save_statuses(
+        mock_db, [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()]
+    )
+    return mock_db
+
+
+def test_iter_table_chunks(export_db):
+    chunks = list(export.iter_table_chunks(export_db, "statuses", chunk_size=1))
+
+    assert len(chunks) == 2
+    columns, rows = chunks[0]
+    assert columns[0] == "id"
+    assert len(rows) == 1
+
+
+def test_iter_table_chunks__since(export_db):
+    since_epoch = export.get_since_epoch(fixtures.STATUS_ONE["created_at"])
+    chunks = list(
+        export.iter_table_chunks(export_db, "statuses", since_epoch=since_epoch)
+    )
+
+    assert [row[0] for _, rows in chunks for row in rows] == [2]
+
+    # The watermark is an index range scan on the epoch column.
+    plan = export_db.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM statuses WHERE created_at_epoch > ?",
+        [since_epoch],
+    ).fetchall()
+    assert "USING INDEX" in plan[0][-1]
+
+
+def test_get_since_epoch():
+    assert export.get_since_epoch("2024-01-01") == 1704067200
+    assert export.get_since_epoch("2024-01-01T00:00:00.000Z") == 1704067200
+    assert export.get_since_epoch("2024-01-01T01:00:00+01:00") == 1704067200
+
+
+def test_export_database__ndjson(export_db, tmp_path):
+    counts = export.export_database(export_db, tmp_path, "ndjson")
+
+    assert counts == {
+        "statuses": 2,
+        "accounts": 2,
+        "following": 0,
+        "status_activities": 0,
+    }
+
+    with (tmp_path / "statuses.ndjson").open() as file_obj:
+        rows = [json.loads(line) for line in file_obj]
+
+    assert [row["id"] for row in rows] == [1, 2]
+    assert rows[0]["content"] == fixtures.STATUS_ONE["content"]
+
+
+def test_export_database__csv(export_db, tmp_path):
+    export.export_database(export_db, tmp_path, "csv", tables=["accounts"])
+
+    with (tmp_path / "accounts.csv").open() as file_obj:
+        rows = list(csv.DictReader(file_obj))
+
+    assert [row["username"] for row in rows] == ["finn", "jake"]
+    assert not (tmp_path / "statuses.csv").exists()
+
+
+@pytest.mark.parametrize("export_format", ("parquet", "arrow"))
+def test_export_database__arrow(export_format, export_db, tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    export.export_database(
+        export_db,
+        tmp_path,
+        export_format,
+        tables=["statuses"],
+        chunk_size=1,
+    )
+
+    path = str(tmp_path / f"statuses.{export_format}")
+    if export_format == "parquet":
+        table = pq.read_table(path)
+    else:
+        table = pa.ipc.open_file(path).read_all()
+
+    assert table.num_rows == 2
+    assert table.column("id").to_pylist() == [1, 2]
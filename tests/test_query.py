@@ -0,0 +1,219 @@
+import datetime
+
+import pytest
+from click.testing import CliRunner
+
+from mastodon_to_sqlite import cli, query, service, shards
+
+from . import fixtures
+
+UTC = datetime.timezone.utc
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "mastodon.db"
+    db = service.open_database(path)
+
+    service.save_accounts(
+        db, [fixtures.ACCOUNT_ONE.copy(), fixtures.ACCOUNT_TWO.copy()]
+    )
+    service.save_accounts(
+        db,
+        [fixtures.ACCOUNT_TWO.copy()],
+        followed_id=fixtures.ACCOUNT_ONE["id"],
+    )
+
+    start = datetime.datetime(2022, 1, 1, tzinfo=UTC)
+    statuses = []
+    for index in range(1, 11):
+        created_at = start + datetime.timedelta(days=index)
+        statuses.append(
+            {
+                "id": str(index),
+                "created_at": created_at.isoformat(),
+                "content": f"<p>Status number {index}</p>",
+                "account": fixtures.ACCOUNT_ONE
+                if index % 2
+                else fixtures.ACCOUNT_TWO,
+            }
+        )
+    service.save_activities(db, "1", "favourited", statuses)
+    db.conn.close()
+
+    return path
+
+
+def collect(fetch):
+    items, cursor = [], None
+    while True:
+        page = fetch(cursor)
+        items.extend(page.items)
+        if page.cursor is None:
+            return items
+        cursor = page.cursor
+
+
+def test_archive_reader__read_only(db_path):
+    with query.ArchiveReader(db_path) as reader:
+        with pytest.raises(Exception):
+            reader.conn.execute("DELETE FROM statuses")
+
+
+def test_archive_reader__timeline(db_path):
+    start = datetime.datetime(2022, 1, 3, tzinfo=UTC)
+    end = datetime.datetime(2022, 1, 9, tzinfo=UTC)
+
+    with query.ArchiveReader(db_path) as reader:
+        statuses = collect(
+            lambda cursor: reader.timeline(start, end, limit=2, cursor=cursor)
+        )
+
+    assert [status.id for status in statuses] == [7, 6, 5, 4, 3, 2]
+    assert isinstance(statuses[0], query.Status)
+
+
+def test_archive_reader__statuses_by_account(db_path):
+    with query.ArchiveReader(db_path) as reader:
+        statuses = collect(
+            lambda cursor: reader.statuses_by_account(1, limit=2, cursor=cursor)
+        )
+
+    assert [status.id for status in statuses] == [9, 7, 5, 3, 1]
+
+
+def test_archive_reader__search(db_path):
+    with query.ArchiveReader(db_path) as reader:
+        statuses = collect(
+            lambda cursor: reader.search("status", limit=3, cursor=cursor)
+        )
+        assert [s.id for s in reader.search("number 7").items] == [7]
+
+    assert [status.id for status in statuses] == list(range(10, 0, -1))
+
+
+def test_archive_reader__followers_as_of(db_path):
+    with query.ArchiveReader(db_path) as reader:
+        now = reader.followers_as_of(1, datetime.datetime.now(UTC))
+        before = reader.followers_as_of(1, datetime.datetime(2022, 1, 1))
+
+    assert [account.username for account in now.items] == ["jake"]
+    assert before.items == []
+
+
+def test_archive_reader__followers_as_of__imported(db_path, mocker):
+    mocker.patch("mastodon_to_sqlite.cli.service.get_client")
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_authenticated_account",
+        return_value=fixtures.ACCOUNT_ONE.copy(),
+    )
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_followers",
+        return_value=iter([[fixtures.ACCOUNT_TWO.copy()]]),
+    )
+    mocker.patch(
+        "mastodon_to_sqlite.cli.service.get_followings",
+        return_value=iter(
+            [[{**fixtures.ACCOUNT_TWO, "id": "3", "username": "bmo"}]]
+        ),
+    )
+
+    runner = CliRunner()
+    for command in ("followers", "followings"):
+        result = runner.invoke(
+            cli.cli,
+            [command, str(db_path), "--auth", "tests/fixture-auth.json"],
+        )
+        assert result.exit_code == 0, result.output
+
+    now = datetime.datetime.now(UTC)
+    with query.ArchiveReader(db_path) as reader:
+        followers = reader.followers_as_of(1, now)
+        followers_of_followed = reader.followers_as_of(3, now)
+
+    # The account followed by the authenticated account isn't a follower.
+    assert [account.username for account in followers.items] == ["jake"]
+    assert [account.username for account in followers_of_followed.items] == [
+        "finn"
+    ]
+
+
+def test_archive_reader__favourites_by_author(db_path):
+    with query.ArchiveReader(db_path) as reader:
+        statuses = collect(
+            lambda cursor: reader.favourites_by_author(
+                1, 2, limit=2, cursor=cursor
+            )
+        )
+
+    assert [status.id for status in statuses] == [10, 8, 6, 4, 2]
+
+
+def test_archive_reader__shard_catalog(db_path):
+    db = service.open_database(db_path)
+    shards.create_catalog(db, "year")
+    shards.split_database(db)
+    service.save_statuses(
+        db,
+        [
+            {
+                "id": "11",
+                "created_at": "2022-01-12T00:00:00+00:00",
+                "content": "<p>Status number 11</p>",
+                "account": fixtures.ACCOUNT_ONE,
+            }
+        ],
+    )
+    db.conn.close()
+
+    start = datetime.datetime(2022, 1, 3, tzinfo=UTC)
+    end = datetime.datetime(2022, 1, 9, tzinfo=UTC)
+    with query.ArchiveReader(db_path) as reader:
+        timeline = collect(
+            lambda cursor: reader.timeline(start, end, limit=2, cursor=cursor)
+        )
+        by_account = reader.statuses_by_account(1).items
+        found = collect(
+            lambda cursor: reader.search("status", limit=3, cursor=cursor)
+        )
+        favourites = reader.favourites_by_author(1, 2).items
+
+    assert [status.id for status in timeline] == [7, 6, 5, 4, 3, 2]
+    assert [status.id for status in by_account] == [11, 9, 7, 5, 3, 1]
+    assert [status.id for status in found] == list(range(11, 0, -1))
+    assert found[0].content == "<p>Status number 11</p>"
+    assert [status.id for status in favourites] == [10, 8, 6, 4, 2]
+
+
+@pytest.mark.parametrize(
+    "sql, params",
+    (
+        (
+            query.TIMELINE_SQL,
+            {"start": 0, "end": 1, "before_epoch": 1, "before_id": 1},
+        ),
+        (query.STATUSES_BY_ACCOUNT_SQL, {"account_id": 1, "before_id": 1}),
+        (query.SEARCH_SQL, {"query": "a", "before_id": 1}),
+        (
+            query.FOLLOWERS_AS_OF_SQL,
+            {"account_id": 1, "after_id": 0, "as_of": 0},
+        ),
+        (
+            query.FAVOURITES_BY_AUTHOR_SQL,
+            {"account_id": 1, "author_id": 1, "before_id": 1},
+        ),
+    ),
+)
+def test_archive_reader__query_plans_use_indexes(sql, params, db_path):
+    with query.ArchiveReader(db_path) as reader:
+        plan = [
+            row[-1]
+            for row in reader.conn.execute(
+                f"EXPLAIN QUERY PLAN {sql}", {**params, "limit": 10}
+            )
+        ]
+
+    for step in plan:
+        if step.startswith("SCAN"):
+            assert "VIRTUAL TABLE" in step or "INDEX" in step, plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
@@ -1,3 +1,10 @@
+import copy
+import datetime
+import sqlite3
+import threading
+
+import pytest
+
 from mastodon_to_sqlite import service
 
 from . import fixtures
@@ -62,6 +69,8 @@ def test_transformer_status():
         "id": fixtures.STATUS_ONE["id"],
         "created_at": fixtures.STATUS_ONE["created_at"],
         "content": fixtures.STATUS_ONE["content"],
+        "content_text": fixtures.STATUS_ONE["content"],
+        "created_at_epoch": 1640029589,
         "account_id": fixtures.STATUS_ONE["account"]["id"],
         "replies_count": fixtures.STATUS_ONE["replies_count"],
         "reblogs_count": fixtures.STATUS_ONE["reblogs_count"],
@@ -124,3 +133,782 @@ def test_get_most_recent_status_id(mock_db):
 
     result = service.get_most_recent_status_id(mock_db)
     assert result == int(status_two["id"])
+
+
+def test_get_status_contexts__dedupes_threads(mocker):
+    contexts = {
+        "1": {
+            "ancestors": [],
+            "descendants": [fixtures.STATUS_TWO, fixtures.STATUS_THREE],
+        },
+        "4": {"ancestors": [], "descendants": []},
+    }
+    mock_get_status_context = mocker.patch(
+        "mastodon_to_sqlite.service.get_status_context",
+        side_effect=lambda status_id, client: contexts[status_id],
+    )
+
+    result = list(
+        service.get_status_contexts([1, 1, 4], mocker.Mock(), max_workers=1)
+    )
+
+    assert [status_id for status_id, _ in result] == ["1", "4"]
+    assert mock_get_status_context.call_count == 2
+
+    mock_get_status_context.reset_mock()
+    result = list(
+        service.get_status_contexts([1, 2, 3], mocker.Mock(), max_workers=1)
+    )
+
+    assert [status_id for status_id, _ in result] == ["1"]
+    assert mock_get_status_context.call_count == 1
+
+
+def test_get_status_contexts__deleted_status(mock_db, mocker):
+    def statuses_context(status_id):
+        response = mocker.Mock(status_code=404 if status_id == "1" else 200)
+        response.json.return_value = {
+            "ancestors": [],
+            "descendants": [fixtures.STATUS_THREE],
+        }
+        return None, response
+
+    client = mocker.Mock()
+    client.statuses_context.side_effect = statuses_context
+
+    result = list(service.get_status_contexts([1, 2], client, max_workers=1))
+
+    assert result == [
+        ("1", {"ancestors": [], "descendants": []}),
+        ("2", {"ancestors": [], "descendants": [fixtures.STATUS_THREE]}),
+    ]
+
+    service.save_status_context(mock_db, *result[0])
+    assert service.get_fetched_status_ids(
+        mock_db, datetime.timedelta(hours=1)
+    ) == {1}
+
+
+def test_save_status_context(mock_db):
+    service.save_statuses(mock_db, [fixtures.STATUS_TWO.copy()])
+
+    service.save_status_context(
+        mock_db,
+        "2",
+        {
+            "ancestors": [fixtures.STATUS_ONE.copy()],
+            "descendants": [fixtures.STATUS_THREE.copy()],
+        },
+    )
+
+    assert mock_db["statuses"].count == 3
+    assert mock_db["accounts"].count == 2
+    assert list(
+        mock_db["status_context"].rows_where(order_by="related_status_id")
+    ) == [
+        {"status_id": 2, "related_status_id": 1, "relation": "ancestor"},
+        {"status_id": 2, "related_status_id": 3, "relation": "descendant"},
+    ]
+    assert mock_db["status_context_fetches"].count == 3
+
+
+def test_get_thread_status_ids(mock_db):
+    service.save_statuses(
+        mock_db, [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()]
+    )
+    service.save_activities(
+        mock_db, "1", "bookmarked", [fixtures.STATUS_THREE.copy()]
+    )
+
+    assert service.get_thread_status_ids(mock_db, "1") == [3, 1]
+    assert service.get_thread_status_ids(
+        mock_db, "1", sources=("statuses",)
+    ) == [1]
+
+    service.save_status_context(
+        mock_db, "1", {"ancestors": [], "descendants": []}
+    )
+
+    ttl = datetime.timedelta(hours=1)
+    assert service.get_thread_status_ids(mock_db, "1", ttl=ttl) == [3]
+    assert service.get_thread_status_ids(mock_db, "1") == [3, 1]
+
+
+def test_get_snowflake_id():
+    timestamp = datetime.datetime(
+        2021, 12, 20, 19, 46, 29, 73000, tzinfo=datetime.timezone.utc
+    )
+
+    snowflake_id = service.get_snowflake_id(timestamp)
+
+    assert snowflake_id & 0xFFFF == 0
+    assert service.get_snowflake_datetime(snowflake_id) == timestamp
+    assert service.get_snowflake_datetime(snowflake_id + 0xFFFF) == timestamp
+
+
+def test_get_status_partitions():
+    start = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+    end = datetime.datetime(2022, 1, 4, tzinfo=datetime.timezone.utc)
+
+    partitions = service.get_status_partitions(start, end, 3)
+
+    second = service.get_snowflake_id(start + datetime.timedelta(days=1))
+    third = service.get_snowflake_id(start + datetime.timedelta(days=2))
+    assert partitions == [
+        (None, str(second)),
+        (str(second - 1), str(third)),
+        (str(third - 1), None),
+    ]
+
+    for status_id in (second - 1, second, third):
+        windows = [
+            (since_id, max_id)
+            for since_id, max_id in partitions
+            if (since_id is None or status_id > int(since_id))
+            and (max_id is None or status_id < int(max_id))
+        ]
+        assert len(windows) == 1
+
+
+def test_get_statuses_backfill(mocker):
+    start = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+    status_ids = [
+        service.get_snowflake_id(start + datetime.timedelta(days=days)) + 1
+        for days in range(0, 400, 7)
+    ]
+
+    def accounts_statuses_page(account_id, max_id=None, since_id=None):
+        matches = sorted(
+            (
+                status_id
+                for status_id in status_ids
+                if (max_id is None or status_id < int(max_id))
+                and (since_id is None or status_id > int(since_id))
+            ),
+            reverse=True,
+        )[:5]
+        response = mocker.Mock()
+        response.json.return_value = [
+            {"id": str(status_id)} for status_id in matches
+        ]
+        return None, response
+
+    client = mocker.Mock()
+    client.accounts_statuses_page.side_effect = accounts_statuses_page
+
+    pages = list(
+        service.get_statuses_backfill(
+            "1", client, start=start, workers=3, partitions=7
+        )
+    )
+
+    fetched = [int(status["id"]) for page in pages for status in page]
+    assert sorted(fetched) == status_ids
+
+
+def test_save_statuses__updates_aggregates(mock_db):
+    service.save_statuses(
+        mock_db, [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()]
+    )
+    service.save_statuses(
+        mock_db, [fixtures.STATUS_ONE.copy(), fixtures.STATUS_THREE.copy()]
+    )
+
+    assert list(
+        mock_db["statuses_per_day"].rows_where(order_by="account_id")
+    ) == [
+        {"account_id": 1, "date": "2021-12-20", "count": 1},
+        {"account_id": 2, "date": "2021-12-20", "count": 2},
+    ]
+
+
+def test_save_activities__updates_aggregates(mock_db):
+    service.save_activities(
+        mock_db, "42", "favourited", [fixtures.STATUS_ONE.copy()]
+    )
+    service.save_activities(
+        mock_db,
+        "42",
+        "favourited",
+        [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()],
+    )
+    service.save_activities(
+        mock_db, "42", "bookmarked", [fixtures.STATUS_ONE.copy()]
+    )
+
+    rows = mock_db.execute(
+        "SELECT activity, author_id, month, count FROM activities_per_month"
+        " ORDER BY activity, author_id"
+    ).fetchall()
+    assert rows == [
+        ("bookmarked", 1, "2021-12", 1),
+        ("favourited", 1, "2021-12", 1),
+        ("favourited", 2, "2021-12", 1),
+    ]
+    assert mock_db["statuses_per_day"].count == 2
+
+
+def test_save_accounts__updates_aggregates(mock_db):
+    service.save_accounts(
+        mock_db,
+        [fixtures.ACCOUNT_TWO.copy()],
+        followed_id=fixtures.ACCOUNT_ONE["id"],
+    )
+    service.save_accounts(
+        mock_db,
+        [fixtures.ACCOUNT_TWO.copy()],
+        followed_id=fixtures.ACCOUNT_ONE["id"],
+    )
+
+    rows = list(mock_db["followers_per_day"].rows)
+    assert len(rows) == 1
+    assert rows[0]["account_id"] == 1
+    assert rows[0]["gained"] == 1
+
+
+def test_rebuild_aggregates(mock_db):
+    service.save_activities(
+        mock_db,
+        "42",
+        "favourited",
+        [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()],
+    )
+    service.save_accounts(
+        mock_db,
+        [fixtures.ACCOUNT_TWO.copy()],
+        followed_id=fixtures.ACCOUNT_ONE["id"],
+    )
+    tables = ("statuses_per_day", "activities_per_month", "followers_per_day")
+    before = {table: list(mock_db[table].rows) for table in tables}
+
+    mock_db.execute("UPDATE statuses_per_day SET count = 100")
+    service.rebuild_aggregates(mock_db)
+
+    assert {table: list(mock_db[table].rows) for table in tables} == before
+
+
+def test_get_plain_text():
+    html = (
+        '<p>Check <a href="https://adventure.time/" class="mention">'
+        '<span class="invisible">https://</span>adventure.time</a></p>'
+        "<p>Mathematical!<br />Algebraic! &amp; more</p>"
+    )
+
+    assert service.get_plain_text(html) == (
+        "Check https://adventure.time\n\nMathematical!\nAlgebraic! & more"
+    )
+    assert service.get_plain_text(None) is None
+
+
+def test_save_statuses__fts_indexes_plain_text(mock_db):
+    status = fixtures.STATUS_ONE.copy()
+    status["content"] = '<p class="piñata">Smash</p>'
+
+    service.save_statuses(mock_db, [status])
+
+    assert [row["id"] for row in mock_db["statuses"].search("Smash")] == [1]
+    assert list(mock_db["statuses"].search("class")) == []
+
+
+def test_build_database__migrates_content_text(mock_db):
+    mock_db["statuses"].create(
+        {"id": int, "account_id": int, "content": str, "created_at": str},
+        pk="id",
+    )
+    mock_db["statuses"].insert_all(
+        [
+            {"id": 1, "account_id": 1, "content": "<p>Smash</p>"},
+            {"id": 2, "account_id": 1, "content": None},
+        ]
+    )
+    mock_db["statuses"].enable_fts(
+        ["content"], create_triggers=True, tokenize="porter"
+    )
+
+    service.build_database(mock_db)
+
+    assert mock_db["statuses"].get(1)["content_text"] == "Smash"
+    assert mock_db["statuses"].get(2)["content_text"] is None
+    assert mock_db["statuses_fts"].columns_dict.keys() == {"content_text"}
+    assert service.get_fts_tokenize(mock_db, "statuses") == "porter"
+    assert [row["id"] for row in mock_db["statuses"].search("smashing")] == [1]
+
+
+def test_rebuild_statuses_fts(mock_db):
+    service.save_statuses(mock_db, [fixtures.STATUS_ONE.copy()])
+    assert service.get_fts_tokenize(mock_db, "statuses") is None
+
+    service.rebuild_statuses_fts(mock_db, tokenize="trigram")
+
+    assert service.get_fts_tokenize(mock_db, "statuses") == "trigram"
+    assert [row["id"] for row in mock_db["statuses"].search("anging")] == [1]
+
+
+def test_open_database__incremental_auto_vacuum(tmp_path):
+    db = service.open_database(tmp_path / "mastodon.db")
+    service.build_database(db)
+
+    assert db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_maintain_database(tmp_path):
+    db = service.open_database(tmp_path / "mastodon.db")
+    service.save_accounts(db, [fixtures.ACCOUNT_ONE.copy()])
+    service.save_statuses(
+        db, [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()]
+    )
+    db.execute("DELETE FROM statuses")
+    db.conn.commit()
+
+    report = service.maintain_database(db)
+
+    assert report["problems"] == []
+    assert report["size_after"] <= report["size_before"]
+    assert set(report["timings"]) == {
+        "analyze",
+        "optimize",
+        "statuses_fts optimize",
+        "accounts_fts optimize",
+        "incremental vacuum",
+        "integrity check",
+        "statuses_fts integrity check",
+        "accounts_fts integrity check",
+    }
+
+    report = service.maintain_database(db, fts_merge_pages=16, full_vacuum=True)
+    assert "vacuum" in report["timings"]
+
+
+def test_batch_writer(mocker):
+    save_func = mocker.Mock()
+
+    with service.BatchWriter(save_func, batch_size=3, flush_interval=None) as w:
+        w.add([{"id": 1}, {"id": 2}])
+        save_func.assert_not_called()
+
+        w.add([{"id": 3}, {"id": 4}])
+        save_func.assert_called_once_with(
+            [{"id": 1}, {"id": 2}, {"id": 3}, {"id": 4}]
+        )
+
+        w.add([{"id": 5}])
+
+    assert save_func.call_count == 2
+    save_func.assert_called_with([{"id": 5}])
+
+
+def test_batch_writer__flush_interval(mocker):
+    mock_monotonic = mocker.patch(
+        "mastodon_to_sqlite.service.time.monotonic", return_value=100.0
+    )
+    save_func = mocker.Mock()
+
+    writer = service.BatchWriter(save_func, batch_size=100, flush_interval=5)
+    writer.add([{"id": 1}])
+    save_func.assert_not_called()
+
+    mock_monotonic.return_value = 105.0
+    writer.add([{"id": 2}])
+    save_func.assert_called_once_with([{"id": 1}, {"id": 2}])
+
+
+def test_batch_writer__retries_locked_saves(mocker):
+    mocker.patch("mastodon_to_sqlite.service.time.sleep")
+    saved = []
+
+    def save_func(records):
+        for record in records:
+            record["saved"] = True
+        if not saved:
+            saved.append(None)
+            raise sqlite3.OperationalError("database is locked")
+        saved.extend(records)
+
+    with service.BatchWriter(save_func, flush_interval=None, attempts=2) as w:
+        w.add([{"id": 1}])
+
+    assert saved[1:] == [{"id": 1, "saved": True}]
+
+
+def test_batch_writer__one_transaction_per_flush(tmp_path):
+    db = service.open_database(str(tmp_path / "mastodon.db"))
+    service.build_database(db)
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+
+    with service.BatchWriter(
+        lambda statuses: service.save_statuses(db, statuses),
+        flush_interval=None,
+        db=db,
+    ) as writer:
+        writer.add(
+            {**fixtures.STATUS_ONE, "id": str(index)}
+            for index in range(1, 1_001)
+        )
+
+    assert [s for s in statements if s.startswith(("BEGIN", "COMMIT"))] == [
+        "BEGIN IMMEDIATE",
+        "COMMIT",
+    ]
+    assert db["statuses"].count == 1_000
+
+
+def test_batch_writer__rolls_back_failed_flush(tmp_path):
+    db = service.open_database(str(tmp_path / "mastodon.db"))
+    service.build_database(db)
+
+    def save_func(statuses):
+        service.save_statuses(db, statuses)
+        raise ValueError("Failed after saving")
+
+    with pytest.raises(ValueError):
+        with service.BatchWriter(save_func, flush_interval=None, db=db) as w:
+            w.add([fixtures.STATUS_ONE.copy()])
+
+    assert db["statuses"].count == 0
+    assert db["statuses_per_day"].count == 0
+
+
+def test_batch_writer__retries_locked_flush_after_upsert(mocker, tmp_path):
+    mocker.patch("mastodon_to_sqlite.service.time.sleep")
+    db = service.open_database(str(tmp_path / "mastodon.db"))
+    service.build_database(db)
+
+    increment_aggregate = service.increment_aggregate
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def locked_once(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        increment_aggregate(*args, **kwargs)
+
+    mocker.patch("mastodon_to_sqlite.service.increment_aggregate", locked_once)
+
+    with service.BatchWriter(
+        lambda statuses: service.save_statuses(db, statuses),
+        flush_interval=None,
+        attempts=2,
+        db=db,
+    ) as writer:
+        writer.add([fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()])
+
+    assert failures == []
+    assert db["statuses"].count == 2
+    assert db.execute("SELECT sum(count) FROM statuses_per_day").fetchone() == (
+        2,
+    )
+
+
+def test_batch_writer__waits_for_other_writer(tmp_path):
+    db_path = str(tmp_path / "mastodon.db")
+    db = service.open_database(db_path, busy_timeout=3)
+    service.build_database(db)
+
+    other = sqlite3.connect(
+        db_path, isolation_level=None, check_same_thread=False
+    )
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, other.rollback).start()
+
+    # The save reads before it writes, which fails at once without waiting
+    # for the busy timeout unless the transaction takes the write lock first.
+    with service.BatchWriter(
+        lambda statuses: service.save_statuses(db, statuses),
+        flush_interval=None,
+        db=db,
+    ) as writer:
+        writer.add([fixtures.STATUS_ONE.copy()])
+
+    assert db["statuses"].count == 1
+
+
+def test_open_database__busy_timeout(tmp_path):
+    db = service.open_database(str(tmp_path / "mastodon.db"), busy_timeout=2.5)
+
+    assert db.execute("PRAGMA busy_timeout").fetchone()[0] == 2500
+
+
+def test_retry_on_locked(tmp_path):
+    db_path = str(tmp_path / "mastodon.db")
+    db = service.open_database(db_path, busy_timeout=0)
+    db["statuses"].create({"id": int}, pk="id")
+
+    other = sqlite3.connect(
+        db_path, isolation_level=None, check_same_thread=False
+    )
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.2, other.rollback).start()
+
+    def save():
+        with db.conn:
+            db["statuses"].insert({"id": 1})
+
+    with pytest.raises(sqlite3.OperationalError):
+        service.retry_on_locked(save, attempts=1)
+
+    service.retry_on_locked(save, attempts=10, delay=0.05)
+    assert db["statuses"].count == 1
+
+
+def test_retry_on_locked__other_errors(mocker):
+    func = mocker.Mock(side_effect=sqlite3.OperationalError("no such table"))
+
+    with pytest.raises(sqlite3.OperationalError):
+        service.retry_on_locked(func, attempts=3, delay=0)
+
+    assert func.call_count == 1
+
+
+def test_database_lock(tmp_path):
+    db_path = str(tmp_path / "mastodon.db")
+
+    with service.DatabaseLock(db_path) as lock:
+        assert lock.wait_time < 1
+
+        with pytest.raises(TimeoutError):
+            service.DatabaseLock(db_path, timeout=0.2).acquire()
+
+    with service.DatabaseLock(db_path, timeout=0.2) as lock:
+        assert lock.file_obj is not None
+
+
+def test_get_epoch():
+    assert service.get_epoch("2021-12-20T19:46:29.073Z") == 1640029589
+    assert service.get_epoch("2021-12-20T21:46:29+02:00") == 1640029589
+    assert service.get_epoch(None) is None
+
+
+def test_transformer_status__created_at_epoch_from_id():
+    status = fixtures.STATUS_ONE.copy()
+    del status["created_at"]
+    status["id"] = str(1640029589073 << 16)
+
+    service.transformer_status(status)
+
+    assert status["created_at_epoch"] == 1640029589
+
+
+def test_build_database__migrates_epochs(mock_db):
+    mock_db["statuses"].create(
+        {"id": int, "account_id": int, "content": str, "created_at": str},
+        pk="id",
+    )
+    mock_db["statuses"].insert_all(
+        [
+            {"id": 1, "created_at": "2021-12-20T19:46:29.073Z"},
+            {"id": 1640029589073 << 16, "created_at": None},
+            {"id": 3, "created_at": "2021-12-20T21:46:29.073Z"},
+        ]
+    )
+    mock_db["following"].create(
+        {"followed_id": int, "follower_id": int, "first_seen": str},
+        pk=("followed_id", "follower_id"),
+    )
+    mock_db["following"].insert(
+        {
+            "followed_id": 1,
+            "follower_id": 2,
+            "first_seen": "2021-12-20T19:46:29.073000+00:00",
+        }
+    )
+
+    service.migrate_statuses_created_at_epoch(mock_db, chunk_size=2)
+    service.build_database(mock_db)
+
+    assert [
+        row["created_at_epoch"]
+        for row in mock_db["statuses"].rows_where(order_by="rowid")
+    ] == [1640029589, 1640036789, 1640029589]
+    assert next(mock_db["following"].rows)["first_seen_epoch"] == 1640029589
+    assert ("created_at_epoch",) in {
+        tuple(index.columns) for index in mock_db["statuses"].indexes
+    }
+
+
+def test_build_database__migrates_following_direction(mock_db):
+    mock_db["following"].create(
+        {"followed_id": int, "follower_id": int, "first_seen": str},
+        pk=("followed_id", "follower_id"),
+    )
+    # A mutual follow, saved inverted by the old followers and followings
+    # commands, and an account only followed by account 1.
+    mock_db["following"].insert_all(
+        [
+            {"followed_id": 1, "follower_id": 2, "first_seen": "2022-01-01"},
+            {"followed_id": 2, "follower_id": 1, "first_seen": "2022-01-02"},
+            {"followed_id": 1, "follower_id": 3, "first_seen": "2022-01-03"},
+        ]
+    )
+
+    service.build_database(mock_db)
+    service.build_database(mock_db)
+
+    assert [
+        (row["followed_id"], row["follower_id"], row["first_seen"])
+        for row in mock_db["following"].rows_where(order_by="first_seen")
+    ] == [(2, 1, "2022-01-01"), (1, 2, "2022-01-02"), (3, 1, "2022-01-03")]
+    assert [
+        (row["account_id"], row["gained"])
+        for row in mock_db["followers_per_day"].rows_where(order_by="date")
+    ] == [(2, 1), (1, 1), (3, 1)]
+
+
+def test_build_database__new_following_not_migrated(mock_db):
+    service.build_database(mock_db)
+    service.save_accounts(
+        mock_db,
+        [fixtures.ACCOUNT_TWO.copy()],
+        followed_id=fixtures.ACCOUNT_ONE["id"],
+    )
+    service.build_database(mock_db)
+
+    row = next(mock_db["following"].rows)
+    assert (row["followed_id"], row["follower_id"]) == (1, 2)
+
+
+def test_save_statuses__without_created_at(mock_db):
+    status = fixtures.STATUS_ONE.copy()
+    status["id"] = str(1640995200000 << 16)
+    del status["created_at"]
+
+    service.save_statuses(mock_db, [status])
+    service.save_activity_status_ids(
+        mock_db, "42", "favourited", [str(1640995200000 << 16)]
+    )
+
+    assert next(mock_db["statuses_per_day"].rows)["date"] == "2022-01-01"
+    assert next(mock_db["activities_per_month"].rows)["month"] == "2022-01"
+
+
+def test_get_most_recent_status_id__uses_index(mock_db):
+    service.build_database(mock_db)
+
+    plan = mock_db.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM statuses"
+        " ORDER BY created_at_epoch DESC, id DESC LIMIT 1"
+    ).fetchall()
+
+    assert "INDEX idx_statuses_created_at_epoch" in plan[0][-1]
+    assert "TEMP B-TREE" not in " ".join(row[-1] for row in plan)
+
+
+def test_get_sync_plan(mock_db):
+    account = {
+        "id": "1",
+        "statuses_count": 100,
+        "followers_count": 200,
+        "following_count": 50,
+    }
+
+    plan = service.get_sync_plan(mock_db, account)
+
+    assert [(step.action, step.estimated_requests) for step in plan] == [
+        ("full", 4),
+        ("full", 4),
+        ("full", 2),
+    ]
+
+    service.save_statuses(mock_db, [fixtures.STATUS_ONE.copy()])
+    for step in plan:
+        service.save_sync_state(mock_db, "1", step.endpoint, step.remote_count)
+
+    account["statuses_count"] = 102
+    account["followers_count"] = 201
+    plan = service.get_sync_plan(mock_db, account)
+
+    assert [(step.action, step.estimated_requests) for step in plan] == [
+        ("incremental", 2),
+        ("full", 4),
+        ("skip", 0),
+    ]
+
+
+def test_estimate_rate_limit_wait():
+    assert service.estimate_rate_limit_wait(300) == 0
+    assert service.estimate_rate_limit_wait(301) == 300
+    assert service.estimate_rate_limit_wait(900) == 600
+
+
+def test_get_dangling_account_ids(mock_db):
+    service.save_accounts(mock_db, [fixtures.ACCOUNT_ONE.copy()])
+    service.save_statuses(
+        mock_db, [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()]
+    )
+    service.save_activities(
+        mock_db, "3", "favourited", [fixtures.STATUS_TWO.copy()]
+    )
+
+    assert service.get_dangling_account_ids(mock_db) == ["2", "3"]
+
+
+def test_backfill_accounts__falls_back_to_single_fetches(mock_db, mocker):
+    service.save_statuses(
+        mock_db, [fixtures.STATUS_ONE.copy(), fixtures.STATUS_TWO.copy()]
+    )
+
+    def get_account(account_id):
+        if account_id == "1":
+            return None, mocker.Mock(
+                status_code=200, json=lambda: fixtures.ACCOUNT_ONE.copy()
+            )
+        return None, mocker.Mock(status_code=404)
+
+    client = mocker.Mock()
+    client.accounts.return_value = None, mocker.Mock(status_code=404)
+    client.account.side_effect = get_account
+
+    counts = service.backfill_accounts(mock_db, client, batch_size=1)
+
+    assert counts == {"missing": 2, "saved": 1}
+    assert client.accounts.call_count == 1
+    assert [row["id"] for row in mock_db["accounts"].rows] == [1]
+    assert service.get_dangling_account_ids(mock_db) == ["2"]
+
+
+def test_get_notifications__oldest_first(mocker):
+    pages = [
+        (None, mocker.Mock(json=lambda: [{"id": "11"}, {"id": "10"}])),
+        (None, mocker.Mock(json=lambda: [])),
+        (None, mocker.Mock(json=lambda: [{"id": "9"}])),
+    ]
+    client = mocker.Mock()
+    client.notifications.return_value = iter(pages)
+
+    result = list(service.get_notifications(client, min_id="9"))
+
+    assert result == [[{"id": "10"}, {"id": "11"}]]
+    client.notifications.assert_called_once_with(min_id="9")
+
+
+def test_save_notifications(mock_db):
+    service.save_notifications(
+        mock_db,
+        "1",
+        [
+            copy.deepcopy(fixtures.NOTIFICATION_ONE),
+            copy.deepcopy(fixtures.NOTIFICATION_TWO),
+        ],
+    )
+
+    assert [
+        (row["id"], row["type"], row["account_id"], row["status_id"])
+        for row in mock_db["notifications"].rows
+    ] == [(10, "favourite", 2, 1), (11, "follow", 2, None)]
+    assert mock_db["statuses"].count == 1
+    assert service.get_dangling_account_ids(mock_db) == []
+
+
+def test_save_home_timeline(mock_db):
+    service.save_home_timeline(
+        mock_db,
+        "1",
+        [
+            copy.deepcopy(fixtures.STATUS_ONE),
+            copy.deepcopy(fixtures.STATUS_TWO),
+        ],
+    )
+    service.save_import_cursor(mock_db, "1", "home", "2")
+
+    assert mock_db["home_timeline"].count == 2
+    assert service.get_import_cursor(mock_db, "1", "home") == "2"
+    assert service.get_import_cursor(mock_db, "1", "notifications") is None
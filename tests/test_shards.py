@@ -0,0 +1,210 @@
+import datetime
+
+import pytest
+
+from mastodon_to_sqlite import service, shards
+
+from . import fixtures
+
+
+def get_statuses():
+    return [
+        fixtures.STATUS_ONE.copy(),
+        fixtures.STATUS_TWO.copy(),
+        {**fixtures.STATUS_THREE, "created_at": "2022-01-01T00:00:00.000Z"},
+    ]
+
+
+@pytest.fixture
+def catalog_db(tmp_path):
+    db = service.open_database(str(tmp_path / "mastodon.db"))
+    shards.create_catalog(db, "year")
+    return db
+
+
+def test_get_shard_key():
+    status = fixtures.STATUS_ONE.copy()
+    assert shards.get_shard_key(status, "year") == "2021"
+    assert shards.get_shard_key(status, "month") == "2021-12"
+
+    del status["created_at"]
+    status["id"] = str(1640995200000 << 16)
+    assert shards.get_shard_key(status, "month") == "2022-01"
+
+
+def test_save_statuses(catalog_db, tmp_path):
+    shards.save_statuses(catalog_db, get_statuses())
+    shards.save_activities(
+        catalog_db, "1", "favourited", [fixtures.STATUS_ONE.copy()]
+    )
+
+    assert [shard["key"] for shard in shards.get_shards(catalog_db)] == [
+        "2021",
+        "2022",
+    ]
+    assert catalog_db["statuses"].count == 0
+
+    shard_db = service.open_database(str(tmp_path / "mastodon-2021.db"))
+    assert [row["id"] for row in shard_db["statuses"].rows] == [1, 2]
+    assert shard_db["status_activities"].count == 1
+    assert shards.get_most_recent_status_id(catalog_db) == 3
+
+
+def test_attach_shards(catalog_db):
+    shards.save_statuses(catalog_db, get_statuses())
+    service.save_statuses(
+        catalog_db, [{**fixtures.STATUS_ONE, "id": "4", "content": "Smash"}]
+    )
+
+    shards.attach_shards(catalog_db)
+
+    assert [
+        row[0]
+        for row in catalog_db.execute("SELECT id FROM statuses ORDER BY id")
+    ] == [1, 2, 3, 4]
+    assert catalog_db.execute(
+        "SELECT sum(count) FROM statuses_per_day"
+    ).fetchone() == (4,)
+    assert [
+        row[0]
+        for row in catalog_db.execute(
+            "SELECT rowid FROM statuses_fts WHERE content_text MATCH 'smash'"
+            " ORDER BY rowid"
+        )
+    ] == [1, 4]
+
+
+def test_split_database(tmp_path):
+    db = service.open_database(str(tmp_path / "mastodon.db"))
+    service.save_statuses(db, get_statuses())
+    service.save_activities(db, "1", "bookmarked", [fixtures.STATUS_TWO.copy()])
+    # An activity on a status that isn't saved is sharded by the status ID.
+    db["status_activities"].insert(
+        {
+            "account_id": 1,
+            "activity": "favourited",
+            "status_id": 1640995200000 << 16,
+        }
+    )
+
+    shards.create_catalog(db, "year")
+    moved = shards.split_database(db)
+
+    assert moved == {
+        "2021": {"statuses": 2, "status_activities": 1},
+        "2022": {"statuses": 1, "status_activities": 1},
+    }
+    assert db["statuses"].count == 0
+    assert db["statuses_per_day"].count == 0
+
+    shard_db = service.open_database(str(tmp_path / "mastodon-2022.db"))
+    assert next(shard_db["statuses_per_day"].rows)["count"] == 1
+    assert shard_db["statuses_fts"].count == 1
+
+    assert shards.split_database(db) == {}
+
+
+def test_freeze_shard(catalog_db):
+    shards.save_statuses(catalog_db, get_statuses())
+
+    report = shards.freeze_shard(catalog_db, "2021")
+    assert report["problems"] == []
+
+    with pytest.raises(shards.ShardError):
+        shards.save_statuses(catalog_db, [fixtures.STATUS_ONE.copy()])
+
+    shards.attach_shards(catalog_db)
+    with pytest.raises(Exception, match="readonly"):
+        catalog_db.execute("DELETE FROM shard_2021.statuses")
+
+    with pytest.raises(shards.ShardError):
+        shards.freeze_shard(catalog_db, "2020")
+
+
+def test_create_catalog__other_period(catalog_db):
+    with pytest.raises(shards.ShardError):
+        shards.create_catalog(catalog_db, "month")
+
+
+def test_create_catalog__month_attach_limit(mocker, tmp_path):
+    db = service.open_database(str(tmp_path / "mastodon.db"))
+    mock_limit = mocker.patch(
+        "mastodon_to_sqlite.shards.raise_attach_limit", return_value=10
+    )
+
+    with pytest.raises(shards.ShardError):
+        shards.create_catalog(db, "month")
+
+    mock_limit.return_value = 125
+    shards.create_catalog(db, "month")
+    assert shards.get_shard_period(db) == "month"
+
+
+def test_attach_shards__attach_limit(catalog_db, mocker):
+    shards.save_statuses(catalog_db, get_statuses())
+    mocker.patch("mastodon_to_sqlite.shards.raise_attach_limit", return_value=1)
+
+    with pytest.raises(shards.ShardError, match="2 shards"):
+        shards.attach_shards(catalog_db)
+
+
+def test_save_home_timeline_and_threads(catalog_db):
+    service.save_accounts(catalog_db, [fixtures.ACCOUNT_ONE.copy()])
+    shards.save_home_timeline(catalog_db, "1", [fixtures.STATUS_ONE.copy()])
+    shards.save_status_context(
+        catalog_db,
+        "1",
+        {"ancestors": [], "descendants": [get_statuses()[2]]},
+    )
+    saved = shards.save_activity_status_ids(
+        catalog_db, "1", "bookmarked", ["1", "3", "4"]
+    )
+
+    assert catalog_db["statuses"].count == 0
+    assert catalog_db["home_timeline"].count == 1
+    assert catalog_db["status_context"].count == 1
+    assert [shard["key"] for shard in shards.get_shards(catalog_db)] == [
+        "2021",
+        "2022",
+    ]
+    assert saved == 2
+
+    assert shards.get_thread_status_ids(catalog_db, "1") == [3, 1]
+    # Both statuses were part of the thread fetched for status 1.
+    assert (
+        shards.get_thread_status_ids(
+            catalog_db, "1", ttl=datetime.timedelta(hours=1)
+        )
+        == []
+    )
+
+
+def test_sync_plan_and_dangling_accounts(catalog_db):
+    shards.save_statuses(catalog_db, get_statuses())
+    service.save_accounts(catalog_db, [fixtures.ACCOUNT_TWO.copy()])
+    service.save_sync_state(catalog_db, "2", "statuses", 2)
+
+    assert shards.count_account_statuses(catalog_db, "2") == 2
+    plan = service.get_sync_plan(
+        catalog_db, {**fixtures.ACCOUNT_TWO, "statuses_count": 2}
+    )
+    assert (plan[0].endpoint, plan[0].action) == ("statuses", "skip")
+
+    assert shards.get_dangling_account_ids(catalog_db) == ["1"]
+
+
+def test_export_and_compress(catalog_db, tmp_path):
+    from mastodon_to_sqlite import export
+
+    shards.save_statuses(catalog_db, get_statuses())
+    service.save_statuses(
+        catalog_db, [{**fixtures.STATUS_ONE, "id": "4", "content": "Smash"}]
+    )
+
+    counts = export.export_database(
+        catalog_db, tmp_path / "export", "ndjson", tables=["statuses"]
+    )
+    assert counts == {"statuses": 4}
+
+    with pytest.raises(shards.ShardError):
+        service.set_content_codec(catalog_db, "zlib")
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+# The cumulative import time budget for the CLI, in milliseconds. It can be
+# raised on slow machines with the environment variable.
+IMPORT_TIME_BUDGET_MS = int(
+    os.environ.get("MASTODON_TO_SQLITE_IMPORT_TIME_BUDGET_MS", "150")
+)
+
+HEAVY_MODULES = ("sqlite_utils", "requests", "pyarrow", "zstandard")
+
+
+def get_import_times(*args: str) -> Dict[str, int]:
+    """
+    Run the CLI with the arguments in a fresh interpreter with
+    ``python -X importtime``, returning the cumulative import time in
+    microseconds of every module it imported.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "import sys; from mastodon_to_sqlite.cli import cli;"
+            " cli(sys.argv[1:])",
+            *args,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        _, cumulative, module = line.split("|")
+        import_times[module.strip()] = int(cumulative)
+
+    return import_times
+
+
+@pytest.mark.parametrize(
+    "args",
+    (
+        ("--help",),
+        ("verify-auth", "--help"),
+        ("statuses", "--help"),
+    ),
+)
+def test_cli_startup(args):
+    import_times = get_import_times(*args)
+
+    heavy_modules = [
+        module
+        for module in import_times
+        if module.split(".")[0] in HEAVY_MODULES
+    ]
+    assert heavy_modules == []
+
+    cli_import_ms = import_times["mastodon_to_sqlite.cli"] / 1000
+    assert cli_import_ms < IMPORT_TIME_BUDGET_MS